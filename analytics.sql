@@ -0,0 +1,260 @@
+-- Historical analytics, refreshed incrementally by refresh_ship_analytics().
+-- Runs after init_db.sql on a new database, and can be applied again to an existing one.
+-- Times are UTC like the source tables; the berthing date is the Taiwan date.
+
+-- Per-voyage ETA accuracy and berth times
+CREATE TABLE IF NOT EXISTS voyage_analytics (
+    ship_voyage_number VARCHAR(10) PRIMARY KEY,
+    berth_number VARCHAR(10),
+    captain_eta_first TIMESTAMP,          -- 船長報告ETA, first and last report before berthing
+    captain_eta_last TIMESTAMP,
+    captain_eta_reports INTEGER,
+    forecast_eta_first TIMESTAMP,         -- 修改進港預報, first and last forecast before berthing
+    forecast_eta_last TIMESTAMP,
+    forecast_eta_reports INTEGER,
+    arrival_time TIMESTAMP,               -- passing 5 nm (or 10 nm): the ship reaches the anchorage
+    inbound_pilot_time TIMESTAMP,         -- 引水人上船時間 (進港): the anchor wait ends
+    berthed_at TIMESTAMP,                 -- 實際靠妥時間
+    departed_at TIMESTAMP,                -- 離開泊地時間
+    berthing_date DATE,
+    captain_eta_error_minutes NUMERIC(10, 1),   -- berthed_at - ETA, positive when the ship was late
+    forecast_eta_error_minutes NUMERIC(10, 1),
+    anchor_wait_minutes NUMERIC(10, 1),         -- proxy for the time 錨泊中, see refresh_ship_analytics()
+    turnaround_minutes NUMERIC(10, 1),          -- from berthing to leaving the berth
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS voyage_analytics_berth_date_idx ON voyage_analytics (berth_number, berthing_date);
+CREATE INDEX IF NOT EXISTS voyage_analytics_berthed_at_idx ON voyage_analytics (berthed_at);
+
+-- Per-berth daily waiting and turnaround, by Taiwan berthing date
+CREATE TABLE IF NOT EXISTS berth_daily_analytics (
+    berth_number VARCHAR(10),
+    berthing_date DATE,
+    voyages INTEGER,
+    anchor_wait_avg_minutes NUMERIC(10, 1),
+    anchor_wait_p50_minutes NUMERIC(10, 1),
+    anchor_wait_p90_minutes NUMERIC(10, 1),
+    anchor_wait_max_minutes NUMERIC(10, 1),
+    turnaround_avg_minutes NUMERIC(10, 1),
+    turnaround_p50_minutes NUMERIC(10, 1),
+    turnaround_max_minutes NUMERIC(10, 1),
+    captain_eta_abs_error_avg_minutes NUMERIC(10, 1),
+    forecast_eta_abs_error_avg_minutes NUMERIC(10, 1),
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (berth_number, berthing_date)
+);
+
+CREATE INDEX IF NOT EXISTS berth_daily_analytics_date_idx ON berth_daily_analytics (berthing_date);
+
+-- Source indexes: the events of one voyage, and the voyages updated since the last refresh
+CREATE INDEX IF NOT EXISTS ship_events_voyage_name_idx ON ship_events (ship_voyage_number, event_name);
+CREATE INDEX IF NOT EXISTS ship_voyage_updated_at_idx ON ship_voyage (updated_at);
+
+-- Progress of the refresh: the last event id and ship_voyage update processed
+CREATE TABLE IF NOT EXISTS analytics_watermark (
+    name VARCHAR(50) PRIMARY KEY,
+    last_event_id INTEGER NOT NULL DEFAULT 0,
+    last_voyage_update TIMESTAMP NOT NULL DEFAULT '1970-01-01',
+    refreshed_at TIMESTAMP
+);
+
+-- Voyages whose existing events changed; new events are found by id instead
+CREATE TABLE IF NOT EXISTS analytics_dirty_voyages (
+    ship_voyage_number VARCHAR(10) PRIMARY KEY
+);
+
+CREATE OR REPLACE FUNCTION mark_analytics_dirty()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO analytics_dirty_voyages (ship_voyage_number) VALUES (NEW.ship_voyage_number)
+    ON CONFLICT (ship_voyage_number) DO NOTHING;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS mark_ship_events_analytics_dirty ON ship_events;
+CREATE TRIGGER mark_ship_events_analytics_dirty
+AFTER UPDATE ON ship_events
+FOR EACH ROW
+WHEN (OLD.event_content_time IS DISTINCT FROM NEW.event_content_time OR OLD.berth_number IS DISTINCT FROM NEW.berth_number)
+EXECUTE FUNCTION mark_analytics_dirty();
+
+-- Recomputes the analytics of the voyages with new or changed events or passage times
+-- since the last call, then the berth days they belong to (before and after).
+-- Returns the number of voyages refreshed.
+CREATE OR REPLACE FUNCTION refresh_ship_analytics()
+RETURNS INTEGER AS $$
+DECLARE
+    wm_event_id INTEGER;
+    wm_voyage_update TIMESTAMP;
+    max_event_id INTEGER;
+    max_voyage_update TIMESTAMP;
+    voyages VARCHAR[];
+    berths VARCHAR[];
+    days DATE[];
+BEGIN
+    INSERT INTO analytics_watermark (name) VALUES ('ship_analytics') ON CONFLICT (name) DO NOTHING;
+    -- Locking the watermark makes concurrent refreshes run one after the other
+    SELECT w.last_event_id, w.last_voyage_update INTO wm_event_id, wm_voyage_update
+    FROM analytics_watermark w
+    WHERE w.name = 'ship_analytics'
+    FOR UPDATE;
+
+    -- The strict se.id > wm_event_id watermark below is only race-free because the crawler
+    -- (the only writer of ship_events) runs this refresh in its 'analytics' stage, which
+    -- crawler/main.py starts after the 'ship_events' stage has committed. An insert still
+    -- in flight here could commit later with an id below max_event_id, and be skipped.
+    SELECT COALESCE(MAX(se.id), wm_event_id) INTO max_event_id FROM ship_events se;
+    SELECT COALESCE(MAX(sv.updated_at), wm_voyage_update) INTO max_voyage_update FROM ship_voyage sv;
+
+    WITH dirty AS (
+        DELETE FROM analytics_dirty_voyages RETURNING ship_voyage_number
+    )
+    SELECT ARRAY(
+        SELECT se.ship_voyage_number FROM ship_events se
+        WHERE se.id > wm_event_id AND se.id <= max_event_id
+            AND se.event_name IN ('船長報告ETA', '修改進港預報', '引水人上船時間', '實際靠妥時間', '離開泊地時間')
+        UNION
+        SELECT sv.ship_voyage_number FROM ship_voyage sv
+        WHERE sv.updated_at > wm_voyage_update AND sv.updated_at <= max_voyage_update
+        UNION
+        SELECT d.ship_voyage_number FROM dirty d
+    ) INTO voyages;
+
+    WITH computed AS (
+        SELECT
+            v.ship_voyage_number,
+            COALESCE(b.berth_number, lb.berth_number) AS berth_number,
+            eta.captain_eta_first,
+            eta.captain_eta_last,
+            eta.captain_eta_reports,
+            eta.forecast_eta_first,
+            eta.forecast_eta_last,
+            eta.forecast_eta_reports,
+            COALESCE(sv.pass_5_miles_time, sv.pass_10_miles_time) AS arrival_time,
+            t.inbound_pilot_time,
+            b.berthed_at,
+            t.departed_at,
+            (b.berthed_at + INTERVAL '8 hours')::date AS berthing_date,
+            ROUND((EXTRACT(EPOCH FROM b.berthed_at - eta.captain_eta_last) / 60)::numeric, 1) AS captain_eta_error_minutes,
+            ROUND((EXTRACT(EPOCH FROM b.berthed_at - eta.forecast_eta_last) / 60)::numeric, 1) AS forecast_eta_error_minutes,
+            -- A proxy for the time spent 錨泊中: the ship grid only flags that stage, without a time,
+            -- so the wait runs from passing 5 nm (or 10 nm) to the inbound pilot boarding
+            CASE WHEN t.inbound_pilot_time >= COALESCE(sv.pass_5_miles_time, sv.pass_10_miles_time) THEN
+                ROUND((EXTRACT(EPOCH FROM t.inbound_pilot_time - COALESCE(sv.pass_5_miles_time, sv.pass_10_miles_time)) / 60)::numeric, 1)
+            END AS anchor_wait_minutes,
+            CASE WHEN t.departed_at >= b.berthed_at THEN
+                ROUND((EXTRACT(EPOCH FROM t.departed_at - b.berthed_at) / 60)::numeric, 1)
+            END AS turnaround_minutes
+        FROM unnest(voyages) AS v(ship_voyage_number)
+        LEFT JOIN ship_voyage sv ON sv.ship_voyage_number = v.ship_voyage_number
+        -- The first berthing and its berth
+        LEFT JOIN LATERAL (
+            SELECT COALESCE(se.event_content_time, se.event_time) AS berthed_at, NULLIF(se.berth_number, '') AS berth_number
+            FROM ship_events se
+            WHERE se.ship_voyage_number = v.ship_voyage_number AND se.event_name = '實際靠妥時間'
+            ORDER BY COALESCE(se.event_content_time, se.event_time)
+            LIMIT 1
+        ) b ON TRUE
+        -- Otherwise the berth of the latest event naming one
+        LEFT JOIN LATERAL (
+            SELECT se.berth_number
+            FROM ship_events se
+            WHERE se.ship_voyage_number = v.ship_voyage_number AND NULLIF(se.berth_number, '') IS NOT NULL
+            ORDER BY se.event_time DESC
+            LIMIT 1
+        ) lb ON b.berth_number IS NULL
+        LEFT JOIN LATERAL (
+            SELECT
+                (array_agg(se.event_content_time ORDER BY se.event_time) FILTER (WHERE se.event_name = '船長報告ETA'))[1] AS captain_eta_first,
+                (array_agg(se.event_content_time ORDER BY se.event_time DESC) FILTER (WHERE se.event_name = '船長報告ETA'))[1] AS captain_eta_last,
+                COUNT(*) FILTER (WHERE se.event_name = '船長報告ETA') AS captain_eta_reports,
+                (array_agg(se.event_content_time ORDER BY se.event_time) FILTER (WHERE se.event_name = '修改進港預報'))[1] AS forecast_eta_first,
+                (array_agg(se.event_content_time ORDER BY se.event_time DESC) FILTER (WHERE se.event_name = '修改進港預報'))[1] AS forecast_eta_last,
+                COUNT(*) FILTER (WHERE se.event_name = '修改進港預報') AS forecast_eta_reports
+            FROM ship_events se
+            WHERE se.ship_voyage_number = v.ship_voyage_number
+                AND se.event_name IN ('船長報告ETA', '修改進港預報')
+                AND se.event_content_time IS NOT NULL
+                AND (b.berthed_at IS NULL OR se.event_time <= b.berthed_at)
+        ) eta ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT
+                MIN(COALESCE(se.event_content_time, se.event_time)) FILTER (WHERE se.event_name = '引水人上船時間' AND se.navigation_status = '進港') AS inbound_pilot_time,
+                MAX(COALESCE(se.event_content_time, se.event_time)) FILTER (WHERE se.event_name = '離開泊地時間') AS departed_at
+            FROM ship_events se
+            WHERE se.ship_voyage_number = v.ship_voyage_number
+                AND se.event_name IN ('引水人上船時間', '離開泊地時間')
+        ) t ON TRUE
+    ),
+    previous AS (
+        SELECT va.berth_number, va.berthing_date
+        FROM voyage_analytics va
+        WHERE va.ship_voyage_number = ANY(voyages)
+    ),
+    upserted AS (
+        INSERT INTO voyage_analytics AS va (
+            ship_voyage_number, berth_number, captain_eta_first, captain_eta_last, captain_eta_reports,
+            forecast_eta_first, forecast_eta_last, forecast_eta_reports, arrival_time, inbound_pilot_time,
+            berthed_at, departed_at, berthing_date, captain_eta_error_minutes, forecast_eta_error_minutes,
+            anchor_wait_minutes, turnaround_minutes
+        )
+        SELECT * FROM computed
+        ON CONFLICT (ship_voyage_number) DO UPDATE SET
+            berth_number = EXCLUDED.berth_number,
+            captain_eta_first = EXCLUDED.captain_eta_first,
+            captain_eta_last = EXCLUDED.captain_eta_last,
+            captain_eta_reports = EXCLUDED.captain_eta_reports,
+            forecast_eta_first = EXCLUDED.forecast_eta_first,
+            forecast_eta_last = EXCLUDED.forecast_eta_last,
+            forecast_eta_reports = EXCLUDED.forecast_eta_reports,
+            arrival_time = EXCLUDED.arrival_time,
+            inbound_pilot_time = EXCLUDED.inbound_pilot_time,
+            berthed_at = EXCLUDED.berthed_at,
+            departed_at = EXCLUDED.departed_at,
+            berthing_date = EXCLUDED.berthing_date,
+            captain_eta_error_minutes = EXCLUDED.captain_eta_error_minutes,
+            forecast_eta_error_minutes = EXCLUDED.forecast_eta_error_minutes,
+            anchor_wait_minutes = EXCLUDED.anchor_wait_minutes,
+            turnaround_minutes = EXCLUDED.turnaround_minutes,
+            refreshed_at = CURRENT_TIMESTAMP
+        RETURNING va.berth_number, va.berthing_date
+    )
+    SELECT array_agg(k.berth_number), array_agg(k.berthing_date) INTO berths, days
+    FROM (SELECT * FROM previous UNION SELECT * FROM upserted) k
+    WHERE k.berth_number IS NOT NULL AND k.berthing_date IS NOT NULL;
+
+    DELETE FROM berth_daily_analytics bd
+    WHERE (bd.berth_number, bd.berthing_date) IN (SELECT * FROM unnest(berths, days));
+
+    INSERT INTO berth_daily_analytics (
+        berth_number, berthing_date, voyages,
+        anchor_wait_avg_minutes, anchor_wait_p50_minutes, anchor_wait_p90_minutes, anchor_wait_max_minutes,
+        turnaround_avg_minutes, turnaround_p50_minutes, turnaround_max_minutes,
+        captain_eta_abs_error_avg_minutes, forecast_eta_abs_error_avg_minutes
+    )
+    SELECT
+        va.berth_number,
+        va.berthing_date,
+        COUNT(*),
+        AVG(va.anchor_wait_minutes),
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY va.anchor_wait_minutes),
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY va.anchor_wait_minutes),
+        MAX(va.anchor_wait_minutes),
+        AVG(va.turnaround_minutes),
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY va.turnaround_minutes),
+        MAX(va.turnaround_minutes),
+        AVG(ABS(va.captain_eta_error_minutes)),
+        AVG(ABS(va.forecast_eta_error_minutes))
+    FROM voyage_analytics va
+    WHERE (va.berth_number, va.berthing_date) IN (SELECT * FROM unnest(berths, days))
+    GROUP BY va.berth_number, va.berthing_date;
+
+    UPDATE analytics_watermark
+    SET last_event_id = max_event_id, last_voyage_update = max_voyage_update, refreshed_at = CURRENT_TIMESTAMP
+    WHERE name = 'ship_analytics';
+
+    RETURN COALESCE(array_length(voyages, 1), 0);
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,155 @@
+"""
+Measures the API's response latency under concurrent clients.
+
+The tables are created and seeded in a scratch database (dropped afterwards) next to
+POSTGRES_DB. The API runs in-process with its refresh loop, and every client thread
+sends requests over its own keep-alive connection: a mix of the ship, timeline, ETA
+and berth queue endpoints, a third of them revalidated with If-None-Match. Run from
+the api directory with the usual POSTGRES_* variables:
+
+    POSTGRES_HOST=localhost python -m benchmarks.bench_queries --ships 3000 --clients 32 --duration 20
+"""
+import argparse
+import http.client
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List
+
+from psycopg2.extras import execute_values
+
+import main as api
+
+BENCH_DB = 'portcdm_bench_api'
+INIT_SQL = Path(__file__).resolve().parent.parent.parent / 'init_db.sql'
+
+EVENT_NAMES = ["修改進港預報", "修改出港預報", "船長報告ETA", "引水人上船時間", "實際靠妥時間", "離開泊地時間"]
+BERTHS = ["1042", "1043", "1120", "1121", "1070", "1075", "1108", "1115"]
+
+
+def seed(conn, ships: int, events: int, rng: random.Random) -> List[str]:
+    now = datetime.utcnow()
+    voyages, status_rows, voyage_rows, event_rows, berth_rows = [], [], [], [], []
+    for i in range(ships):
+        voyage_number = f"{100000 + i:06d}{i % 10000:04d}"
+        voyages.append(voyage_number)
+        status_rows.append((voyage_number, f"船{i} SHIP {i}", rng.choice(EVENT_NAMES)))
+        voyage_rows.append((voyage_number, now - timedelta(hours=2), now - timedelta(hours=1)))
+        for n in range(events):
+            event_time = now - timedelta(minutes=(events - n) * 10)
+            event_rows.append((voyage_number, 'seed', event_time, rng.choice(EVENT_NAMES), '進港', f"{n:08d}",
+                               rng.choice(BERTHS), event_time + timedelta(hours=6)))
+        if rng.random() < 0.3:
+            berth_rows.append((rng.choice(BERTHS), None, '進港', now + timedelta(minutes=rng.randint(0, 2000)),
+                               f"船{i}", f"SHIP {i}", "陽明海運"))
+
+    with conn.cursor() as cur:
+        execute_values(cur, 'INSERT INTO ship_status (ship_voyage_number, ship_name, latest_event) VALUES %s', status_rows)
+        execute_values(cur, 'INSERT INTO ship_voyage (ship_voyage_number, pass_10_miles_time, pass_5_miles_time) VALUES %s',
+                       voyage_rows)
+        execute_values(cur, '''INSERT INTO ship_events (ship_voyage_number, event_source, event_time, event_name, navigation_status,
+                                   pilot_order_number, berth_number, event_content_time) VALUES %s ON CONFLICT DO NOTHING''',
+                       event_rows)
+        execute_values(cur, '''INSERT INTO ship_berth_order (berth_number, berthing_time, ship_status, pilotage_time,
+                                   ship_name_chinese, ship_name_english, port_agent) VALUES %s ON CONFLICT DO NOTHING''',
+                       berth_rows)
+        cur.execute('ANALYZE')
+    conn.commit()
+    return voyages
+
+
+def client(port: int, voyages: List[str], deadline: float, latencies: List[float], statuses: Dict[int, int],
+           lock: threading.Lock, rng: random.Random) -> None:
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    etags: Dict[str, str] = {}
+    samples, counts = [], {}
+    while time.time() < deadline:
+        voyage = rng.choice(voyages)
+        path = rng.choice([f'/ships/{voyage}', f'/ships/{voyage}/timeline', f'/ships/{voyage}/eta',
+                           f'/berths/{rng.choice(BERTHS)}/queue', '/berths', '/eta', '/ships'])
+        headers = {'If-None-Match': etags[path]} if path in etags and rng.random() < 0.33 else {}
+
+        start = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        samples.append(time.perf_counter() - start)
+
+        counts[response.status] = counts.get(response.status, 0) + 1
+        if response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    conn.close()
+    with lock:
+        latencies.extend(samples)
+        for status, count in counts.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ships', type=int, default=3000)
+    parser.add_argument('--events', type=int, default=30, help="events per voyage")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20, help="seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    admin = api.get_db_connection()
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS {BENCH_DB}')
+        cur.execute(f"CREATE DATABASE {BENCH_DB} ENCODING 'UTF8' TEMPLATE template0")
+
+    # Every connection opened by the API now goes to the scratch database
+    os.environ['POSTGRES_DB'] = BENCH_DB
+    server = None
+    try:
+        conn = api.get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute(INIT_SQL.read_text())
+        voyages = seed(conn, args.ships, args.events, random.Random(args.seed))
+        conn.close()
+
+        api.snapshot.refresh()
+        threading.Thread(target=api.refresh_loop, daemon=True).start()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), api.QueryHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        print(f"{args.ships} ships, {args.events} events per voyage, {args.clients} clients for {args.duration:.0f}s")
+
+        latencies: List[float] = []
+        statuses: Dict[int, int] = {}
+        lock = threading.Lock()
+        deadline = time.time() + args.duration
+        clients = [threading.Thread(target=client, args=(port, voyages, deadline, latencies, statuses, lock,
+                                                         random.Random(args.seed + n)))
+                   for n in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+
+        print(f"requests  {len(latencies)} ({len(latencies) / args.duration:.0f}/s), statuses {dict(sorted(statuses.items()))}")
+        for p in (50, 90, 99):
+            print(f"p{p:<2}       {percentile(latencies, p) * 1000:.2f} ms")
+        print(f"max       {max(latencies) * 1000:.2f} ms")
+    finally:
+        if server is not None:
+            server.shutdown()
+        with admin.cursor() as cur:
+            # The refresh loop still holds its connection
+            cur.execute(f'DROP DATABASE IF EXISTS {BENCH_DB} WITH (FORCE)')
+        admin.close()
+
+if __name__ == '__main__':
+    main()
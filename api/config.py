@@ -0,0 +1,25 @@
+import os
+
+##########################################
+# HTTP server                            #
+##########################################
+host = os.getenv('API_HOST', '0.0.0.0')
+port = int(os.getenv('API_PORT', 8000))
+
+##########################################
+# Snapshot refresh                       #
+##########################################
+# Seconds between incremental refreshes of the in-memory snapshot
+refresh_interval = float(os.getenv('API_REFRESH_INTERVAL', 5))
+# Rows whose updated_at falls inside this window before the last watermark are re-read,
+# so transactions that commit after the previous refresh are not missed
+refresh_overlap = int(os.getenv('API_REFRESH_OVERLAP', 60))
+# Every N refreshes the snapshot is rebuilt from scratch, dropping the voyages past the retention
+full_reload_every = int(os.getenv('API_FULL_RELOAD_EVERY', 120))
+# Only voyages with a status or passage time updated within this many days are served
+retention_days = int(os.getenv('API_RETENTION_DAYS', 30))
+# Minutes a berth order stays in the queue after the later of its berthing and pilotage times
+queue_grace = int(os.getenv('API_QUEUE_GRACE', 60))
+
+ETA_EVENT = '修改進港預報'
+ETD_EVENT = '修改出港預報'
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+import psycopg2
+
+from config import host, port, refresh_interval
+from snapshot import ShipSnapshot, render
+
+
+def get_db_connection():
+    return psycopg2.connect(
+        dbname=os.getenv('POSTGRES_DB'),
+        user=os.getenv('POSTGRES_USER'),
+        password=os.getenv('POSTGRES_PASSWORD'),
+        host=os.getenv('POSTGRES_HOST', 'db')
+    )
+
+snapshot = ShipSnapshot(get_db_connection)
+NOT_FOUND = render({'error': 'not found'})[1]
+
+
+def refresh_loop():
+    while True:
+        try:
+            snapshot.refresh()
+        except Exception as e:
+            print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 快照更新失敗: {str(e)}')
+        time.sleep(refresh_interval)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path).rstrip('/') or '/'
+
+        if path == '/healthz':
+            ready = snapshot.refreshed_at is not None
+            self._send(200 if ready else 503, *render({'ready': ready, 'refreshed_at': snapshot.refreshed_at}))
+            return
+
+        cached = snapshot.get(path)
+        if cached is None:
+            self._send(404, None, NOT_FOUND)
+            return
+
+        etag, body = cached
+        if etag in self.headers.get('If-None-Match', ''):
+            self._send(304, etag, b'')
+        else:
+            self._send(200, etag, body)
+
+    def _send(self, status, etag, body):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    threading.Thread(target=refresh_loop, daemon=True).start()
+
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 查詢服務啟動: {host}:{port}')
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+from config import ETA_EVENT, ETD_EVENT, refresh_overlap, full_reload_every, retention_days, queue_grace
+
+EPOCH = datetime(1970, 1, 1)
+
+STATUS_QUERY = 'SELECT ship_voyage_number, ship_name, latest_event, created_at, updated_at FROM ship_status '
+VOYAGE_QUERY = 'SELECT ship_voyage_number, pass_10_miles_time, pass_5_miles_time, updated_at FROM ship_voyage '
+EVENTS_QUERY = ('SELECT id, ship_voyage_number, event_source, event_time, event_name, navigation_status, '
+                'pilot_order_number, berth_number, event_content_time{updated_at} FROM ship_events ')
+BERTH_QUERY = ('SELECT berth_number, berthing_time, ship_status, pilotage_time, ship_name_chinese, '
+               'ship_name_english, port_agent, updated_at FROM ship_berth_order ')
+
+
+def _queued(row: dict, now: datetime) -> bool:
+    """
+    Whether a berth order is still queued: the ship has not reached the later of its
+    berthing and pilotage times, give or take `queue_grace` minutes. The crawler never
+    deletes berth orders, so the ships that berthed and left stay in the table.
+    """
+    times = [t for t in (row['berthing_time'], row['pilotage_time']) if t is not None]
+    return not times or max(times) >= now - timedelta(minutes=queue_grace)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value)
+
+
+def render(payload) -> Tuple[str, bytes]:
+    """
+    Serializes a payload to JSON and computes its ETag.
+
+    Args:
+        payload: Any JSON serializable object (datetimes are rendered as ISO strings).
+
+    Returns:
+        Tuple[str, bytes]: The quoted ETag and the encoded body.
+    """
+    body = json.dumps(payload, ensure_ascii=False, default=_json_default, separators=(',', ':')).encode('utf-8')
+    etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    return etag, body
+
+
+class ShipSnapshot:
+    """
+    In-memory copy of the ship tables with pre-rendered responses.
+
+    Rows are pulled incrementally using the `updated_at` columns, re-reading the last
+    `refresh_overlap` seconds. Only voyages updated within `retention_days` are kept;
+    the periodic full reload drops the others. Only the resources touched by a refresh
+    are re-rendered, and the response map is swapped in one assignment, so readers
+    never take a lock.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._conn = None
+        self._refresh_lock = threading.Lock()
+        self._refresh_count = 0
+
+        self.ships: Dict[str, dict] = {}
+        self.voyages: Dict[str, dict] = {}
+        self.events: Dict[str, Dict[int, dict]] = {}
+        self.berth_orders: Dict[str, Dict[tuple, dict]] = {}
+
+        self._status_watermark = EPOCH
+        self._voyage_watermark = EPOCH
+        self._berth_watermark = EPOCH
+        self._event_watermark = EPOCH
+        # Whether ship_events has updated_at (see upgrade_db.sql), checked on every full load
+        self._events_updated_at: Optional[bool] = None
+        # (time, highest event id) of the recent refreshes, used without ship_events.updated_at
+        self._event_ids: deque = deque()
+
+        # Per-voyage documents, kept so the collection endpoints can be rebuilt cheaply
+        self._ship_docs: Dict[str, dict] = {}
+        self._eta_docs: Dict[str, dict] = {}
+
+        self.responses: Dict[str, Tuple[str, bytes]] = {}
+        self.refreshed_at: Optional[datetime] = None
+
+    def get(self, path: str) -> Optional[Tuple[str, bytes]]:
+        return self.responses.get(path)
+
+    def refresh(self) -> None:
+        with self._refresh_lock:
+            full = self._refresh_count % full_reload_every == 0
+            try:
+                changed_ships, changed_berths = self._pull(full)
+            except Exception:
+                self._close()
+                raise
+            self._refresh_count += 1
+            if full or changed_ships or changed_berths or not self.responses:
+                self._publish(full, changed_ships, changed_berths)
+            self.refreshed_at = datetime.now()
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def _cursor(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = self._connect()
+            self._conn.autocommit = True
+        return self._conn.cursor(cursor_factory=RealDictCursor)
+
+    def _pull(self, full: bool) -> Tuple[set, set]:
+        overlap = timedelta(seconds=refresh_overlap)
+        changed_ships, changed_berths = set(), set()
+
+        with self._cursor() as cur:
+            if full:
+                self._full_load(cur)
+                return changed_ships, changed_berths
+
+            known = self.ships.keys() | self.voyages.keys() | self.events.keys()
+
+            cur.execute(STATUS_QUERY + 'WHERE updated_at >= %s', (self._status_watermark - overlap,))
+            for row in cur.fetchall():
+                key = row['ship_voyage_number']
+                if self.ships.get(key) != row:
+                    self.ships[key] = row
+                    changed_ships.add(key)
+                self._status_watermark = max(self._status_watermark, row['updated_at'])
+
+            cur.execute(VOYAGE_QUERY + 'WHERE updated_at >= %s', (self._voyage_watermark - overlap,))
+            for row in cur.fetchall():
+                key = row['ship_voyage_number']
+                if self.voyages.get(key) != row:
+                    self.voyages[key] = row
+                    changed_ships.add(key)
+                self._voyage_watermark = max(self._voyage_watermark, row['updated_at'])
+
+            # Events committed late by a concurrent transaction, or updated in place, are
+            # re-read within the overlap like the other tables
+            if self._events_updated_at:
+                cur.execute(self._events_query() + 'WHERE updated_at >= %s', (self._event_watermark - overlap,))
+            else:
+                cur.execute(self._events_query() + 'WHERE id > %s', (self._event_id_floor(),))
+            changed_ships |= self._store_events(cur.fetchall())
+
+            cur.execute(BERTH_QUERY + 'WHERE updated_at >= %s', (self._berth_watermark - overlap,))
+            rows = cur.fetchall()
+            cur.execute('SELECT LOCALTIMESTAMP AS now')
+            now = cur.fetchone()['now']
+            for row in rows:
+                berth = row['berth_number']
+                key = (row['ship_name_chinese'], row['ship_status'])
+                queue = self.berth_orders.setdefault(berth, {})
+                if not _queued(row, now):
+                    if queue.pop(key, None) is not None:
+                        changed_berths.add(berth)
+                elif queue.get(key) != row:
+                    queue[key] = row
+                    changed_berths.add(berth)
+                self._berth_watermark = max(self._berth_watermark, row['updated_at'])
+            changed_berths |= self._evict_passed(now)
+
+            # A voyage back after the retention, or first seen through one of its events,
+            # is loaded whole so its timeline is complete
+            returning = changed_ships - known
+            if returning:
+                self._load_voyages(cur, list(returning))
+
+        return changed_ships, changed_berths
+
+    def _full_load(self, cur) -> None:
+        """
+        Reloads the voyages updated within the retention, and the berth queues.
+        """
+        self.ships, self.voyages, self.events, self.berth_orders = {}, {}, {}, {}
+        self._event_ids.clear()
+
+        cur.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name = 'ship_events' AND column_name = 'updated_at'"
+        )
+        events_updated_at = cur.fetchone() is not None
+        if not events_updated_at and self._events_updated_at is not False:
+            print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} '
+                  f'ship_events 沒有 updated_at 欄位, 原地更新的事件要到完整重載才會更新, 請執行 upgrade_db.sql')
+        self._events_updated_at = events_updated_at
+
+        # Rows committed while loading are re-read by the next refresh, within the overlap
+        cur.execute('SELECT LOCALTIMESTAMP AS now')
+        now = cur.fetchone()['now']
+        self._status_watermark = self._voyage_watermark = self._berth_watermark = self._event_watermark = now
+
+        cutoff = now - timedelta(days=retention_days)
+        cur.execute(
+            'SELECT ship_voyage_number FROM ship_status WHERE updated_at >= %(cutoff)s '
+            'UNION SELECT ship_voyage_number FROM ship_voyage WHERE updated_at >= %(cutoff)s',
+            {'cutoff': cutoff}
+        )
+        self._load_voyages(cur, [row['ship_voyage_number'] for row in cur.fetchall()])
+
+        cur.execute('SELECT MAX(id) AS id FROM ship_events')
+        self._event_ids.append((time.monotonic(), cur.fetchone()['id'] or 0))
+
+        cur.execute(BERTH_QUERY + 'WHERE updated_at >= %s', (cutoff,))
+        for row in cur.fetchall():
+            if _queued(row, now):
+                self.berth_orders.setdefault(row['berth_number'], {})[(row['ship_name_chinese'], row['ship_status'])] = row
+
+    def _evict_passed(self, now: datetime) -> set:
+        """
+        Drops the berth orders whose berthing and pilotage times have passed.
+
+        Returns:
+            set: The berths whose queue changed.
+        """
+        changed = set()
+        for berth, queue in list(self.berth_orders.items()):
+            for key, row in list(queue.items()):
+                if not _queued(row, now):
+                    del queue[key]
+                    changed.add(berth)
+            if not queue:
+                del self.berth_orders[berth]
+                changed.add(berth)
+        return changed
+
+    def _load_voyages(self, cur, voyage_numbers: list) -> None:
+        cur.execute(STATUS_QUERY + 'WHERE ship_voyage_number = ANY(%s)', (voyage_numbers,))
+        for row in cur.fetchall():
+            self.ships[row['ship_voyage_number']] = row
+        cur.execute(VOYAGE_QUERY + 'WHERE ship_voyage_number = ANY(%s)', (voyage_numbers,))
+        for row in cur.fetchall():
+            self.voyages[row['ship_voyage_number']] = row
+        cur.execute(self._events_query() + 'WHERE ship_voyage_number = ANY(%s)', (voyage_numbers,))
+        self._store_events(cur.fetchall())
+
+    def _events_query(self) -> str:
+        return EVENTS_QUERY.format(updated_at=', updated_at' if self._events_updated_at else '')
+
+    def _store_events(self, rows: list) -> set:
+        """
+        Stores the events that are new or changed.
+
+        Returns:
+            set: The voyages whose events changed.
+        """
+        changed = set()
+        max_id = self._event_ids[-1][1] if self._event_ids else 0
+        for row in rows:
+            updated_at = row.pop('updated_at', None)
+            if updated_at is not None:
+                self._event_watermark = max(self._event_watermark, updated_at)
+            max_id = max(max_id, row['id'])
+
+            key = row['ship_voyage_number']
+            events = self.events.setdefault(key, {})
+            if events.get(row['id']) != row:
+                events[row['id']] = row
+                changed.add(key)
+        self._event_ids.append((time.monotonic(), max_id))
+        return changed
+
+    def _event_id_floor(self) -> int:
+        """
+        Without ship_events.updated_at, the highest event id seen at least `refresh_overlap`
+        seconds ago: the events above it are re-read, since ids are taken before the
+        transactions that insert them commit.
+        """
+        horizon = time.monotonic() - refresh_overlap
+        while len(self._event_ids) > 1 and self._event_ids[1][0] <= horizon:
+            self._event_ids.popleft()
+        return self._event_ids[0][1] if self._event_ids else 0
+
+    def _timeline(self, voyage_number: str) -> list:
+        events = self.events.get(voyage_number, {}).values()
+        return sorted(events, key=lambda e: (e['event_time'] or EPOCH, e['id']))
+
+    def _eta(self, voyage_number: str, timeline: list) -> dict:
+        eta = etd = None
+        for event in timeline:
+            if event['event_name'] == ETA_EVENT:
+                eta = event['event_content_time']
+            elif event['event_name'] == ETD_EVENT:
+                etd = event['event_content_time']
+        return {'ship_voyage_number': voyage_number, 'eta': eta, 'etd': etd}
+
+    def _ship(self, voyage_number: str, timeline: list, eta: dict) -> dict:
+        status = self.ships.get(voyage_number, {})
+        voyage = self.voyages.get(voyage_number, {})
+        latest = timeline[-1] if timeline else {}
+        return {
+            'ship_voyage_number': voyage_number,
+            'ship_name': status.get('ship_name'),
+            'latest_event': status.get('latest_event'),
+            'latest_event_name': latest.get('event_name'),
+            'latest_event_time': latest.get('event_time'),
+            'navigation_status': latest.get('navigation_status'),
+            'berth_number': latest.get('berth_number'),
+            'eta': eta['eta'],
+            'etd': eta['etd'],
+            'pass_10_miles_time': voyage.get('pass_10_miles_time'),
+            'pass_5_miles_time': voyage.get('pass_5_miles_time'),
+            'updated_at': max(status.get('updated_at') or EPOCH, voyage.get('updated_at') or EPOCH),
+        }
+
+    def _queue(self, berth_number: str) -> list:
+        rows = self.berth_orders.get(berth_number, {}).values()
+        return [
+            {k: v for k, v in row.items() if k != 'berth_number'}
+            for row in sorted(rows, key=lambda r: (r['berthing_time'] or datetime.max,
+                                                   r['pilotage_time'] or datetime.max))
+        ]
+
+    def _publish(self, full: bool, changed_ships: set, changed_berths: set) -> None:
+        responses = {} if full else dict(self.responses)
+        voyage_numbers = self.ships.keys() | self.voyages.keys() | self.events.keys()
+
+        if full:
+            self._ship_docs, self._eta_docs = {}, {}
+            changed_ships = set(voyage_numbers)
+        for voyage_number in changed_ships:
+            timeline = self._timeline(voyage_number)
+            eta = self._eta(voyage_number, timeline)
+            ship = self._ship(voyage_number, timeline, eta)
+            self._ship_docs[voyage_number] = ship
+            self._eta_docs[voyage_number] = eta
+            responses[f'/ships/{voyage_number}'] = render(ship)
+            responses[f'/ships/{voyage_number}/timeline'] = render(timeline)
+            responses[f'/ships/{voyage_number}/eta'] = render(eta)
+
+        if full:
+            changed_berths = set(self.berth_orders)
+        for berth_number in changed_berths:
+            if berth_number in self.berth_orders:
+                responses[f'/berths/{berth_number}/queue'] = render(self._queue(berth_number))
+            else:
+                responses.pop(f'/berths/{berth_number}/queue', None)
+
+        if full or changed_ships:
+            ordered = sorted(voyage_numbers)
+            responses['/ships'] = render([self._ship_docs[v] for v in ordered])
+            responses['/eta'] = render([self._eta_docs[v] for v in ordered
+                                        if self._eta_docs[v]['eta'] or self._eta_docs[v]['etd']])
+        if full or changed_berths:
+            responses['/berths'] = render({b: len(q) for b, q in sorted(self.berth_orders.items())})
+
+        self.responses = responses
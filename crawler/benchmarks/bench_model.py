@@ -0,0 +1,170 @@
+"""
+Compares the per-cycle memory and time of the DataFrame pipeline with the record model.
+
+Both paths start from freshly created strings, as an HTML parser would hand them over,
+and go as far as the tuples passed to the database: the ship status grid, the events of
+every voyage and the 10/5 nm passage times.
+
+Every measurement runs in a fresh process and reports the growth of its resident set
+size (Linux only), not tracemalloc: pandas 3 keeps strings in Arrow buffers that
+tracemalloc does not see.
+
+Run from the crawler directory (the legacy path needs pandas, which the crawler itself no
+longer depends on):
+
+    python -m benchmarks.bench_model --ships 200 --events 25
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import time
+
+from config import cols, event_cols, miles_cols
+from utils.model import ShipStatus, ShipEvent, ShipPassTime
+
+SHIP_NAMES = [f"長榮{n}號 EVER {n}" for n in range(60)]
+EVENT_NAMES = ["進港預報申請", "修改進港預報", "新增引水申請", "更新引水時間", "船長報告ETA", "引水人上船時間", "實際靠妥時間"]
+STAGES = ["YES", "NO", "RED"]
+
+
+def _fresh(value: str) -> str:
+    # A new str object with the same content, like the parser produces for every cell
+    return (value + ' ')[:-1]
+
+
+def ship_cells(ships: int):
+    for i in range(ships):
+        yield [f"{100000 + i:06d}{i % 9000:04d}", _fresh(SHIP_NAMES[i % len(SHIP_NAMES)]), _fresh(EVENT_NAMES[i % 7])] \
+            + [_fresh(STAGES[(i + n) % 3]) for n in range(len(cols) - 3)]
+
+
+def event_cells(events: int):
+    for n in range(events):
+        yield [_fresh("VTS轉檔"), f"2024/10/{n % 28 + 1:02d} 下午 03:{n % 60:02d}:00", _fresh(EVENT_NAMES[n % 7]),
+               _fresh("進港"), f"{n:08d}", _fresh(f"{1040 + n % 10}"), f"113/10/{n % 28 + 1:02d} 15:{n % 60:02d}"]
+
+
+def legacy_cycle(ships: int, events: int) -> int:
+    import pandas as pd
+
+    ship_df = pd.DataFrame(columns=cols)
+    for cells in ship_cells(ships):
+        ship_df = pd.concat([ship_df, pd.DataFrame([cells], columns=cols)], ignore_index=True)
+    ship_df['船編'] = ship_df['船編航次'].str.slice(0, 6)
+    ship_df['航次'] = ship_df['船編航次'].str.slice(6, 10)
+    rows = [(row['船編航次'], row['船名'], row['最新事件']) for _, row in ship_df.iterrows()]
+
+    for _, ship in ship_df.iterrows():
+        event_df = pd.DataFrame(columns=event_cols)
+        for cells in event_cells(events):
+            event_df = pd.concat([event_df, pd.DataFrame([cells], columns=event_cols)], ignore_index=True)
+        event_df['船編航次'] = ship['船編航次']
+        rows += [(row['船編航次'], row['事件名稱'], row['碼頭代碼']) for _, row in event_df.iterrows()]
+
+    def miles(row):
+        return [row['船編航次'], 'null', 'null']
+    pass_df = pd.DataFrame(ship_df.apply(miles, axis=1, result_type='expand').values.tolist(),
+                           columns=["船編航次"] + miles_cols)
+    rows += [(row['船編航次'], row['10浬'], row['5浬']) for _, row in pass_df.iterrows()]
+    return len(rows)
+
+
+def record_cycle(ships: int, events: int) -> int:
+    statuses = [ShipStatus(cells[0], cells[1], cells[2], cells[3:]) for cells in ship_cells(ships)]
+    rows = [(ship.voyage_number, ship.ship_name, ship.latest_event) for ship in statuses]
+
+    for ship in statuses:
+        voyage_events = [ShipEvent(ship.voyage_number, *cells) for cells in event_cells(events)]
+        rows += [(event.voyage_number, event.name, event.berth_number) for event in voyage_events]
+
+    pass_times = [ShipPassTime(ship.voyage_number, 'null', 'null') for ship in statuses]
+    rows += [pass_time.as_row() for pass_time in pass_times]
+    return len(rows)
+
+
+def _rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _reset_peak_rss() -> None:
+    # ru_maxrss would still hold the parent's peak from before the exec
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def _peak_rss() -> int:
+    with open('/proc/self/status') as f:
+        line = next(line for line in f if line.startswith('VmHWM:'))
+    return int(line.split()[1]) * 1024
+
+
+def _in_fresh_process(target, *args):
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(target, args)
+
+
+def measure(cycle, ships: int, events: int):
+    """
+    Time and peak RSS growth of one cycle.
+    """
+    if cycle is legacy_cycle:
+        import pandas  # noqa: F401  # Loaded before the baseline
+    gc.collect()
+    _reset_peak_rss()
+    base = _rss()
+    start = time.perf_counter()
+    rows = cycle(ships, events)
+    elapsed = time.perf_counter() - start
+    return rows, elapsed, max(0, _peak_rss() - base)
+
+
+def retained(kind: str, ships: int, events: int) -> int:
+    """
+    RSS growth while the grid and events are held, i.e. what a cycle keeps alive.
+    """
+    if kind == 'dataframe':
+        import pandas as pd
+    gc.collect()
+    base = _rss()
+    if kind == 'dataframe':
+        held = (pd.DataFrame(list(ship_cells(ships)), columns=cols),
+                pd.DataFrame([cells for _ in range(ships) for cells in event_cells(events)], columns=event_cols))
+    else:
+        held = ([ShipStatus(c[0], c[1], c[2], c[3:]) for c in ship_cells(ships)],
+                [ShipEvent('0', *c) for _ in range(ships) for c in event_cells(events)])
+    gc.collect()
+    size = _rss() - base
+    del held
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ships', type=int, default=200)
+    parser.add_argument('--events', type=int, default=25)
+    args = parser.parse_args()
+
+    try:
+        import pandas
+    except ImportError:
+        pandas = None
+    print(f"{args.ships} ships, {args.events} events per voyage"
+          + (f", pandas {pandas.__version__}" if pandas is not None else ""))
+
+    kinds = [('records', record_cycle)]
+    if pandas is not None:
+        kinds.insert(0, ('dataframe', legacy_cycle))
+    else:
+        print("pandas is not installed, skipping the DataFrame baseline")
+
+    for name, cycle in kinds:
+        rows, elapsed, peak = _in_fresh_process(measure, cycle, args.ships, args.events)
+        size = _in_fresh_process(retained, name, args.ships, args.events)
+        print(f"{name:>10}: {rows} rows  {elapsed * 1000:9.1f} ms  peak +{peak / 2**20:6.2f} MiB"
+              f"  retained +{size / 2**20:6.2f} MiB")
+
+
+if __name__ == '__main__':
+    main()
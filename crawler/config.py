@@ -1,10 +1,35 @@
-url = 'https://sdci.kh.twport.com.tw/khbweb/UA1007.aspx'
-ship_berth_order_url = "https://sdci.kh.twport.com.tw/khbweb/oh015.aspx"
-event_url = 'https://sdci.kh.twport.com.tw/khbweb/UA3007.aspx'
-miles_pass_url = 'https://sdci.kh.twport.com.tw/khbweb/UA5007.aspx'
+import os
+
+# Point at another host (e.g. the traffic simulator) with PORT_WEB_BASE_URL
+base_url = os.getenv('PORT_WEB_BASE_URL', 'https://sdci.kh.twport.com.tw/khbweb').rstrip('/')
+url = f'{base_url}/UA1007.aspx'
+ship_berth_order_url = f"{base_url}/oh015.aspx"
+event_url = f'{base_url}/UA3007.aspx'
+miles_pass_url = f'{base_url}/UA5007.aspx'
 output_html_path = 'output/output.html'
 output_csv_path = 'output/output.csv'
 ship_content_id_prefix = 'ASPx_船舶即時動態_tccell'
 cols = ["船編航次", "船名", "最新事件", "進港申請", "移泊申請", "出港申請", "港外船舶進港", "錨泊中", "進港作業中", "裝卸須知", "移泊作業中", "移泊裝卸作業", "出港作業中", "船舶已出港"]
 event_cols = ["事件來源", "發生時間", "事件名稱", "航行狀態", "引水單序號", "碼頭代碼", "事件內容"]
-miles_cols = ["10浬", "5浬"]
\ No newline at end of file
+miles_cols = ["10浬", "5浬"]
+
+# Headless Chrome pool shared by the Selenium scrapes
+browser_pool_size = int(os.getenv('BROWSER_POOL_SIZE', 1))
+browser_wait_timeout = int(os.getenv('BROWSER_WAIT_TIMEOUT', 15))
+
+# Append-only Parquet export of the rows every cycle inserted or updated (needs pyarrow)
+export_dir = os.getenv('EXPORT_DIR', 'output/export')
+export_enabled = os.getenv('EXPORT_ENABLED', '1') == '1'
+# Full CSV snapshots of the last cycle, rewritten every cycle
+csv_snapshots = os.getenv('CSV_SNAPSHOTS', '0') == '1'
+
+# HTTP fetches run with an adaptive (AIMD) concurrency limit per endpoint
+fetch_timeout = float(os.getenv('FETCH_TIMEOUT', 20))
+fetch_min_concurrency = max(1, int(os.getenv('FETCH_MIN_CONCURRENCY', 1)))
+fetch_initial_concurrency = int(os.getenv('FETCH_INITIAL_CONCURRENCY', 2))
+fetch_max_concurrency = int(os.getenv('FETCH_MAX_CONCURRENCY', 16))
+# Seconds above which a response counts as the site slowing down
+fetch_target_latency = float(os.getenv('FETCH_TARGET_LATENCY', 2))
+# A cycle should finish within INTERVAL_TIME; cycle durations and endpoint limits are kept here
+interval_time = int(os.getenv('INTERVAL_TIME', 180))
+crawl_health_path = os.getenv('CRAWL_HEALTH_PATH', 'output/crawl_health.json')
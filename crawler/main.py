@@ -1,95 +1,161 @@
 import os
 import time
-from typing import List
-from utils.fetch import fetch_ship_webpage, fetch_webpage, fetch_ship_berth_order
-from utils.extract import extract_ship_data, extract_event_data, extract_miles_data
-from utils.save import save_to_csv, save_to_html, save_to_db
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Sequence
+from utils.fetch import iter_ship_webpages, fetch_webpage, fetch_ship_berth_order
+from utils.browser import browser_pool
+from utils.extract import ShipGridParser, extract_event_data, extract_miles_data
+from utils.save import save_to_csv, save_to_html, save_to_db, refresh_analytics
+from utils.export import changes, compact
+from utils.throttle import fetch_controller
+from utils.model import ShipStatus, ShipPassTime, BerthOrder, drop_duplicate_berth_orders
+from utils.pipeline import Channel, Stage, StageResult, run_stages
+from config import url, ship_berth_order_url, event_url, miles_pass_url, output_html_path, output_csv_path, ship_content_id_prefix, cols, event_cols, miles_cols
+from config import export_dir, csv_snapshots, fetch_max_concurrency, interval_time, crawl_health_path
 from datetime import datetime, timedelta
 
-def fetch_ship_data(url: str, output_csv_path: str, output_html_path: str, ship_content_id_prefix: str, cols: list[str]) -> pd.DataFrame:
-    # Fetch the webpage
-    html = fetch_ship_webpage(url)
-    save_to_html(html, output_html_path)
-
-    # Extract the ship data
-    result_df = pd.DataFrame(columns=cols)
-    ship_id = 0
-    while True:
-        ids = [f"{ship_content_id_prefix}{ship_id}_{num}" for num in range(14)]
-
-        result, df = extract_ship_data(html, ids, cols)
-        if not result:
-            break
-
-        result_df = pd.concat([result_df, df], ignore_index=True)
-        ship_id += 1
-
-    save_to_csv(result_df, output_csv_path)
-
-    save_to_db(result_df, table_name='ship_status')
-
-    return result_df
-
-def fetch_ship_event_data(ship_df: pd.DataFrame, event_url: str, event_cols: list[str]) -> None:
-    # Extract the ship id and voyage number from the ship dataframe
-    ship_df['船編'] = ship_df['船編航次'].str.slice(0, 6)
-    ship_df['航次'] = ship_df['船編航次'].str.slice(6, 10)
-
-    # Extract the event data of all ships
-    for index, row in ship_df.iterrows():
-        url = event_url + f"?SP_ID={row['船編']}&SP_SERIAL={row['航次']}"
-        html = fetch_webpage(url)
-        result, df = extract_event_data(html, event_cols)
-        if result:
-            df['船編航次'] = row['船編航次']
-            save_to_db(df, table_name='ship_events')
+def fetch_ship_data(url: str, output_csv_path: str, output_html_path: str, ship_content_id_prefix: str, cols: list[str], channels: Sequence[Channel] = ()) -> List[ShipStatus]:
+    # Extract the ship data page by page, handing every ship to the detail fetchers
+    # while the next pages of the grid are still being fetched
+    parser = ShipGridParser(ship_content_id_prefix, cols)
+    pages, ships = [], []
+    for page in iter_ship_webpages(url):
+        pages.append(page)
+        for ship in parser.feed(page):
+            ships.append(ship)
+            for channel in channels:
+                channel.put(ship)
+    save_to_html(''.join(pages), output_html_path)
+
+    if csv_snapshots:
+        save_to_csv(cols, (ship.as_row() for ship in ships), output_csv_path)
+
+    save_to_db(ships, table_name='ship_status')
+
+    return ships
+
+def fetch_ship_event_data(ships: Iterable[ShipStatus], event_url: str, event_cols: list[str]) -> None:
+    def fetch_events(ship):
+        try:
+            url = event_url + f"?SP_ID={ship.ship_id}&SP_SERIAL={ship.voyage}"
+            html = fetch_webpage(url)
+            events = extract_event_data(html, ship.voyage_number, event_cols)
+            if events:
+                save_to_db(events, table_name='ship_events')
+        except Exception as e:
+            print(f"Failed to fetch the events of {ship.voyage_number}: {str(e)}")
+
+    # Extract the event data of all ships, as many at once as the endpoint's limit allows
+    with ThreadPoolExecutor(max_workers=fetch_max_concurrency, thread_name_prefix='events') as executor:
+        for _ in executor.map(fetch_events, ships):
+            pass
             
 def fetch_ship_berth_order_data(url: str, output_csv_path: str) -> None:
     ship_berth_order_data = fetch_ship_berth_order(url)
-    ship_berth_order_df = pd.DataFrame(ship_berth_order_data)
+    berth_orders = BerthOrder.from_dicts(ship_berth_order_data)
 
     # filter out the same 船席,動態,中文船名 only keep the latest
-    ship_berth_order_df = ship_berth_order_df.drop_duplicates(subset=['船席', '動態', '中文船名'], keep='last')
+    berth_orders = drop_duplicate_berth_orders(berth_orders)
 
-    berth_order_csv_path = output_csv_path.replace('.csv', '_ship_berth_order.csv')
-    save_to_csv(ship_berth_order_df, berth_order_csv_path)
+    if csv_snapshots:
+        berth_order_csv_path = output_csv_path.replace('.csv', '_ship_berth_order.csv')
+        headers = berth_orders[0].headers if berth_orders else ()
+        save_to_csv(headers, (order.as_row() for order in berth_orders), berth_order_csv_path)
 
-    save_to_db(ship_berth_order_df, table_name='ship_berth_order')
+    save_to_db(berth_orders, table_name='ship_berth_order')
 
-def fetch_ship_pass_5_and_10_miles(ship_df: pd.DataFrame, miles_pass_url: str, miles_cols: List[str], output_csv_path: str) -> None:
+def fetch_ship_pass_5_and_10_miles(ships: Iterable[ShipStatus], miles_pass_url: str, miles_cols: List[str], output_csv_path: str) -> None:
     cols = ["船編航次"] + miles_cols
     
-    def fetch_miles_data(row):
-        url = f"{miles_pass_url}?SP_ID={row['船編']}&SP_SERIAL={row['航次']}"
-        html = fetch_webpage(url)
-        miles_time = extract_miles_data(html, miles_cols)
-        return [row['船編航次']] + miles_time
-
-    ship_pass_time_data = ship_df.apply(fetch_miles_data, axis=1, result_type='expand').values.tolist()
-    
-    ship_pass_time_df = pd.DataFrame(ship_pass_time_data, columns=cols)
+    def fetch_miles_data(ship):
+        try:
+            url = f"{miles_pass_url}?SP_ID={ship.ship_id}&SP_SERIAL={ship.voyage}"
+            html = fetch_webpage(url)
+            miles_time = extract_miles_data(html, miles_cols)
+            return ShipPassTime(ship.voyage_number, *miles_time)
+        except Exception as e:
+            print(f"Failed to fetch the miles passage of {ship.voyage_number}: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=fetch_max_concurrency, thread_name_prefix='miles') as executor:
+        pass_times = [pass_time for pass_time in executor.map(fetch_miles_data, ships) if pass_time is not None]
     
-    ship_pass_time_csv_path = output_csv_path.replace('.csv', '_ship_pass_time.csv')
-    save_to_csv(ship_pass_time_df, ship_pass_time_csv_path)
-
-    save_to_db(ship_pass_time_df, table_name='ship_voyage') 
+    if csv_snapshots:
+        ship_pass_time_csv_path = output_csv_path.replace('.csv', '_ship_pass_time.csv')
+        save_to_csv(cols, (pass_time.as_row() for pass_time in pass_times), ship_pass_time_csv_path)
+
+    save_to_db(pass_times, table_name='ship_voyage') 
+
+def refresh_analytics_data() -> None:
+    refreshed = refresh_analytics()
+    if refreshed is None:
+        # Init scripts only run on a new database volume
+        print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 分析資料表未建立, 略過分析資料更新 (請套用 analytics.sql)')
+    else:
+        print(f'分析資料更新: {refreshed} 航次')
+
+def crawl() -> Dict[str, StageResult]:
+    """
+    Runs one crawl cycle as a stage graph.
+
+    The berth order scrape is independent and starts right away. The event and
+    miles fetchers consume voyages from channels as each page of the ship grid is
+    fetched, so they run while Selenium pages through the rest of the grid, and
+    the cycle takes about as long as its longest stage.
+
+    The analytics are refreshed once the events and the passage times are saved.
+    The rows the stages upserted are exported once they have all finished, even if
+    some failed, since those rows are already in the database. Export partitions of
+    previous days are compacted alongside the crawl.
+    """
+    event_channel: Channel[ShipStatus] = Channel()
+    miles_channel: Channel[ShipStatus] = Channel()
+
+    def ship_data():
+        try:
+            fetch_ship_data(url, output_csv_path, output_html_path, ship_content_id_prefix, cols,
+                            channels=(event_channel, miles_channel))
+        finally:
+            event_channel.close()
+            miles_channel.close()
+
+    stages = [
+        Stage('ship_data', ship_data),
+        Stage('ship_events', lambda: fetch_ship_event_data(event_channel, event_url, event_cols)),
+        Stage('ship_miles', lambda: fetch_ship_pass_5_and_10_miles(miles_channel, miles_pass_url, miles_cols, output_csv_path)),
+        Stage('berth_order', lambda: fetch_ship_berth_order_data(ship_berth_order_url, output_csv_path)),
+        Stage('analytics', refresh_analytics_data, deps=('ship_events', 'ship_miles')),
+    ]
+    if not changes.enabled:
+        return run_stages(stages)
+
+    stages.append(Stage('export_compaction', lambda: compact(export_dir, datetime.utcnow().date())))
+    results = run_stages(stages)
+    results.update(run_stages([Stage('export', changes.flush)]))
+    return results
 
 if __name__ == '__main__':
-    from config import url, ship_berth_order_url, event_url, miles_pass_url, output_html_path, output_csv_path, ship_content_id_prefix, cols, event_url, event_cols, miles_cols
-
     print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 爬取網站資料')
 
+    fetch_controller.load(crawl_health_path)
+    start = time.perf_counter()
     try:
-        ship_df = fetch_ship_data(url, output_csv_path, output_html_path, ship_content_id_prefix, cols)
+        results = crawl()
 
-        fetch_ship_event_data(ship_df, event_url, event_cols)
-
-        fetch_ship_pass_5_and_10_miles(ship_df, miles_pass_url, miles_cols, output_csv_path)
-
-        fetch_ship_berth_order_data(ship_berth_order_url, output_csv_path)
-
-        print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 爬取資料完成')
+        failed = [name for name, result in results.items() if not result.ok]
+        if failed:
+            print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 爬取資料部分失敗: {", ".join(failed)}')
+        else:
+            print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 爬取資料完成')
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-
+    finally:
+        browser_pool.close()
+
+        cycle = fetch_controller.record_cycle(time.perf_counter() - start, interval_time)
+        if not cycle['within_slo']:
+            print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 爬取週期 {cycle["duration"]}s 超過 INTERVAL_TIME {interval_time}s')
+        for name, endpoint in cycle['endpoints'].items():
+            print(f'{name}: 並行上限 {endpoint["limit"]}, 請求 {endpoint["requests"]}, 錯誤 {endpoint["errors"]}, '
+                  f'逾時 {endpoint["timeouts"]}, p95 {endpoint["p95_latency"]}s')
+        fetch_controller.save(crawl_health_path)
@@ -0,0 +1,65 @@
+"""
+Tests of the Parquet change export.
+
+Run from the repository root:
+
+    python -m pytest crawler/tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+CRAWLER_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(CRAWLER_DIR))
+
+from utils.export import ChangeExporter, TABLE_COLUMNS, compact_partition, partition_files, pa, pq, write_atomic
+
+EVENT = {
+    'id': 7, 'ship_voyage_number': '1000010001', 'event_source': 'VTS轉檔', 'event_time': datetime(2024, 10, 1, 7, 0),
+    'event_name': '船長報告ETA', 'navigation_status': '進港', 'pilot_order_number': '00000001', 'berth_number': '1042',
+    'event_content_time': datetime(2024, 10, 1, 9, 0), 'updated_at': datetime(2024, 10, 1, 7, 5),
+}
+
+
+@unittest.skipIf(pa is None, "needs pyarrow")
+class ShipEventsExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.exporter = ChangeExporter(self.tmp.name)
+
+    def test_updated_at_is_exported(self):
+        self.assertIn(('updated_at', 'timestamp'), TABLE_COLUMNS['ship_events'])
+
+        # An event updated in place comes back from the upsert with its new updated_at
+        updated = dict(EVENT, event_content_time=datetime(2024, 10, 1, 10, 0), updated_at=datetime(2024, 10, 1, 8, 0))
+        self.exporter.add('ship_events', [EVENT, updated])
+        path = self.exporter.flush(datetime(2024, 10, 1, 8, 1))['ship_events']
+
+        rows = pq.read_table(path).to_pylist()
+        self.assertEqual([row['updated_at'] for row in rows], [datetime(2024, 10, 1, 7, 5), datetime(2024, 10, 1, 8, 0)])
+        self.assertEqual([row['event_content_time'] for row in rows],
+                         [datetime(2024, 10, 1, 9, 0), datetime(2024, 10, 1, 10, 0)])
+        self.assertEqual(rows[0]['exported_at'], datetime(2024, 10, 1, 8, 1))
+
+    def test_compaction_keeps_files_without_updated_at(self):
+        self.exporter.add('ship_events', [EVENT])
+        partition = os.path.dirname(self.exporter.flush(datetime(2024, 10, 1, 8, 1))['ship_events'])
+
+        # A file written before the column was exported
+        old = {name: [EVENT[name]] for name, _ in TABLE_COLUMNS['ship_events'] if name != 'updated_at'}
+        old['exported_at'] = [datetime(2024, 10, 1, 6, 0)]
+        write_atomic(pa.Table.from_pydict(old), os.path.join(partition, 'part-060000-00000000.parquet'))
+
+        output = compact_partition(partition)
+        self.assertEqual(partition_files(partition), [output])
+        rows = pq.read_table(os.path.join(partition, output)).to_pylist()
+        self.assertEqual([(row['exported_at'], row['updated_at']) for row in rows],
+                         [(datetime(2024, 10, 1, 6, 0), None), (datetime(2024, 10, 1, 8, 1), datetime(2024, 10, 1, 7, 5))])
+
+
+if __name__ == '__main__':
+    unittest.main()
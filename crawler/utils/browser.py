@@ -0,0 +1,101 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+from config import browser_pool_size
+
+# Resources the scrapes never need: only the DOM is read
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+    "*.css", "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+]
+
+
+def create_driver() -> webdriver.Chrome:
+    """
+    Starts a headless Chrome that does not download images, stylesheets or fonts.
+
+    Returns:
+        webdriver.Chrome: The WebDriver of the new browser.
+    """
+    # Set up the Chrome WebDriver to run in headless mode (in docker container)
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--window-size=1920x1080")
+    chrome_options.add_argument("--blink-settings=imagesEnabled=false")
+    chrome_options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.fonts": 2,
+    })
+
+    service = Service('/usr/bin/chromedriver')
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+class BrowserPool:
+    """
+    A small pool of headless Chrome browsers reused across the scrapes of a cycle.
+
+    A browser goes back to the pool on an empty tab after each scrape, and is quit
+    instead when the scrape raised. Every cycle runs in a new process and closes the
+    pool when it ends, so a browser never outlives its cycle.
+    """
+
+    def __init__(self, size: int = 1):
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: "queue.LifoQueue[webdriver.Chrome]" = queue.LifoQueue()
+
+    @contextmanager
+    def session(self) -> Iterator[webdriver.Chrome]:
+        with self._slots:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = create_driver()
+
+            healthy = False
+            try:
+                yield driver
+                healthy = True
+            finally:
+                self._release(driver, healthy)
+
+    def _release(self, driver: webdriver.Chrome, healthy: bool) -> None:
+        if healthy:
+            try:
+                # Drop the scraped DOM so an idle browser holds as little memory as possible
+                driver.get('about:blank')
+                self._idle.put(driver)
+                return
+            except Exception:
+                pass
+        _quit(driver)
+
+    def close(self) -> None:
+        while True:
+            try:
+                _quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+def _quit(driver: webdriver.Chrome) -> None:
+    try:
+        # quit() ends the chromedriver and every Chrome process, close() only closes the window
+        driver.quit()
+    except Exception as e:
+        print(f"Failed to quit the browser: {str(e)}")
+
+
+browser_pool = BrowserPool(browser_pool_size)
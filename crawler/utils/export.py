@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the export is skipped without pyarrow
+    pa = pq = None
+
+from config import export_dir, export_enabled
+
+# Columns of the exported tables, as in init_db.sql, plus the time of the export
+TABLE_COLUMNS = {
+    'ship_status': [
+        ('ship_voyage_number', 'string'), ('ship_name', 'string'), ('latest_event', 'string'),
+        ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ],
+    'ship_berth_order': [
+        ('berth_number', 'string'), ('berthing_time', 'timestamp'), ('ship_status', 'string'),
+        ('pilotage_time', 'timestamp'), ('ship_name_chinese', 'string'), ('ship_name_english', 'string'),
+        ('port_agent', 'string'), ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ],
+    'ship_voyage': [
+        ('ship_voyage_number', 'string'), ('pass_10_miles_time', 'timestamp'), ('pass_5_miles_time', 'timestamp'),
+        ('created_at', 'timestamp'), ('updated_at', 'timestamp'),
+    ],
+    'ship_events': [
+        ('id', 'int64'), ('ship_voyage_number', 'string'), ('event_source', 'string'), ('event_time', 'timestamp'),
+        ('event_name', 'string'), ('navigation_status', 'string'), ('pilot_order_number', 'string'),
+        ('berth_number', 'string'), ('event_content_time', 'timestamp'), ('updated_at', 'timestamp'),
+    ],
+}
+
+# Lists the files a compacted file replaces, to finish an interrupted compaction
+COMPACTED_FROM = b'portcdm.compacted_from'
+
+
+def table_schema(table: str) -> "pa.Schema":
+    types = {'string': pa.string(), 'timestamp': pa.timestamp('us'), 'int64': pa.int64()}
+    return pa.schema([(name, types[kind]) for name, kind in TABLE_COLUMNS[table]] + [('exported_at', pa.timestamp('us'))])
+
+
+def partition_path(root: str, table: str, day: date) -> str:
+    return os.path.join(root, table, f"date={day.isoformat()}")
+
+
+def partition_files(path: str) -> List[str]:
+    """
+    The data files of a partition. Files starting with '.' or '_' (e.g. files being
+    written) are ignored, as Parquet readers do.
+    """
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path) if name.endswith('.parquet') and name[0] not in '._')
+
+
+def write_atomic(table: "pa.Table", path: str) -> None:
+    """
+    Writes a Parquet file under a hidden name and renames it into place, so readers never
+    see a partial file.
+    """
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+class ChangeExporter:
+    """
+    Collects the rows each cycle inserted or updated, and appends them to a date
+    partitioned Parquet dataset: `<root>/<table>/date=<UTC date>/part-*.parquet`.
+
+    Stages add rows concurrently; `flush` writes one file per table per cycle.
+    """
+
+    def __init__(self, root: str, enabled: bool = True):
+        self.root = root
+        self.enabled = enabled and pa is not None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[dict]] = defaultdict(list)
+
+    def add(self, table: str, rows: List[dict]) -> None:
+        if self.enabled and rows:
+            with self._lock:
+                self._pending[table].extend(rows)
+
+    def flush(self, now: Optional[datetime] = None) -> Dict[str, str]:
+        """
+        Writes the collected rows.
+
+        Returns:
+            Dict[str, str]: The file written for every table with changes.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(list)
+        now = now or datetime.utcnow()
+
+        written = {}
+        for table, rows in pending.items():
+            schema = table_schema(table)
+            columns = {name: [row.get(name) for row in rows] for name in schema.names[:-1]}
+            columns['exported_at'] = [now] * len(rows)
+            path = os.path.join(partition_path(self.root, table, now.date()),
+                                f"part-{now:%H%M%S}-{uuid.uuid4().hex[:8]}.parquet")
+            write_atomic(pa.Table.from_pydict(columns, schema=schema), path)
+            written[table] = path
+        return written
+
+
+def compact_partition(path: str) -> Optional[str]:
+    """
+    Merges the files of a partition into one file sorted by export time.
+
+    The merged file is written atomically before its sources are removed, and lists
+    them in its metadata. Sources left behind by an interrupted compaction are removed
+    on the next run, so rows are never lost and only briefly duplicated.
+
+    Returns:
+        Optional[str]: The name of the merged file, or None if there was nothing to merge.
+    """
+    names = partition_files(path)
+    for name in names:
+        if name.startswith('compacted-'):
+            metadata = pq.read_schema(os.path.join(path, name)).metadata or {}
+            for source in json.loads(metadata.get(COMPACTED_FROM, b'[]')):
+                if source in names and source != name:
+                    os.remove(os.path.join(path, source))
+
+    names = partition_files(path)
+    if len(names) <= 1:
+        return None
+
+    tables = [pq.read_table(os.path.join(path, name)).replace_schema_metadata(None) for name in names]
+    # Files written before a column was added lack it: their rows read as null there
+    merged = pa.concat_tables(tables, promote_options='default').sort_by('exported_at')
+    merged = merged.replace_schema_metadata({COMPACTED_FROM: json.dumps(names)})
+    output = f"compacted-{uuid.uuid4().hex[:8]}.parquet"
+    write_atomic(merged, os.path.join(path, output))
+    for name in names:
+        os.remove(os.path.join(path, name))
+    return output
+
+
+def compact(root: str, before: date) -> List[str]:
+    """
+    Compacts the partitions of every table dated before `before`, which no longer receive rows.
+
+    Returns:
+        List[str]: The partitions that were compacted.
+    """
+    compacted = []
+    if pa is None or not os.path.isdir(root):
+        return compacted
+    for table in sorted(os.listdir(root)):
+        table_path = os.path.join(root, table)
+        if not os.path.isdir(table_path):
+            continue
+        for partition in sorted(os.listdir(table_path)):
+            if not partition.startswith('date=') or date.fromisoformat(partition[len('date='):]) >= before:
+                continue
+            if compact_partition(os.path.join(table_path, partition)):
+                compacted.append(os.path.join(table, partition))
+    return compacted
+
+
+changes = ChangeExporter(export_dir, export_enabled)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compacts the partitions of the Parquet export.")
+    parser.add_argument('--root', default=export_dir)
+    parser.add_argument('--before', type=date.fromisoformat, default=datetime.utcnow().date(),
+                        help="compact the partitions dated before this UTC date (default: today)")
+    args = parser.parse_args()
+
+    if pa is None:
+        raise SystemExit("pyarrow is required to compact the export")
+    for partition in compact(args.root, args.before):
+        print(f"compacted {partition}")
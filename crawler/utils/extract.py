@@ -1,79 +1,98 @@
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup
-import pandas as pd
-from typing import Tuple, List
+from bs4.element import Tag
+from typing import Dict, Iterator, List, Optional
+from utils.model import ShipStatus, ShipEvent
 
-def extract_ship_data(html: str, ids: list[str], cols: list[str]) -> Tuple[bool, pd.DataFrame]:
+def _index_ids(html: str) -> Dict[str, Tag]:
     """
-    Extracts ship data from the given HTML content based on specified IDs.
-
-    Args:
-        html (str): The HTML content of the webpage.
-        ids (List[str]): A list of HTML element IDs to find the ship data.
-        cols (List[str]): A list of column names for the resulting DataFrame.
-
-    Returns:
-        Tuple[bool, pd.DataFrame]: A tuple where the first element is a boolean indicating
-                                   whether the extraction was successful, and the second element
-                                   is a DataFrame containing the extracted data.
+    Parses the HTML once and maps every element id to its (first) element.
     """
-    
     soup = BeautifulSoup(html, 'html.parser')
+    elements = {}
+    for element in soup.find_all(id=True):
+        elements.setdefault(element['id'], element)
+    return elements
+
+def _ship_row(elements: Dict[str, Tag], id_prefix: str, row: int, cols: list[str]) -> Optional[ShipStatus]:
     data = []
-    for id in ids:
-        content = soup.find(id=id)
-        if content:
-            cleaned_content = content.get_text(strip=True)
-            img = content.find('img')
-            if img and 'src' in img.attrs:
-                img_src = img['src']
-                if 'ok.png' in img_src:
-                    cleaned_content += 'YES'
-                elif 'red.gif' in img_src:
-                    cleaned_content += 'RED'
-            if cleaned_content == '':
-                cleaned_content = 'NO'
-            data.append(cleaned_content)
-        else:
-            return False, pd.DataFrame()
-    return True, pd.DataFrame([data], columns=cols)
+    for num in range(len(cols)):
+        content = elements.get(f"{id_prefix}{row}_{num}")
+        if content is None:
+            return None
+        cleaned_content = content.get_text(strip=True)
+        img = content.find('img')
+        if img and 'src' in img.attrs:
+            img_src = img['src']
+            if 'ok.png' in img_src:
+                cleaned_content += 'YES'
+            elif 'red.gif' in img_src:
+                cleaned_content += 'RED'
+        if cleaned_content == '':
+            cleaned_content = 'NO'
+        data.append(cleaned_content)
+    return ShipStatus(data[0], data[1], data[2], data[3:])
+
+class ShipGridParser:
+    """
+    Extracts the ships of the paged ship grid one page at a time.
+
+    Every page is indexed as it is fed, the first element of an id winning as if the
+    pages were joined, and the rows completed so far are yielded right away. The
+    ships of the first pages can then be fetched while the next ones are paged in.
 
-def extract_event_data(html: str, cols: list[str]) -> Tuple[bool, pd.DataFrame]:
+    Args:
+        id_prefix (str): The prefix of the grid cell ids, followed by `{row}_{column}`.
+        cols (List[str]): The grid columns, used to know how many cells a row has.
+    """
+
+    def __init__(self, id_prefix: str, cols: list[str]):
+        self.id_prefix = id_prefix
+        self.cols = cols
+        self._elements: Dict[str, Tag] = {}
+        self._next_row = 0
+
+    def feed(self, html: str) -> Iterator[ShipStatus]:
+        """
+        Indexes a page, and yields the ships of the rows it completes, stopping at the
+        first incomplete row.
+        """
+        for element_id, element in _index_ids(html).items():
+            self._elements.setdefault(element_id, element)
+        while True:
+            ship = _ship_row(self._elements, self.id_prefix, self._next_row, self.cols)
+            if ship is None:
+                return
+            yield ship
+            self._next_row += 1
+
+def extract_event_data(html: str, voyage_number: str, cols: list[str]) -> List[ShipEvent]:
     """
     Extracts event data from the given HTML content.
 
     Args:
         html (str): The HTML content of the webpage.
+        voyage_number (str): The voyage the events belong to.
+        cols (List[str]): The event grid columns, used to know how many cells a row has.
 
     Returns:
-        Tuple[bool, List[str]]: A tuple where the first element is a boolean indicating
-                                whether the extraction was successful, and the second element
-                                is a list of event data.
+        List[ShipEvent]: The events in grid order.
     """
-
-    soup = BeautifulSoup(html, 'html.parser')
-    result_df = pd.DataFrame(columns=cols)
+    elements = _index_ids(html)
     event_id_prefix = 'ASPx_船舶事件_tccell'
 
+    events = []
     event_num = 0
-    done = False
     while True:
         event_data = []
-        event_ids = [f"{event_id_prefix}{event_num}_{num}" for num in range(0, 7)]
-
-        for event_id in event_ids:
-            content = soup.find(id=event_id)
-            if content:
-                event_data.append(content.get_text(strip=True))
-            else:
-                done = True
-                break
-
-        if done:
-            break
-        result_df = pd.concat([result_df, pd.DataFrame([event_data], columns=cols)], ignore_index=True)
-        event_num += 1
+        for num in range(len(cols)):
+            content = elements.get(f"{event_id_prefix}{event_num}_{num}")
+            if content is None:
+                return events
+            event_data.append(content.get_text(strip=True))
 
-    return True, result_df
+        events.append(ShipEvent(voyage_number, *event_data))
+        event_num += 1
 
 def extract_miles_data(html: str, cols: List[str]) -> List[str]:
     """
@@ -104,4 +123,98 @@ def extract_miles_data(html: str, cols: List[str]) -> List[str]:
     if len(event_data) != len(cols):
         raise ValueError(f"Mismatch between extracted data ({len(event_data)}) and provided columns ({len(cols)})")
     
-    return event_data
\ No newline at end of file
+    return event_data
+
+# Marks a <br> among the text parts of a cell
+LINE_BREAK = None
+
+
+def _rendered_text(parts: List[Optional[str]]) -> str:
+    """
+    The text of a cell as Selenium's `.text` renders it: whitespace collapsed within
+    each line, and a newline for every <br>.
+    """
+    lines, line = [], []
+    for part in parts + [LINE_BREAK]:
+        if part is LINE_BREAK:
+            lines.append(' '.join(''.join(line).split()))
+            line = []
+        else:
+            line.append(part)
+    return '\n'.join(lines).strip()
+
+
+class _BerthOrderGridParser(HTMLParser):
+    """
+    Streams through the oh015 page once, collecting the DevExpress grid header
+    texts and the cells of every data row, without building a DOM.
+    """
+
+    HEADER_CLASS = 'dxgvHeader_PlasticBlue'
+    ROW_CLASS = 'dxgvDataRow_PlasticBlue'
+    CELL_CLASS = 'dxgv'
+
+    def __init__(self):
+        super().__init__()
+        self.headers: List[str] = []
+        self.rows: List[List[str]] = []
+        self._row: List[str] = None
+        self._row_depth = 0
+        # The element whose text is being collected: (tag, nesting depth, text parts, target list)
+        self._capture = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._capture is not None:
+            if tag == self._capture[0]:
+                self._capture[1] += 1
+            elif tag == 'br':
+                self._capture[2].append(LINE_BREAK)
+            return
+
+        classes = (dict(attrs).get('class') or '').split()
+        if self._row is not None:
+            if tag == 'tr':
+                self._row_depth += 1
+            elif self.CELL_CLASS in classes:
+                self._capture = [tag, 1, [], self._row]
+        elif tag == 'tr' and self.ROW_CLASS in classes:
+            self._row = []
+            self._row_depth = 1
+        elif self.HEADER_CLASS in classes:
+            self._capture = [tag, 1, [], self.headers]
+
+    def handle_endtag(self, tag):
+        if self._capture is not None:
+            if tag == self._capture[0]:
+                self._capture[1] -= 1
+                if self._capture[1] == 0:
+                    self._capture[3].append(_rendered_text(self._capture[2]))
+                    self._capture = None
+            return
+
+        if self._row is not None and tag == 'tr':
+            self._row_depth -= 1
+            if self._row_depth == 0:
+                self.rows.append(self._row)
+                self._row = None
+
+    def handle_data(self, data):
+        if self._capture is not None:
+            self._capture[2].append(data)
+
+
+def extract_berth_order_data(html: str) -> List[Dict[str, str]]:
+    """
+    Extracts the berth order grid rows from the oh015 page in a single pass.
+
+    Args:
+        html (str): The HTML content of the webpage.
+
+    Returns:
+        List[Dict[str, str]]: One dictionary per grid row, keyed by the grid headers,
+                              as scraped from the page by Selenium.
+    """
+    parser = _BerthOrderGridParser()
+    parser.feed(html)
+    parser.close()
+    return [dict(zip(parser.headers, row)) for row in parser.rows]
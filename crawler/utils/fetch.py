@@ -1,73 +1,57 @@
-import csv
-import time
-import requests
-import pandas as pd
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
+from typing import Iterator
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from config import browser_wait_timeout
+from utils.browser import browser_pool
+from utils.throttle import fetch_controller
+from utils.extract import extract_berth_order_data
 
-def fetch_ship_webpage(url: str) -> str:
+def iter_ship_webpages(url: str) -> Iterator[str]:
     """
-    Fetches the content of the ship data webpage using Selenium.
+    Pages through the ship data grid using Selenium.
 
     Args:
         url (str): The URL of the webpage to fetch.
 
-    Returns:
-        str: The HTML content of the webpage if the request is successful, None otherwise.
+    Yields:
+        str: The HTML content of every page of the grid, as soon as it is rendered.
+             Nothing if the request is not successful.
     """
 
-    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
-
-    # Set up the Chrome WebDriver to run in headless mode (in docker container)
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--window-size=1920x1080")
-
-    # Use the ChromeDriverManager to automatically download the correct version of the ChromeDriver
-    service = Service('/usr/bin/chromedriver')
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-    driver.get(url)
-    
-    # Will concat all the pages
-    html = driver.page_source
-    
-    i = 0
-    while True:
-        try:
-            button = driver.find_element(By.ID, 'ASPx_船舶即時動態_DXPagerBottom_PBN')
-        except:
-            break
-        if i%20 == 19:
-            button.click()
-            time.sleep(5)
-
-            html += driver.page_source
-            button = driver.find_element(By.ID, 'ASPx_船舶即時動態_DXPagerBottom_PBN')
-
-            if button.get_attribute('onclick') == None:
+    response = fetch_controller.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+    if response.status_code != 200:
+        print(f"Failed to retrieve the webpage. Status code: {response.status_code}")
+        return
+
+    with browser_pool.session() as driver:
+        driver.get(url)
+        yield driver.page_source
+
+        while True:
+            try:
+                button = driver.find_element(By.ID, 'ASPx_船舶即時動態_DXPagerBottom_PBN')
+            except NoSuchElementException:
+                break
+            # The next-page button of the last page has no callback: clicking it would not
+            # re-render the pager, and the wait below would time out
+            if button.get_attribute('onclick') is None:
                 break
+            driver.execute_script("arguments[0].click();", button)
 
-        i = i+1
+            # The grid callback re-renders the pager, wait for it instead of sleeping
+            try:
+                WebDriverWait(driver, browser_wait_timeout).until(EC.staleness_of(button))
+            except TimeoutException:
+                print("Timed out waiting for the next page of the ship grid")
+
+            yield driver.page_source
 
-    driver.close()
-    if response.status_code == 200:
-        return html
-    else:
-        print(f"Failed to retrieve the webpage. Status code: {response.status_code}")
-        return None
 
 def fetch_webpage(url: str) -> str:
     """
-    Fetches the content of a webpage.
+    Fetches the content of a webpage, within the adaptive concurrency limit of its endpoint.
 
     Args:
         url (str): The URL of the webpage to fetch.
@@ -76,7 +60,7 @@ def fetch_webpage(url: str) -> str:
         str: The HTML content of the webpage if the request is successful, None otherwise.
     """
 
-    response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'})
+    response = fetch_controller.get(url, headers={'User-Agent': 'Mozilla/5.0'})
     if response.status_code == 200:
         return response.text
     else:
@@ -85,7 +69,7 @@ def fetch_webpage(url: str) -> str:
 
 def fetch_ship_berth_order(url: str) -> list[dict]:
     """
-    Fetches data from the Kaohsiung Port website using Selenium.
+    Fetches the berth order grid, over plain HTTP when possible and with Selenium otherwise.
 
     Args:
         url (str): The URL of the webpage to fetch data from.
@@ -93,44 +77,65 @@ def fetch_ship_berth_order(url: str) -> list[dict]:
     Returns:
         list[dict]: A list of dictionaries containing the scraped data.
     """
-    # Set up the Chrome WebDriver to run in headless mode (in docker container)
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--window-size=1920x1080")
-    # Use the ChromeDriverManager to automatically download the correct version of the ChromeDriver
-    service = Service('/usr/bin/chromedriver')
-    driver = webdriver.Chrome(service=service, options=chrome_options)
+    data = fetch_ship_berth_order_http(url)
+    if data:
+        return data
 
-    try:
-        # Navigate to the website
-        driver.get(url)
-        # Wait for the table to load
-        table = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CLASS_NAME, "dxgvControl_PlasticBlue"))
-        )
-        # Create a list to store table data
-        data = []
-
-        # Extract table headers
-        headers = [th.text.strip() for th in table.find_elements(By.CLASS_NAME, "dxgvHeader_PlasticBlue")]
-
-        # Extract data from table rows
-        rows = table.find_elements(By.CSS_SELECTOR, ".dxgvDataRow_PlasticBlue, .dxgvDataRow_PlasticBlue.dxgvDataRowAlt_PlasticBlue")
-        
-        for row in rows:
-            # Extract data from each cell
-            row_data = [td.text.strip() for td in row.find_elements(By.CLASS_NAME, "dxgv")]
-            data.append(dict(zip(headers, row_data)))
+    print("Berth order grid not found over HTTP, falling back to Selenium")
+    return fetch_ship_berth_order_selenium(url)
 
-        return data
+def fetch_ship_berth_order_http(url: str) -> list[dict]:
+    """
+    Fetches the berth order grid by downloading the page and parsing the rendered grid rows.
+
+    Args:
+        url (str): The URL of the webpage to fetch data from.
 
+    Returns:
+        list[dict]: A list of dictionaries containing the scraped data, empty if the page
+                    could not be fetched or holds no grid rows.
+    """
+    try:
+        html = fetch_webpage(url)
+        return extract_berth_order_data(html) if html else []
     except Exception as e:
         print(f"Error: {str(e)}")
         return []
 
-    finally:
-        # Close the browser
-        driver.quit()
+def fetch_ship_berth_order_selenium(url: str) -> list[dict]:
+    """
+    Fetches data from the Kaohsiung Port website using Selenium.
+
+    Args:
+        url (str): The URL of the webpage to fetch data from.
+
+    Returns:
+        list[dict]: A list of dictionaries containing the scraped data.
+    """
+    try:
+        with browser_pool.session() as driver:
+            # Navigate to the website
+            driver.get(url)
+            # Wait for the table to load
+            table = WebDriverWait(driver, browser_wait_timeout).until(
+                EC.presence_of_element_located((By.CLASS_NAME, "dxgvControl_PlasticBlue"))
+            )
+            # Create a list to store table data
+            data = []
+
+            # Extract table headers
+            headers = [th.text.strip() for th in table.find_elements(By.CLASS_NAME, "dxgvHeader_PlasticBlue")]
+
+            # Extract data from table rows
+            rows = table.find_elements(By.CSS_SELECTOR, ".dxgvDataRow_PlasticBlue, .dxgvDataRow_PlasticBlue.dxgvDataRowAlt_PlasticBlue")
+            
+            for row in rows:
+                # Extract data from each cell
+                row_data = [td.text.strip() for td in row.find_elements(By.CLASS_NAME, "dxgv")]
+                data.append(dict(zip(headers, row_data)))
+
+            return data
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return []
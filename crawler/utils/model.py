@@ -0,0 +1,138 @@
+from sys import intern
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return intern(value) if value else value
+
+
+class ShipStatus:
+    """
+    A row of the ship status grid (UA1007).
+
+    Ship names, event names and the stage flags repeat across rows and cycles,
+    so they are interned and shared instead of being stored once per row.
+    """
+    __slots__ = ('voyage_number', 'ship_name', 'latest_event', 'stages')
+
+    def __init__(self, voyage_number: str, ship_name: str, latest_event: str, stages: Sequence[str]):
+        self.voyage_number = voyage_number
+        self.ship_name = _intern(ship_name)
+        self.latest_event = _intern(latest_event)
+        self.stages = tuple(intern(stage) for stage in stages)
+
+    @property
+    def ship_id(self) -> str:
+        return self.voyage_number[:6]
+
+    @property
+    def voyage(self) -> str:
+        return self.voyage_number[6:10]
+
+    def as_row(self) -> Tuple[str, ...]:
+        return (self.voyage_number, self.ship_name, self.latest_event) + self.stages
+
+
+class ShipEvent:
+    """
+    A row of the event grid (UA3007) of one voyage.
+    """
+    __slots__ = ('voyage_number', 'source', 'time', 'name', 'navigation_status',
+                 'pilot_order_number', 'berth_number', 'content')
+
+    def __init__(self, voyage_number: str, source: str, time: str, name: str, navigation_status: str,
+                 pilot_order_number: str, berth_number: str, content: str):
+        self.voyage_number = voyage_number
+        self.source = _intern(source)
+        self.time = time
+        self.name = _intern(name)
+        self.navigation_status = _intern(navigation_status)
+        self.pilot_order_number = pilot_order_number
+        self.berth_number = _intern(berth_number)
+        self.content = content
+
+
+class ShipPassTime:
+    """
+    The 10 and 5 nautical miles passage times (UA5007) of one voyage.
+    """
+    __slots__ = ('voyage_number', 'pass_10_miles', 'pass_5_miles')
+
+    def __init__(self, voyage_number: str, pass_10_miles: str, pass_5_miles: str):
+        self.voyage_number = voyage_number
+        self.pass_10_miles = pass_10_miles
+        self.pass_5_miles = pass_5_miles
+
+    def as_row(self) -> Tuple[str, str, str]:
+        return (self.voyage_number, self.pass_10_miles, self.pass_5_miles)
+
+
+class BerthOrder:
+    """
+    A row of the berth order grid (oh015).
+
+    The grid headers come from the page, so a row keeps its cell values in page order
+    next to a headers tuple shared by every row of the same scrape.
+    """
+    __slots__ = ('headers', 'values')
+
+    INTERNED_HEADERS = ('船席', '動態', '中文船名', '英文船名', '港代理')
+
+    def __init__(self, headers: Tuple[str, ...], values: Sequence[str]):
+        self.headers = headers
+        self.values = tuple(
+            _intern(value) if header in self.INTERNED_HEADERS else value
+            for header, value in zip(headers, values)
+        )
+
+    def get(self, header: str, default: Optional[str] = None) -> Optional[str]:
+        try:
+            return self.values[self.headers.index(header)]
+        except (ValueError, IndexError):
+            return default
+
+    @property
+    def key(self) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        return (self.get('船席'), self.get('動態'), self.get('中文船名'))
+
+    def as_row(self) -> Tuple[str, ...]:
+        return self.values
+
+    @classmethod
+    def from_dicts(cls, rows: Iterable[Dict[str, str]]) -> List['BerthOrder']:
+        """
+        Builds berth order records from the scraped header -> cell dictionaries.
+
+        Args:
+            rows (Iterable[Dict[str, str]]): The scraped rows, all sharing the same headers.
+
+        Returns:
+            List[BerthOrder]: One record per row, sharing one headers tuple.
+        """
+        records = []
+        headers: Tuple[str, ...] = ()
+        for row in rows:
+            if tuple(row) != headers:
+                headers = tuple(intern(header) for header in row)
+            records.append(cls(headers, tuple(row.values())))
+        return records
+
+
+def drop_duplicate_berth_orders(records: List[BerthOrder]) -> List[BerthOrder]:
+    """
+    Keeps only the last record of each (船席, 動態, 中文船名), preserving page order.
+
+    Args:
+        records (List[BerthOrder]): The scraped berth order records.
+
+    Returns:
+        List[BerthOrder]: The de-duplicated records.
+    """
+    seen = set()
+    kept = []
+    for record in reversed(records):
+        if record.key not in seen:
+            seen.add(record.key)
+            kept.append(record)
+    kept.reverse()
+    return kept
@@ -0,0 +1,113 @@
+import queue
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Generic, Iterator, List, Optional, Sequence, TypeVar
+
+T = TypeVar('T')
+
+_CLOSED = object()
+
+
+class Channel(Generic[T]):
+    """
+    A closable queue that streams items from one stage to another.
+
+    Iterating a channel yields items as they are put, and stops once the
+    producer closes it. Every consumer needs its own channel.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+
+    def put(self, item: T) -> None:
+        self._queue.put(item)
+
+    def close(self) -> None:
+        self._queue.put(_CLOSED)
+
+    def __iter__(self) -> Iterator[T]:
+        while True:
+            item = self._queue.get()
+            if item is _CLOSED:
+                return
+            yield item
+
+
+class Stage:
+    """
+    A unit of the crawl cycle.
+
+    Args:
+        name (str): The name used in the logs and in the results of `run_stages`.
+        func (Callable[[], None]): The work of the stage.
+        deps (Sequence[str]): Stages that must finish successfully before this one starts.
+    """
+    __slots__ = ('name', 'func', 'deps')
+
+    def __init__(self, name: str, func: Callable[[], None], deps: Sequence[str] = ()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class StageResult:
+    __slots__ = ('name', 'duration', 'error', 'skipped')
+
+    def __init__(self, name: str, duration: float = 0.0, error: Optional[BaseException] = None, skipped: bool = False):
+        self.name = name
+        self.duration = duration
+        self.error = error
+        self.skipped = skipped
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.skipped
+
+
+def _now() -> str:
+    return (datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _run_stage(stage: Stage, deps: Dict[str, Future]) -> StageResult:
+    for name, future in deps.items():
+        if not future.result().ok:
+            print(f'{_now()} 略過 {stage.name}: {name} 未完成')
+            return StageResult(stage.name, skipped=True)
+
+    start = time.perf_counter()
+    try:
+        stage.func()
+    except Exception as e:
+        print(f'{_now()} {stage.name} 失敗: {str(e)}')
+        traceback.print_exc()
+        return StageResult(stage.name, time.perf_counter() - start, error=e)
+
+    result = StageResult(stage.name, time.perf_counter() - start)
+    print(f'{_now()} {stage.name} 完成 ({result.duration:.1f}s)')
+    return result
+
+
+def run_stages(stages: List[Stage]) -> Dict[str, StageResult]:
+    """
+    Runs the stages concurrently, each one as soon as its dependencies have finished.
+
+    A failing stage only skips the stages that depend on it; the others run to completion.
+
+    Args:
+        stages (List[Stage]): The stages, with every dependency listed before its dependents.
+
+    Returns:
+        Dict[str, StageResult]: The outcome of every stage by name.
+    """
+    futures: Dict[str, Future] = {}
+    # One thread per stage, so a stage waiting on its dependencies never starves them
+    with ThreadPoolExecutor(max_workers=max(len(stages), 1), thread_name_prefix='stage') as executor:
+        for stage in stages:
+            missing = [name for name in stage.deps if name not in futures]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown or later stages: {missing}")
+            futures[stage.name] = executor.submit(_run_stage, stage, {name: futures[name] for name in stage.deps})
+
+    return {name: future.result() for name, future in futures.items()}
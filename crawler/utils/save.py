@@ -1,19 +1,26 @@
 import os
-import pandas as pd
+import csv
 import psycopg2
-from psycopg2.extras import execute_batch
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional, Sequence
+from utils.model import ShipStatus, ShipEvent, ShipPassTime, BerthOrder
+from utils.export import changes
 
-def save_to_csv(df: pd.DataFrame, output_path: str) -> None:
+def save_to_csv(header: Sequence[str], rows: Iterable[Sequence[str]], output_path: str) -> None:
     """
-    Saves the given DataFrame to a CSV file.
+    Saves the given rows to a CSV file.
 
     Args:
-        df (pd.DataFrame): The DataFrame to save.
+        header (Sequence[str]): The column names written as the first line.
+        rows (Iterable[Sequence[str]]): The rows to save.
         output_path (str): The path where the CSV file will be saved.
     """
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df.to_csv(output_path, index=False)
+    with open(output_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
 
 def save_to_html(html: str, output_path: str) -> None:
     """
@@ -32,10 +39,20 @@ def get_db_connection():
         dbname=os.getenv('POSTGRES_DB'),
         user=os.getenv('POSTGRES_USER'),
         password=os.getenv('POSTGRES_PASSWORD'),
-        host='db'
+        host=os.getenv('POSTGRES_HOST', 'db')
     )
 
-def save_to_db(df: pd.DataFrame, table_name: str) -> None:
+def save_to_db(records: Sequence, table_name: str) -> List[dict]:
+    """
+    Upserts the records and queues the rows that actually changed for the Parquet export.
+
+    Args:
+        records (Sequence): The records of the table.
+        table_name (str): The table to save to.
+
+    Returns:
+        List[dict]: The inserted or updated rows, as stored.
+    """
     save_functions = {
         'ship_status': save_ship_status_to_db,
         'ship_berth_order': save_ship_berth_order_to_db,
@@ -44,29 +61,32 @@ def save_to_db(df: pd.DataFrame, table_name: str) -> None:
     }
     save_function = save_functions.get(table_name)
     if save_function:
-        save_function(df)
+        rows = save_function(records)
     else:
         raise ValueError(f"Unsupported table name: {table_name}")
+    changes.add(table_name, rows)
+    return rows
 
-def save_ship_status_to_db(df: pd.DataFrame) -> None:
+def save_ship_status_to_db(ships: Sequence[ShipStatus]) -> List[dict]:
     query = '''
         INSERT INTO ship_status (ship_voyage_number, ship_name, latest_event)
-        VALUES (%s, %s, %s)
+        VALUES %s
         ON CONFLICT (ship_voyage_number) DO UPDATE SET
             ship_name = EXCLUDED.ship_name,
             latest_event = EXCLUDED.latest_event,
             updated_at = CURRENT_TIMESTAMP
         WHERE EXCLUDED.latest_event != ship_status.latest_event
+        RETURNING *
     '''
-    data = [(row['船編航次'], row['船名'], row['最新事件']) for _, row in df.iterrows()]
-    execute_batch_query(query, data)
+    data = [(ship.voyage_number, ship.ship_name, ship.latest_event) for ship in ships]
+    return execute_upsert_query(query, data, key=lambda row: row[0])
 
-def save_ship_berth_order_to_db(df: pd.DataFrame) -> None:
+def save_ship_berth_order_to_db(orders: Sequence[BerthOrder]) -> List[dict]:
     query = '''
         INSERT INTO ship_berth_order (
             berth_number, berthing_time, ship_status, pilotage_time,
             ship_name_chinese, ship_name_english, port_agent
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ) VALUES %s
         ON CONFLICT (berth_number, ship_name_chinese, ship_status) DO UPDATE SET
             berthing_time = EXCLUDED.berthing_time,
             pilotage_time = EXCLUDED.pilotage_time,
@@ -77,22 +97,23 @@ def save_ship_berth_order_to_db(df: pd.DataFrame) -> None:
         OR EXCLUDED.pilotage_time != ship_berth_order.pilotage_time
         OR EXCLUDED.ship_name_english != ship_berth_order.ship_name_english
         OR EXCLUDED.port_agent != ship_berth_order.port_agent
+        RETURNING *
     '''
 
-    data = [(row['船席'], 
-             convert_time(row['靠泊時間']),
-             row['動態'], 
-             convert_time(row['引水時間']),
-             row['中文船名'], 
-             row['英文船名'], 
-             row['港代理']) for _, row in df.iterrows()]
+    data = [(order.get('船席'), 
+             convert_time(order.get('靠泊時間')),
+             order.get('動態'), 
+             convert_time(order.get('引水時間')),
+             order.get('中文船名'), 
+             order.get('英文船名'), 
+             order.get('港代理')) for order in orders]
     
-    execute_batch_query(query, data)
+    return execute_upsert_query(query, data, key=lambda row: (row[0], row[4], row[2]))
 
-def save_ship_pass_time_to_db(df: pd.DataFrame) -> None:
+def save_ship_pass_time_to_db(pass_times: Sequence[ShipPassTime]) -> List[dict]:
     query = '''
         INSERT INTO ship_voyage (ship_voyage_number, pass_10_miles_time, pass_5_miles_time)
-        VALUES (%s, %s, %s)
+        VALUES %s
         ON CONFLICT (ship_voyage_number) DO UPDATE
         SET pass_10_miles_time = COALESCE(EXCLUDED.pass_10_miles_time, ship_voyage.pass_10_miles_time),
             pass_5_miles_time = COALESCE(EXCLUDED.pass_5_miles_time, ship_voyage.pass_5_miles_time),
@@ -100,13 +121,35 @@ def save_ship_pass_time_to_db(df: pd.DataFrame) -> None:
         WHERE 
             (EXCLUDED.pass_10_miles_time IS DISTINCT FROM ship_voyage.pass_10_miles_time)
             OR (EXCLUDED.pass_5_miles_time IS DISTINCT FROM ship_voyage.pass_5_miles_time)
+        RETURNING *
     '''
 
-    data = [(row['船編航次'], 
-             convert_time(row['10浬']), 
-             convert_time(row['5浬'])) 
-            for _, row in df.iterrows()]
-    execute_batch_query(query, data)
+    data = [(pass_time.voyage_number, 
+             convert_time(pass_time.pass_10_miles), 
+             convert_time(pass_time.pass_5_miles)) 
+            for pass_time in pass_times]
+    return execute_upsert_query(query, data, key=lambda row: row[0])
+
+def refresh_analytics() -> Optional[int]:
+    """
+    Refreshes the ETA accuracy and berth time analytics (analytics.sql) from the events
+    and passage times saved since the previous refresh.
+
+    Returns:
+        Optional[int]: The number of voyages refreshed, or None if analytics.sql has not
+                       been applied to the database.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regprocedure('refresh_ship_analytics()') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute('SELECT refresh_ship_analytics()')
+                refreshed = cur.fetchone()[0]
+            else:
+                refreshed = None
+        conn.commit()
+    conn.close()
+    return refreshed
 
 def convert_time(time_str):
     if time_str in ['待接靠', 'null', '', None]:
@@ -122,12 +165,12 @@ def convert_time(time_str):
         return utc_time.strftime("%Y-%m-%d %H:%M:%S")
     return time_str
 
-def save_ship_events_to_db(df: pd.DataFrame) -> None:
+def save_ship_events_to_db(events: Sequence[ShipEvent]) -> List[dict]:
     query = '''
         INSERT INTO ship_events (
             ship_voyage_number, event_source, event_time, event_name, 
             navigation_status, pilot_order_number, berth_number, event_content_time
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ) VALUES %s
         ON CONFLICT (ship_voyage_number, event_time, event_name) DO UPDATE SET
             event_source = EXCLUDED.event_source,
             navigation_status = EXCLUDED.navigation_status,
@@ -137,24 +180,25 @@ def save_ship_events_to_db(df: pd.DataFrame) -> None:
         WHERE (EXCLUDED.event_content_time IS DISTINCT FROM ship_events.event_content_time)
             OR (EXCLUDED.event_content_time IS NULL AND ship_events.event_content_time IS NOT NULL)
             OR (EXCLUDED.event_content_time IS NOT NULL AND ship_events.event_content_time IS NULL)
+        RETURNING *
     '''
     
-    def process_row(row):
-        event_time = convert_to_24h_timestamp(row['發生時間'])
-        event_content_time = convert_to_timestamp(row['事件內容'])
+    def process_row(event):
+        event_time = convert_to_24h_timestamp(event.time)
+        event_content_time = convert_to_timestamp(event.content)
         return (
-            row['船編航次'],
-            row['事件來源'],
+            event.voyage_number,
+            event.source,
             (datetime.strptime(event_time, "%Y-%m-%d %H:%M:%S") - timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S"),
-            row['事件名稱'],
-            row['航行狀態'],
-            row['引水單序號'],
-            row['碼頭代碼'],
+            event.name,
+            event.navigation_status,
+            event.pilot_order_number,
+            event.berth_number,
             (datetime.strptime(event_content_time, "%Y-%m-%d %H:%M:%S") - timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S") if event_content_time else None
         )
 
-    data = [process_row(row) for _, row in df.iterrows()]
-    execute_batch_query(query, data)
+    data = [process_row(event) for event in events]
+    return execute_upsert_query(query, data, key=lambda row: (row[0], row[2], row[3]))
 
 def convert_to_24h_timestamp(time_str):
     date, time = time_str.split(' ', 1)
@@ -184,8 +228,27 @@ def convert_to_timestamp(time_str):
     except:
         return None
 
-def execute_batch_query(query: str, data: list) -> None:
+def execute_upsert_query(query: str, data: list, key: Callable) -> List[dict]:
+    """
+    Runs an `INSERT ... VALUES %s ... RETURNING *` upsert for all the rows in one statement.
+
+    A statement may not update the same row twice, so only the last of the rows sharing
+    a conflict key is kept.
+
+    Args:
+        query (str): The upsert, with a single `VALUES %s` placeholder.
+        data (list): The rows to upsert.
+        key (Callable): Returns the conflict key of a row.
+
+    Returns:
+        List[dict]: The rows actually inserted or updated.
+    """
+    data = list({key(row): row for row in data}.values())
+    if not data:
+        return []
     with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            execute_batch(cur, query, data)
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            rows = execute_values(cur, query, data, fetch=True)
         conn.commit()
+    conn.close()
+    return rows
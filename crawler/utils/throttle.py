@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (fetch_timeout, fetch_min_concurrency, fetch_initial_concurrency, fetch_max_concurrency,
+                    fetch_target_latency)
+
+# Responses that mean the site is overloaded, rather than that the page is missing
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504}
+# Cycles kept in the health file to compute the SLO attainment
+CYCLE_HISTORY = 100
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class AdaptiveLimiter:
+    """
+    Limits the requests in flight to one endpoint, with an AIMD limit.
+
+    Every successful response below `target_latency` raises the limit by 1/limit, i.e.
+    by one per window of `limit` requests. A timeout, a connection error, an overload
+    status or a slow response halves it. Requests started before the last decrease do
+    not decrease it again, so one slow period only counts once.
+
+    Args:
+        name (str): The endpoint, e.g. UA3007.aspx.
+        initial (float): The starting limit.
+        minimum (int): The lowest limit.
+        maximum (int): The highest limit.
+        target_latency (float): Seconds above which a response counts as congestion.
+    """
+
+    def __init__(self, name: str, initial: float, minimum: int, maximum: int, target_latency: float):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.decreases = 0
+        self.latencies: deque = deque(maxlen=500)
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        """
+        Waits until a request may start, and yields its start time.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        try:
+            yield time.monotonic()
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def record(self, started: float, ok: bool, overloaded: bool = False, timed_out: bool = False) -> None:
+        latency = time.monotonic() - started
+        with self._condition:
+            self.requests += 1
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+            if timed_out:
+                self.timeouts += 1
+
+            if overloaded or timed_out or latency > self.target_latency:
+                if started >= self._last_decrease:
+                    self.limit = max(float(self.minimum), self.limit / 2)
+                    self.decreases += 1
+                    self._last_decrease = time.monotonic()
+            elif ok:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def summary(self) -> dict:
+        latencies = list(self.latencies)
+        p50, p95 = _percentile(latencies, 50), _percentile(latencies, 95)
+        return {
+            'limit': round(self.limit, 2),
+            'requests': self.requests,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'decreases': self.decreases,
+            'p50_latency': round(p50, 3) if p50 is not None else None,
+            'p95_latency': round(p95, 3) if p95 is not None else None,
+        }
+
+
+class FetchController:
+    """
+    Sends the crawler's HTTP requests through one AIMD limiter per endpoint.
+
+    The learned limits are saved with the cycle durations to a health file, and restored
+    by the next cycle, which runs in a new process.
+    """
+
+    def __init__(self, timeout: float, initial: float, minimum: int, maximum: int, target_latency: float):
+        self.timeout = timeout
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+        self.cycles: List[dict] = []
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=maximum)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def limiter(self, url: str) -> AdaptiveLimiter:
+        name = urlsplit(url).path.rsplit('/', 1)[-1] or urlsplit(url).netloc
+        with self._lock:
+            if name not in self.limiters:
+                self.limiters[name] = AdaptiveLimiter(name, self.initial, self.minimum, self.maximum, self.target_latency)
+            return self.limiters[name]
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        GETs the URL once the endpoint's limit allows it, and feeds the outcome back to the limiter.
+
+        Raises:
+            requests.RequestException: On timeouts and connection errors, after recording them.
+        """
+        limiter = self.limiter(url)
+        with limiter.slot() as started:
+            try:
+                response = self._session.get(url, timeout=self.timeout, **kwargs)
+            except requests.Timeout:
+                limiter.record(started, ok=False, timed_out=True)
+                raise
+            except requests.ConnectionError:
+                limiter.record(started, ok=False, overloaded=True)
+                raise
+            limiter.record(started, ok=response.status_code == 200,
+                           overloaded=response.status_code in OVERLOAD_STATUS_CODES)
+            return response
+
+    def load(self, path: str) -> None:
+        """
+        Restores the limits and the cycle history saved by the previous run.
+        """
+        try:
+            with open(path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        for name, endpoint in saved.get('endpoints', {}).items():
+            self.limiters[name] = AdaptiveLimiter(name, endpoint.get('limit', self.initial),
+                                                  self.minimum, self.maximum, self.target_latency)
+        self.cycles = saved.get('cycles', [])[-CYCLE_HISTORY:]
+
+    def record_cycle(self, duration: float, interval: int) -> dict:
+        """
+        Records a cycle against the SLO of finishing within INTERVAL_TIME.
+
+        Returns:
+            dict: The cycle, with whether it met the SLO.
+        """
+        cycle = {
+            'finished_at': datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            'duration': round(duration, 1),
+            'interval': interval,
+            'within_slo': duration <= interval,
+            'endpoints': {name: limiter.summary() for name, limiter in self.limiters.items()},
+        }
+        self.cycles = (self.cycles + [cycle])[-CYCLE_HISTORY:]
+        return cycle
+
+    def slo_attainment(self) -> Optional[float]:
+        if not self.cycles:
+            return None
+        return sum(1 for cycle in self.cycles if cycle['within_slo']) / len(self.cycles)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'slo_attainment': self.slo_attainment(),
+                'endpoints': {name: limiter.summary() for name, limiter in self.limiters.items()},
+                'cycles': self.cycles,
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+fetch_controller = FetchController(fetch_timeout, fetch_initial_concurrency, fetch_min_concurrency,
+                                   fetch_max_concurrency, fetch_target_latency)
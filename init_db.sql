@@ -41,9 +41,12 @@ CREATE TABLE IF NOT EXISTS ship_events (
     pilot_order_number VARCHAR(20),
     berth_number VARCHAR(10),
     event_content_time TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE (ship_voyage_number, event_time, event_name)
 );
 
+CREATE INDEX IF NOT EXISTS ship_events_updated_at_idx ON ship_events (updated_at);
+
 -- Create the trigger function
 CREATE OR REPLACE FUNCTION update_timestamp()
 RETURNS TRIGGER AS $$
@@ -71,3 +74,8 @@ BEFORE UPDATE ON ship_berth_order
 FOR EACH ROW
 EXECUTE FUNCTION update_timestamp();
 
+-- Create the trigger for ship_events table
+CREATE TRIGGER update_ship_events_timestamp
+BEFORE UPDATE ON ship_events
+FOR EACH ROW
+EXECUTE FUNCTION update_timestamp();
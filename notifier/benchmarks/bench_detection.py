@@ -0,0 +1,141 @@
+"""
+Compares the notifier's change detection paths on a seeded database:
+
+  legacy: benchmarks/legacy_detection.py, the detection the notifier used before
+          (get_recent_ship_statuses + combine_ship_and_berth_and_port_agent
+          + get_berth_and_previous_pilotage_time_updated + notification_filter)
+  set:    get_notification_candidates (one query)
+
+The tables are created and seeded in a scratch database (dropped afterwards) next to
+POSTGRES_DB, so the benchmark can point at any server the notifier can reach. Run from
+the notifier directory with the usual POSTGRES_* variables:
+
+    POSTGRES_HOST=localhost python -m benchmarks.bench_detection --ships 3000 --events 30
+"""
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from psycopg2.extras import execute_values
+
+import main as notifier
+from benchmarks import legacy_detection as legacy
+from config import notification_mapping, INOUT_PILOTAGE_EVENTS
+
+BENCH_DB = 'portcdm_bench_detection'
+INIT_SQL = Path(__file__).resolve().parent.parent.parent / 'init_db.sql'
+
+SHIP_NAMES = [("永明", "YM WELLNESS"), ("長明", "EVER BRIGHT"), ("吉春", "ALS JUNO"), ("海安", "SEA PEACE")]
+PORT_AGENTS = ["陽明海運股份有限公司", "萬海航運公司", "長榮海運股份有限公司", "東方海外"]
+BERTHS = ["1042", "1043", "1120", "1121", "1070", "1075", "1108", "1115"]
+
+
+def seed(conn, ships: int, events: int, interval: int, rng: random.Random) -> None:
+    now = datetime.now()
+    event_names = []
+    for name in notification_mapping:
+        base = name.split(' (')[0]
+        if base in INOUT_PILOTAGE_EVENTS:
+            event_names.append((base, '進港' if '進港' in name else '出港'))
+        elif not name.startswith('通過'):
+            event_names.append((name, '進港'))
+
+    status_rows, voyage_rows, event_rows, berth_rows = [], [], [], []
+    for i in range(ships):
+        voyage_number = f"{100000 + i:06d}{i % 10000:04d}"
+        chinese, english = rng.choice(SHIP_NAMES)
+        chinese, english = f"{chinese}{i}號", f"{english} {i}"
+        # About a tenth of the fleet changed during the last interval
+        recent = rng.random() < 0.1
+        updated_at = now - timedelta(seconds=rng.uniform(0, interval) if recent else rng.uniform(interval * 2, 86400))
+        status_rows.append((voyage_number, chinese + english, 'x', updated_at))
+        voyage_rows.append((voyage_number, now - timedelta(hours=1), None, updated_at - timedelta(seconds=rng.uniform(0, 60))))
+        for n in range(events):
+            name, navigation_status = rng.choice(event_names)
+            event_time = updated_at - timedelta(minutes=(events - n) * 10)
+            if n == events - 1:
+                event_time = updated_at
+            event_rows.append((voyage_number, 'seed', event_time, name, navigation_status, f"{n:08d}", rng.choice(BERTHS),
+                               event_time + timedelta(hours=2)))
+        if rng.random() < 0.5:
+            berth_rows.append((rng.choice(BERTHS), None, '進港', now + timedelta(minutes=rng.randint(0, 2000)),
+                               chinese, english, rng.choice(PORT_AGENTS), updated_at))
+
+    with conn.cursor() as cur:
+        execute_values(cur, 'INSERT INTO ship_status (ship_voyage_number, ship_name, latest_event, updated_at) VALUES %s',
+                       status_rows)
+        execute_values(cur, 'INSERT INTO ship_voyage (ship_voyage_number, pass_10_miles_time, pass_5_miles_time, updated_at) VALUES %s',
+                       voyage_rows)
+        execute_values(cur, '''INSERT INTO ship_events (ship_voyage_number, event_source, event_time, event_name, navigation_status,
+                                   pilot_order_number, berth_number, event_content_time) VALUES %s ON CONFLICT DO NOTHING''',
+                       event_rows)
+        execute_values(cur, '''INSERT INTO ship_berth_order (berth_number, berthing_time, ship_status, pilotage_time,
+                                   ship_name_chinese, ship_name_english, port_agent, updated_at) VALUES %s ON CONFLICT DO NOTHING''',
+                       berth_rows)
+        cur.execute('ANALYZE')
+    conn.commit()
+
+
+def legacy_detection(interval: int) -> list:
+    rows = legacy.get_recent_ship_statuses(interval)
+    rows = legacy.combine_ship_and_berth_and_port_agent(rows)
+    for row in rows:
+        row['收件人'] = [stakeholder for stakeholder in notification_mapping.get(row['最新消息'], [])
+                        if legacy.notification_filter(row, stakeholder)]
+    rows.extend(legacy.get_berth_and_previous_pilotage_time_updated(interval))
+    return rows
+
+
+def set_detection(interval: int) -> list:
+    return notifier.get_notification_candidates(interval)
+
+
+def timed(func, interval: int, repeat: int):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = func(interval)
+        durations.append(time.perf_counter() - start)
+    return rows, sorted(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ships', type=int, default=3000)
+    parser.add_argument('--events', type=int, default=30, help="events per voyage")
+    parser.add_argument('--interval', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    admin = notifier.get_db_connection()
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS {BENCH_DB}')
+        cur.execute(f"CREATE DATABASE {BENCH_DB} ENCODING 'UTF8' TEMPLATE template0")
+
+    # Every connection opened by the notifier functions now goes to the scratch database
+    os.environ['POSTGRES_DB'] = BENCH_DB
+    try:
+        conn = notifier.get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute(INIT_SQL.read_text())
+        seed(conn, args.ships, args.events, args.interval, random.Random(args.seed))
+        conn.close()
+        print(f"{args.ships} ships, {args.events} events per voyage, {args.interval}s interval")
+
+        for name, func in (('legacy', legacy_detection), ('set', set_detection)):
+            rows, durations = timed(func, args.interval, args.repeat)
+            notified = sum(1 for row in rows if row.get('收件人'))
+            print(f"{name:>7}: {len(rows)} candidates ({notified} with recipients), "
+                  f"median {durations[len(durations) // 2] * 1000:.1f} ms, best {durations[0] * 1000:.1f} ms")
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {BENCH_DB}')
+        admin.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Callable, Dict, List, Optional, Sequence
+
+import requests
+
+from render import RenderedMessage
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after `failure_threshold` consecutive failures.
+
+    Once open, the breaker lets a single trial call through every `reset_timeout` seconds
+    (half-open); a success closes it again, a failure keeps it open.
+    """
+    __slots__ = ('failure_threshold', 'reset_timeout', 'failures', 'opened_at', '_trial')
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, failures: int = 0, opened_at: Optional[float] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = failures
+        self.opened_at = opened_at
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.time() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half-open' and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.time()
+        self._trial = False
+
+
+class Channel:
+    """
+    A delivery provider.
+
+    Subclasses map a stakeholder to the addresses it is reached on, build the payload
+    of a rendered message once per stakeholder, and send it. `send` is blocking and
+    raises on failure; the fan-out runs it in a worker thread.
+
+    Args:
+        name (str): The name used in the logs and the circuit breaker state.
+        timeout (float): Seconds a single send may take.
+        breaker (CircuitBreaker): The breaker guarding the provider.
+    """
+
+    def __init__(self, name: str, timeout: float, breaker: CircuitBreaker):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = breaker
+
+    def addresses(self, stakeholder: str) -> List[str]:
+        raise NotImplementedError
+
+    def prepare(self, message: RenderedMessage, stakeholder: Optional[str]):
+        return message.body
+
+    def send(self, payload, address: str) -> None:
+        raise NotImplementedError
+
+    def is_provider_failure(self, error: Exception) -> bool:
+        """
+        Whether a failed send means the provider is unavailable (a timeout, a connection
+        error or a 5xx answer), rather than that it refused one address, e.g. a revoked
+        token. Only the former count towards the circuit breaker.
+        """
+        if isinstance(error, requests.HTTPError):
+            return error.response is None or error.response.status_code >= 500
+        return isinstance(error, (requests.RequestException, OSError))
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+class LineNotifyChannel(Channel):
+    def __init__(self, url: str, tokens: Dict[str, Optional[str]], timeout: float, breaker: CircuitBreaker):
+        super().__init__('line', timeout, breaker)
+        self.url = url
+        self.tokens = tokens
+
+    def addresses(self, stakeholder: str) -> List[str]:
+        return [self.tokens[stakeholder]] if self.tokens.get(stakeholder) else []
+
+    def send(self, payload: str, address: str) -> None:
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Authorization': f'Bearer {address}'
+        }
+        response = requests.post(self.url, headers=headers, data={'message': payload}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class WebhookChannel(Channel):
+    """
+    POSTs every notification as JSON, once per stakeholder, to a single URL.
+    """
+
+    def __init__(self, url: str, timeout: float, breaker: CircuitBreaker):
+        super().__init__('webhook', timeout, breaker)
+        self.url = url
+
+    def addresses(self, stakeholder: str) -> List[str]:
+        return [self.url]
+
+    def prepare(self, message: RenderedMessage, stakeholder: Optional[str]) -> bytes:
+        return json.dumps({
+            'format': message.format,
+            'stakeholder': stakeholder,
+            'title': message.title,
+            'text': message.body,
+            'fields': message.fields,
+        }, ensure_ascii=False).encode('utf-8')
+
+    def send(self, payload: bytes, address: str) -> None:
+        response = requests.post(address, data=payload, headers={'Content-Type': 'application/json; charset=utf-8'},
+                                 timeout=self.timeout)
+        response.raise_for_status()
+
+
+class EmailChannel(Channel):
+    """
+    Sends mails through an SMTP relay, to the comma separated addresses of each stakeholder.
+    """
+
+    def __init__(self, host: str, port: int, sender: str, recipients: Dict[str, Optional[str]],
+                 timeout: float, breaker: CircuitBreaker):
+        super().__init__('email', timeout, breaker)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+
+    def addresses(self, stakeholder: str) -> List[str]:
+        return _split(self.recipients.get(stakeholder))
+
+    def prepare(self, message: RenderedMessage, stakeholder: Optional[str]) -> EmailMessage:
+        mail = EmailMessage()
+        mail['From'] = self.sender
+        mail['Subject'] = f"[PortCDM] {message.title}"
+        mail.set_content(message.body.lstrip('\n'))
+        return mail
+
+    def send(self, payload: EmailMessage, address: str) -> None:
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(payload, to_addrs=[address])
+
+    def is_provider_failure(self, error: Exception) -> bool:
+        # A refused recipient, or a permanent (5xx) answer to the mail itself, is not the relay's fault
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return False
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code < 500
+        return super().is_provider_failure(error)
+
+
+class SmsChannel(Channel):
+    """
+    Sends the one line title and the event time of a notification through an HTTP SMS gateway.
+    """
+
+    def __init__(self, url: str, api_key: Optional[str], recipients: Dict[str, Optional[str]],
+                 timeout: float, breaker: CircuitBreaker):
+        super().__init__('sms', timeout, breaker)
+        self.url = url
+        self.api_key = api_key
+        self.recipients = recipients
+
+    def addresses(self, stakeholder: str) -> List[str]:
+        return _split(self.recipients.get(stakeholder))
+
+    def prepare(self, message: RenderedMessage, stakeholder: Optional[str]) -> str:
+        return f"{message.title} {message.fields.get('事件時間', '')}".strip()
+
+    def send(self, payload: str, address: str) -> None:
+        headers = {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+        response = requests.post(self.url, json={'to': address, 'text': payload}, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class Delivery:
+    __slots__ = ('channel', 'address', 'label', 'payload', 'status')
+
+    def __init__(self, channel: Channel, address: str, label: str, payload):
+        self.channel = channel
+        self.address = address
+        self.label = label
+        self.payload = payload
+        # '成功', '失敗', '逾時', '熔斷' or '拒收' (the provider refused this address)
+        self.status: Optional[str] = None
+
+
+def _now() -> str:
+    return (datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _run_detached(func, *args) -> asyncio.Future:
+    """
+    Runs a blocking call in a daemon thread.
+
+    Unlike `asyncio.to_thread`, a call abandoned after its timeout is never joined, so
+    it cannot hold the notifier's exit back; the socket timeout of the send ends it.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(result, error):
+        if not future.done():
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def run():
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(resolve, result, error)
+        except RuntimeError:
+            # The loop is closed: nobody waits for this call any more
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+async def _deliver(delivery: Delivery) -> Delivery:
+    channel = delivery.channel
+    if not channel.breaker.allow():
+        delivery.status = '熔斷'
+        return delivery
+
+    try:
+        await asyncio.wait_for(_run_detached(channel.send, delivery.payload, delivery.address), channel.timeout)
+    except asyncio.TimeoutError:
+        delivery.status = '逾時'
+        channel.breaker.record_failure()
+    except Exception as e:
+        print(f'{_now()} {channel.name} 發送錯誤: {str(e)}')
+        if channel.is_provider_failure(e):
+            delivery.status = '失敗'
+            channel.breaker.record_failure()
+        else:
+            # The provider answered, it only refused this address
+            delivery.status = '拒收'
+            channel.breaker.record_success()
+    else:
+        delivery.status = '成功'
+        channel.breaker.record_success()
+    return delivery
+
+
+async def fan_out(deliveries: Sequence[Delivery]) -> List[Delivery]:
+    """
+    Sends deliveries concurrently, each bounded by the timeout of its channel and skipped
+    while the channel's circuit breaker is open.
+    """
+    return list(await asyncio.gather(*(_deliver(delivery) for delivery in deliveries)))
+
+
+class Dispatcher:
+    """
+    Sends the notifications through every channel, each channel from its own queue.
+
+    The deliveries of a notification are split by channel. Every channel's worker sends
+    its share of one notification at a time, concurrently, and then moves on to the next
+    one. Each channel keeps the order of the notifications, and a slow provider only
+    delays its own messages, never those of the other channels.
+
+    Usage, from a running event loop:
+
+        dispatcher = Dispatcher()
+        dispatcher.submit(deliveries, on_sent)
+        await dispatcher.join()
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: List[asyncio.Task] = []
+
+    def submit(self, deliveries: Sequence[Delivery], on_sent: Callable[[List[Delivery]], None]) -> None:
+        """
+        Queues the deliveries of one notification. `on_sent` is called with each channel's
+        share once it is sent.
+        """
+        by_channel: Dict[str, List[Delivery]] = {}
+        for delivery in deliveries:
+            by_channel.setdefault(delivery.channel.name, []).append(delivery)
+        for name, batch in by_channel.items():
+            if name not in self._queues:
+                self._queues[name] = asyncio.Queue()
+                self._workers.append(asyncio.create_task(self._work(self._queues[name])))
+            self._queues[name].put_nowait((batch, on_sent))
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch, on_sent = item
+            try:
+                on_sent(await fan_out(batch))
+            except Exception as e:
+                print(f'{_now()} {batch[0].channel.name} 發送錯誤: {str(e)}')
+
+    async def join(self) -> None:
+        """
+        Waits until every queued delivery is sent.
+        """
+        for queue in self._queues.values():
+            queue.put_nowait(None)
+        await asyncio.gather(*self._workers)
+
+
+def load_breakers(path: str, failure_threshold: int, reset_timeout: float) -> Dict[str, CircuitBreaker]:
+    """
+    Restores the circuit breakers saved by the previous notifier run, since every cycle is a new process.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = {}
+    return {name: CircuitBreaker(failure_threshold, reset_timeout, state.get('failures', 0), state.get('opened_at'))
+            for name, state in saved.items()}
+
+
+def save_breakers(path: str, breakers: Dict[str, CircuitBreaker]) -> None:
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({name: {'failures': b.failures, 'opened_at': b.opened_at} for name, b in breakers.items()}, f)
+    os.replace(tmp_path, path)
@@ -5,19 +5,58 @@ from typing import Dict, List
 # LINE Notify tokens                     #
 ##########################################
 # LINE Notify tokens
+line_notify_url = os.getenv('LINE_NOTIFY_URL', 'https://notify-api.line.me/api/notify')
 original_token = os.getenv('LINE_NOTIFY_TOKEN')
 
-line_notify_tokens = {
-    'Pilot': os.getenv('LINE_NOTIFY_TOKEN_PILOT'),
-    'CIQS': os.getenv('LINE_NOTIFY_TOKEN_CIQS'),
-    'Unmooring': os.getenv('LINE_NOTIFY_TOKEN_UNMOORING'),
-    'Tugboat': os.getenv('LINE_NOTIFY_TOKEN_TUGBOAT'),
-    'ShippingAgentWanHai': os.getenv('LINE_NOTIFY_TOKEN_SHIPPINGAGENT_WAN_HAI'),
-    'ShippingCompanyYangMing': os.getenv('LINE_NOTIFY_TOKEN_SHIPPINGCOMPANY_YANG_MING'),
-    'LoadingUnloading': os.getenv('LINE_NOTIFY_TOKEN_LOADINGUNLOADING_LIEN_HAI'),
-    'PierLienHai': os.getenv('LINE_NOTIFY_TOKEN_PIER_LIEN_HAI'),
-    'PierSelfOperated': os.getenv('LINE_NOTIFY_TOKEN_PIER_SELF_OPERATED')
+# Stakeholder -> suffix of its LINE_NOTIFY_TOKEN_*, EMAIL_TO_* and SMS_TO_* variables
+STAKEHOLDER_ENV_SUFFIXES = {
+    'Pilot': 'PILOT',
+    'CIQS': 'CIQS',
+    'Unmooring': 'UNMOORING',
+    'Tugboat': 'TUGBOAT',
+    'ShippingAgentWanHai': 'SHIPPINGAGENT_WAN_HAI',
+    'ShippingCompanyYangMing': 'SHIPPINGCOMPANY_YANG_MING',
+    'LoadingUnloading': 'LOADINGUNLOADING_LIEN_HAI',
+    'PierLienHai': 'PIER_LIEN_HAI',
+    'PierSelfOperated': 'PIER_SELF_OPERATED'
 }
+line_notify_tokens = {stakeholder: os.getenv(f'LINE_NOTIFY_TOKEN_{suffix}') for stakeholder, suffix in STAKEHOLDER_ENV_SUFFIXES.items()}
+##########################################
+# Other delivery channels                #
+##########################################
+# Each channel is enabled once its endpoint is set
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+
+SMTP_HOST = os.getenv('SMTP_HOST')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 25))
+SMTP_FROM = os.getenv('SMTP_FROM', 'portcdm@localhost')
+# Comma separated addresses per stakeholder
+email_recipients = {stakeholder: os.getenv(f'EMAIL_TO_{suffix}') for stakeholder, suffix in STAKEHOLDER_ENV_SUFFIXES.items()}
+
+SMS_GATEWAY_URL = os.getenv('SMS_GATEWAY_URL')
+SMS_GATEWAY_API_KEY = os.getenv('SMS_GATEWAY_API_KEY')
+# Comma separated phone numbers per stakeholder
+sms_recipients = {stakeholder: os.getenv(f'SMS_TO_{suffix}') for stakeholder, suffix in STAKEHOLDER_ENV_SUFFIXES.items()}
+##########################################
+# Delivery limits                        #
+##########################################
+# Seconds a single send may take, per channel
+channel_timeouts = {
+    name: float(os.getenv(f'{name.upper()}_TIMEOUT', os.getenv('CHANNEL_TIMEOUT', 10)))
+    for name in ('line', 'webhook', 'email', 'sms')
+}
+# Consecutive failures that open a channel's circuit breaker, and seconds before it is retried
+CIRCUIT_BREAKER_FAILURES = int(os.getenv('CIRCUIT_BREAKER_FAILURES', 3))
+CIRCUIT_BREAKER_RESET = float(os.getenv('CIRCUIT_BREAKER_RESET', 300))
+CIRCUIT_BREAKER_STATE_FILE = os.getenv('CIRCUIT_BREAKER_STATE_FILE', 'circuit_breakers.json')
+##########################################
+# Recipient filters                      #
+##########################################
+YANG_MING_PORT_AGENT = "陽明海運"
+WAN_HAI_PORT_AGENT = "萬海航運公司"
+PIER_LIEN_HAI = ["1042", "1043"]
+PIER_SELF_OPERATED = ["1120", "1121"]
+UNMOORING_SHIP_NAMES = ["永明", "文明", "好明", "續明", "吉春", "長春輪", "星春輪", "石春", "遠明", "昇春"]
 berth_message_type_for_pier=["新增引水申請 (進港)","更新引水時間 (進港)","船長報告ETA", "引水人出發 (進港)","實際靠妥時間","新增引水申請 (出港)","更新引水時間 (出港)", "引水人出發 (出港)", "引水人上船時間 (進港)"]
 ##########################################
 # Event mapping                          #
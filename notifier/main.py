@@ -1,171 +1,229 @@
 import os
+import json
+import asyncio
 import time
 from datetime import datetime, timedelta
+from typing import Dict, List
 import psycopg2
-import requests
 from psycopg2.extras import RealDictCursor
 
-from config import original_token, line_notify_tokens, notification_mapping, INOUT_PILOTAGE_EVENTS, BERTH_ORDER_EVENTS, berth_message_type_for_pier
+from config import line_notify_url, original_token, line_notify_tokens, notification_mapping, INOUT_PILOTAGE_EVENTS, BERTH_ORDER_EVENTS, berth_message_type_for_pier
+from config import YANG_MING_PORT_AGENT, WAN_HAI_PORT_AGENT, PIER_LIEN_HAI, PIER_SELF_OPERATED, UNMOORING_SHIP_NAMES
+from config import WEBHOOK_URL, SMTP_HOST, SMTP_PORT, SMTP_FROM, email_recipients, SMS_GATEWAY_URL, SMS_GATEWAY_API_KEY, sms_recipients
+from config import channel_timeouts, CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET, CIRCUIT_BREAKER_STATE_FILE
+from channels import Channel, CircuitBreaker, Delivery, LineNotifyChannel, WebhookChannel, EmailChannel, SmsChannel
+from channels import Dispatcher, load_breakers, save_breakers
+from render import render_message
 
 
-def send_line_notify(message, token):
-    url = 'https://notify-api.line.me/api/notify'
-    headers = {
-        'Content-Type': 'application/x-www-form-urlencoded',
-        'Authorization': f'Bearer {token}'
-    }
-    data = {'message': message}
-    return requests.post(url, headers=headers, data=data)
+def create_channels(breakers: Dict[str, CircuitBreaker]) -> Dict[str, Channel]:
+    def breaker(name):
+        return breakers.setdefault(name, CircuitBreaker(CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET))
+
+    channels = [LineNotifyChannel(line_notify_url, line_notify_tokens, channel_timeouts['line'], breaker('line'))]
+    if WEBHOOK_URL:
+        channels.append(WebhookChannel(WEBHOOK_URL, channel_timeouts['webhook'], breaker('webhook')))
+    if SMTP_HOST:
+        channels.append(EmailChannel(SMTP_HOST, SMTP_PORT, SMTP_FROM, email_recipients, channel_timeouts['email'], breaker('email')))
+    if SMS_GATEWAY_URL:
+        channels.append(SmsChannel(SMS_GATEWAY_URL, SMS_GATEWAY_API_KEY, sms_recipients, channel_timeouts['sms'], breaker('sms')))
+    return {channel.name: channel for channel in channels}
 
 def get_db_connection():
     return psycopg2.connect(
         dbname=os.getenv('POSTGRES_DB'),
         user=os.getenv('POSTGRES_USER'),
         password=os.getenv('POSTGRES_PASSWORD'),
-        host='db'
+        host=os.getenv('POSTGRES_HOST', 'db')
     )
 
-def get_recent_ship_statuses(interval):
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            interval_ago = datetime.now() - timedelta(seconds=interval)
-            
-            query = '''
-                WITH ranked_events AS (
-                    SELECT 
-                        se.*,
-                        ROW_NUMBER() OVER (PARTITION BY se.ship_voyage_number, se.event_name ORDER BY se.event_time DESC) AS rn
-                    FROM ship_events se
-                    WHERE se.event_name IN ('修改進港預報', '修改出港預報')
-                ),
-                latest_event AS (
-                    SELECT 
-                        se.*,
-                        RANK() OVER (PARTITION BY se.ship_voyage_number ORDER BY se.event_time DESC) AS rk
-                    FROM ship_events se
-                )
-                SELECT 
-                    ss.ship_name,
-                    ss.ship_voyage_number,
-                    eta.event_content_time as eta,
-                    etd.event_content_time as etd,
-                    le.event_name as latest_event_name,
-                    le.event_time as latest_event_time,
-                    le.navigation_status as navigation_status,
-                    le.event_content_time as latest_event_content_time,
-                    le.event_source as latest_event_source,
-                    ss.updated_at,
-                    sv.pass_10_miles_time,
-                    sv.pass_5_miles_time,
-                    sv.updated_at as ship_voyage_updated_at
-                FROM ship_status ss
-                LEFT JOIN ranked_events eta ON ss.ship_voyage_number = eta.ship_voyage_number 
-                    AND eta.event_name = '修改進港預報' AND eta.rn = 1
-                LEFT JOIN ranked_events etd ON ss.ship_voyage_number = etd.ship_voyage_number 
-                    AND etd.event_name = '修改出港預報' AND etd.rn = 1
-                LEFT JOIN latest_event le ON ss.ship_voyage_number = le.ship_voyage_number AND le.rk = 1
-                LEFT JOIN ship_voyage sv ON ss.ship_voyage_number = sv.ship_voyage_number
-                WHERE (ss.updated_at >= %s OR sv.updated_at >= %s) AND le.event_time >= %s
-                ORDER BY GREATEST(COALESCE(le.event_time, '1970-01-01'), COALESCE(sv.updated_at, '1970-01-01'))
-            '''
-            
-            cur.execute(query, (interval_ago, interval_ago, interval_ago))
-            return [process_row(row) for row in cur.fetchall()]
-        
-def get_berth_and_previous_pilotage_time_updated(interval):
+NOTIFICATION_CANDIDATES_QUERY = """
+    WITH changed_ship AS (
+        SELECT
+            ss.ship_voyage_number,
+            ss.ship_name,
+            ss.updated_at,
+            sv.pass_10_miles_time,
+            sv.pass_5_miles_time,
+            sv.updated_at AS ship_voyage_updated_at
+        FROM ship_status ss
+        LEFT JOIN ship_voyage sv ON ss.ship_voyage_number = sv.ship_voyage_number
+        WHERE ss.updated_at >= %(since)s OR sv.updated_at >= %(since)s
+    ),
+    latest_berth AS (
+        SELECT DISTINCT ON (sbo.ship_name_chinese)
+            sbo.ship_name_chinese,
+            sbo.berth_number,
+            sbo.port_agent
+        FROM ship_berth_order sbo
+        WHERE sbo.ship_name_chinese <> ''
+        ORDER BY sbo.ship_name_chinese, sbo.updated_at DESC
+    ),
+    ship_news AS (
+        SELECT
+            cs.*,
+            le.event_time AS latest_event_time,
+            -- A 10/5 nm passage recorded after the status update is the latest news
+            CASE
+                WHEN cs.ship_voyage_updated_at > cs.updated_at AND cs.pass_5_miles_time IS NOT NULL THEN '通過5浬時間'
+                WHEN cs.ship_voyage_updated_at > cs.updated_at AND cs.pass_10_miles_time IS NOT NULL THEN '通過10浬時間'
+                -- A missing navigation status reads "(None)", as Python formatted it
+                WHEN le.event_name = ANY(%(inout_pilotage_events)s) THEN le.event_name || ' (' || COALESCE(le.navigation_status, 'None') || ')'
+                ELSE le.event_name
+            END AS latest_message,
+            CASE
+                WHEN cs.ship_voyage_updated_at > cs.updated_at AND cs.pass_5_miles_time IS NOT NULL THEN '通過5浬時間'
+                WHEN cs.ship_voyage_updated_at > cs.updated_at AND cs.pass_10_miles_time IS NOT NULL THEN '通過10浬時間'
+                ELSE le.event_name
+            END AS latest_event_name,
+            CASE
+                WHEN cs.ship_voyage_updated_at > cs.updated_at AND cs.pass_5_miles_time IS NOT NULL THEN cs.pass_5_miles_time
+                WHEN cs.ship_voyage_updated_at > cs.updated_at AND cs.pass_10_miles_time IS NOT NULL THEN cs.pass_10_miles_time
+                ELSE le.event_content_time
+            END AS latest_event_content_time,
+            CASE
+                WHEN cs.ship_voyage_updated_at > cs.updated_at AND COALESCE(cs.pass_5_miles_time, cs.pass_10_miles_time) IS NOT NULL THEN 'VTS轉檔'
+                ELSE le.event_source
+            END AS latest_event_source,
+            lb.berth_number AS matched_berth_number,
+            COALESCE(lb.port_agent, 'NO PORT AGENT') AS port_agent
+        FROM changed_ship cs
+        -- Every event sharing the latest event time, as RANK() = 1 did
+        JOIN ship_events le ON le.ship_voyage_number = cs.ship_voyage_number
+            AND le.event_time = (SELECT MAX(se.event_time) FROM ship_events se WHERE se.ship_voyage_number = cs.ship_voyage_number)
+        LEFT JOIN LATERAL (
+            SELECT lb.berth_number, lb.port_agent
+            FROM latest_berth lb
+            WHERE strpos(cs.ship_name, lb.ship_name_chinese) > 0
+            -- Of overlapping names, the last match in ship_name_chinese order wins, as in the former Python loop
+            ORDER BY lb.ship_name_chinese DESC
+            LIMIT 1
+        ) lb ON TRUE
+        WHERE le.event_time >= %(since)s
+    ),
+    ship_candidates AS (
+        SELECT
+            sn.*,
+            CASE
+                WHEN sn.matched_berth_number IS NOT NULL AND sn.latest_message = ANY(%(pier_message_types)s) THEN sn.matched_berth_number
+                ELSE '0000'
+            END AS berth_number
+        FROM ship_news sn
+    ),
+    ship_flags AS (
+        SELECT
+            sc.*,
+            strpos(sc.port_agent, %(yang_ming)s) > 0 AS yang_ming,
+            strpos(sc.port_agent, %(wan_hai)s) > 0 AS wan_hai,
+            sc.berth_number = ANY(%(pier_lien_hai)s) AS pier_lien_hai,
+            sc.berth_number = ANY(%(pier_self_operated)s) AS pier_self_operated,
+            sc.ship_name LIKE ANY(%(unmooring_ship_names)s) AS unmooring
+        FROM ship_candidates sc
+    ),
+    berth_queue AS (
+        SELECT
+            sbo.*,
+            LEAD(sbo.berth_number) OVER w AS next_berth_number,
+            LEAD(CONCAT(sbo.ship_name_chinese, sbo.ship_name_english)) OVER w AS next_ship_name
+        FROM ship_berth_order sbo
+        WINDOW w AS (ORDER BY sbo.berth_number ASC, sbo.berthing_time ASC, sbo.pilotage_time ASC)
+    )
+    SELECT
+        '一般訊息' AS message_format,
+        sf.ship_name,
+        sf.ship_voyage_number,
+        (SELECT se.event_content_time FROM ship_events se WHERE se.ship_voyage_number = sf.ship_voyage_number
+            AND se.event_name = '修改進港預報' ORDER BY se.event_time DESC LIMIT 1) AS eta,
+        (SELECT se.event_content_time FROM ship_events se WHERE se.ship_voyage_number = sf.ship_voyage_number
+            AND se.event_name = '修改出港預報' ORDER BY se.event_time DESC LIMIT 1) AS etd,
+        sf.latest_message,
+        NULL AS trigger_event,
+        sf.latest_event_content_time AS event_time,
+        sf.latest_event_source AS event_source,
+        CASE WHEN sf.latest_event_name = ANY(%(berth_order_events)s) THEN sf.ship_voyage_updated_at ELSE sf.latest_event_time END AS update_time,
+        sf.berth_number,
+        sf.port_agent,
+        ARRAY(
+            SELECT m.stakeholder
+            FROM jsonb_array_elements_text(%(notification_mapping)s::jsonb -> sf.latest_message) WITH ORDINALITY AS m(stakeholder, position)
+            WHERE CASE m.stakeholder
+                WHEN 'Pilot' THEN sf.yang_ming OR sf.wan_hai OR sf.pier_lien_hai OR sf.pier_self_operated
+                WHEN 'CIQS' THEN sf.yang_ming OR sf.wan_hai OR sf.pier_lien_hai OR sf.pier_self_operated
+                WHEN 'PierLienHai' THEN sf.pier_lien_hai
+                WHEN 'PierSelfOperated' THEN sf.pier_self_operated
+                WHEN 'ShippingCompanyYangMing' THEN sf.yang_ming
+                WHEN 'ShippingAgentWanHai' THEN sf.wan_hai
+                WHEN 'Unmooring' THEN sf.unmooring
+                WHEN 'LoadingUnloading' THEN sf.pier_lien_hai OR sf.pier_self_operated
+                WHEN 'Tugboat' THEN sf.yang_ming OR sf.wan_hai
+                ELSE FALSE
+            END
+            ORDER BY m.position
+        ) AS recipients,
+        0 AS part,
+        GREATEST(COALESCE(sf.latest_event_time, '1970-01-01'), COALESCE(sf.ship_voyage_updated_at, '1970-01-01')) AS sort_time
+    FROM ship_flags sf
+    UNION ALL
+    SELECT
+        '接靠順序',
+        bq.next_ship_name,
+        ss.ship_voyage_number,
+        (SELECT se.event_content_time FROM ship_events se WHERE se.ship_voyage_number = ss.ship_voyage_number
+            AND se.event_name = '修改進港預報' ORDER BY se.event_time DESC LIMIT 1),
+        (SELECT se.event_content_time FROM ship_events se WHERE se.ship_voyage_number = ss.ship_voyage_number
+            AND se.event_name = '修改出港預報' ORDER BY se.event_time DESC LIMIT 1),
+        NULL,
+        CASE WHEN bq.berthing_time IS NOT NULL THEN '靠泊' ELSE '引水' END,
+        COALESCE(bq.berthing_time, bq.pilotage_time),
+        NULL,
+        bq.updated_at,
+        bq.berth_number,
+        NULL,
+        ARRAY[]::TEXT[],
+        1,
+        bq.updated_at
+    FROM berth_queue bq
+    JOIN ship_status ss ON ss.ship_name = bq.next_ship_name
+    WHERE bq.next_berth_number = bq.berth_number AND bq.updated_at >= %(since)s
+    ORDER BY part, sort_time
+"""
+
+def get_notification_candidates(interval):
+    """
+    Detects everything to notify about in one round trip: ship news enriched with the berth,
+    the port agent and the filtered recipients, followed by the berth order changes.
+    """
     with get_db_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             interval_ago = datetime.now() - timedelta(seconds=interval)
-
-            query = '''
-                WITH updated_ship AS (
-                    SELECT 
-                        ROW_NUMBER() OVER (ORDER BY berth_number ASC, berthing_time ASC, pilotage_time ASC) AS row_index,
-                        * 
-                    FROM public.ship_berth_order
-                ),
-                target_ship AS (
-                    SELECT 
-                        ROW_NUMBER() OVER (ORDER BY berth_number ASC, berthing_time ASC, pilotage_time ASC) AS row_index,
-                        * ,
-                        CONCAT(ship_name_chinese, ship_name_english) AS ship_name
-                    FROM public.ship_berth_order
-                ),
-                ranked_events AS (
-                    SELECT 
-                        se.*,
-                        ROW_NUMBER() OVER (PARTITION BY se.ship_voyage_number, se.event_name ORDER BY se.event_time DESC) AS rn
-                    FROM ship_events se
-                    WHERE se.event_name IN ('修改進港預報', '修改出港預報')
-                ),
-                latest_event AS (
-                    SELECT 
-                        se.*,
-                        ROW_NUMBER() OVER (PARTITION BY se.ship_voyage_number ORDER BY se.event_time DESC) AS rn
-                    FROM ship_events se
-                )
-                SELECT 
-                    updated_ship.row_index,
-                    target_ship.berth_number,
-                    updated_ship.berthing_time,
-                    updated_ship.pilotage_time,
-                    ship_status.ship_voyage_number,
-                    target_ship.ship_name,
-                    eta.event_content_time as eta,
-                    etd.event_content_time as etd,
-                    updated_ship.updated_at
-                FROM updated_ship
-                LEFT JOIN target_ship ON target_ship.row_index = updated_ship.row_index + 1
-                JOIN ship_status ON ship_status.ship_name = target_ship.ship_name
-                LEFT JOIN ranked_events eta ON ship_status.ship_voyage_number = eta.ship_voyage_number 
-                    AND eta.event_name = '修改進港預報' AND eta.rn = 1
-                LEFT JOIN ranked_events etd ON ship_status.ship_voyage_number = etd.ship_voyage_number 
-                    AND etd.event_name = '修改出港預報' AND etd.rn = 1
-                LEFT JOIN latest_event le ON ship_status.ship_voyage_number = le.ship_voyage_number AND le.rn = 1
-                WHERE
-                    target_ship.berth_number = updated_ship.berth_number and
-                    updated_ship.updated_at >= %s;
-            '''
-
-            cur.execute(query, (interval_ago,))
-            return [process_row_for_berth_order(row) for row in cur.fetchall()]
-
-def get_ship_berth_and_port_agent():
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-
-                query = '''
-                SELECT
-                    temp_table.berth_number,
-                    temp_table.port_agent,
-                    temp_table.ship_name_chinese
-                FROM (
-                    SELECT
-                        sbo.berth_number,
-                        sbo.port_agent,
-                        sbo.ship_name_chinese,
-                        sbo.updated_at,
-                        ROW_NUMBER() OVER(PARTITION BY sbo.ship_name_chinese ORDER BY sbo.updated_at DESC) AS rn
-                    FROM ship_berth_order sbo
-                ) AS temp_table
-                WHERE temp_table.rn = 1;
-                '''
-                cur.execute(query)
-                
-                return [row for row in cur.fetchall()]
-
-def process_row(row):
-    latest_event = row['latest_event_name']
-    if row['ship_voyage_updated_at'] > row['updated_at']:
-        if row['pass_5_miles_time']:
-            latest_event = '通過5浬時間'
-            row['latest_event_content_time'] = row['pass_5_miles_time'] 
-            row['latest_event_source'] = "VTS轉檔"
-        elif row['pass_10_miles_time']:
-            latest_event = '通過10浬時間'
-            row['latest_event_content_time'] = row['pass_10_miles_time']
-            row['latest_event_source'] = "VTS轉檔"
-        
+            cur.execute(NOTIFICATION_CANDIDATES_QUERY, {
+                'since': interval_ago,
+                'inout_pilotage_events': INOUT_PILOTAGE_EVENTS,
+                'berth_order_events': BERTH_ORDER_EVENTS,
+                'pier_message_types': berth_message_type_for_pier,
+                'yang_ming': YANG_MING_PORT_AGENT,
+                'wan_hai': WAN_HAI_PORT_AGENT,
+                'pier_lien_hai': PIER_LIEN_HAI,
+                'pier_self_operated': PIER_SELF_OPERATED,
+                'unmooring_ship_names': [f'%{name}%' for name in UNMOORING_SHIP_NAMES],
+                'notification_mapping': json.dumps(notification_mapping, ensure_ascii=False),
+            })
+            return [process_candidate(row) for row in cur.fetchall()]
+
+def process_candidate(row):
+    if row['message_format'] == '接靠順序':
+        return {
+            '訊息格式': '接靠順序',
+            '船名': row['ship_name'],
+            '船編': row['ship_voyage_number'][:6],
+            '航次': row['ship_voyage_number'][6:10],
+            'ETA': row['eta'],
+            'ETD': row['etd'],
+            '碼頭代號': row['berth_number'],
+            '觸發事件': row['trigger_event'],
+            '事件時間': row['event_time'],
+            '更新時間': row['update_time']
+        }
     return {
         '訊息格式': '一般訊息',
         '船名': row['ship_name'],
@@ -173,170 +231,88 @@ def process_row(row):
         '航次': row['ship_voyage_number'][6:10],
         'ETA': row['eta'],
         'ETD': row['etd'],
-        '最新消息': convert_inout_pilotage_event(latest_event, row['navigation_status']),
-        '事件時間': row['latest_event_content_time'],
-        '事件來源': row['latest_event_source'],
-        '更新時間': row['ship_voyage_updated_at'] if latest_event in BERTH_ORDER_EVENTS else row['latest_event_time'] 
-    }
-
-def process_row_for_berth_order(row):
-    if row['berthing_time'] is not None:
-        trigger_event = '靠泊'
-    else:
-        trigger_event = '引水'
-    trigger_event_time = row['berthing_time'] if row['berthing_time'] is not None else row['pilotage_time']
-    return {
-        '訊息格式': '接靠順序',
-        '船名': row['ship_name'],
-        '船編': row['ship_voyage_number'][:6],
-        '航次': row['ship_voyage_number'][6:10],
-        'ETA': row['eta'],
-        'ETD': row['etd'],
+        '最新消息': row['latest_message'],
+        '事件時間': row['event_time'],
+        '事件來源': row['event_source'],
+        '更新時間': row['update_time'],
         '碼頭代號': row['berth_number'],
-        '觸發事件': trigger_event,
-        '事件時間': trigger_event_time,
-        '更新時間': row['updated_at']
-    }   
-
-def convert_inout_pilotage_event(event_name, navigation_status):
-    return f"{event_name} ({navigation_status})" if event_name in INOUT_PILOTAGE_EVENTS else event_name
-
-def format_datetime(dt):
-    if isinstance(dt, datetime):
-        return (dt + timedelta(hours=8)).strftime("%Y/%m/%d %H:%M:%S")
-    else:
-        return dt
-
-def format_message(row):
-    return f"""
-
-船名: {row['船名']}
-船編: {row['船編']}
-航次: {row['航次']}
-ETA: {format_datetime(row['ETA'])}
-ETD: {format_datetime(row['ETD'])}
-
-最新事件: {row['最新消息']}
-事件時間: {format_datetime(row['事件時間'])}
-事件來源: {row['事件來源']}
-
-更新時間: 
-{format_datetime(row['更新時間']) if row['更新時間'] else "N/A"}"""
-
-def format_previous_pilotage_message(row):
-    return f"""
-
-船名: {row['船名']}
-船編: {row['船編']}
-航次: {row['航次']}
-ETA: {format_datetime(row['ETA'])}
-ETD: {format_datetime(row['ETD'])}
-
-碼頭代號: {row['碼頭代號']}
-前一艘船舶{row['觸發事件']}時間: {format_datetime(row['事件時間'])}
-
-更新時間: 
-{format_datetime(row['更新時間']) if row['更新時間'] else "N/A"}"""
-
-def notification_filter(row, stakeholder) -> bool:
-
-    boat_name = "永明" in row["船名"] or "文明" in row["船名"] or "好明" in row["船名"] or "續明" in row["船名"] or "吉春" in row["船名"] or "長春輪" in row["船名"] or "星春輪" in row["船名"] or "石春" in row["船名"] or "遠明" in row["船名"] or "昇春" in row["船名"]
-    yang_ming_or_wan_hai = "陽明海運" in row["港代"] or "萬海航運公司" in row["港代"]
-    pier_1042_1043 = row['碼頭代號'] in {'1042', '1043'}
-    pier_1120_1121 = row['碼頭代號'] in {'1120', '1121'}
-
-    stakeholder_conditions = {
-        'Pilot': yang_ming_or_wan_hai or pier_1042_1043 or pier_1120_1121,
-        'CIQS': yang_ming_or_wan_hai or pier_1042_1043 or pier_1120_1121,
-        'PierLienHai': pier_1042_1043,
-        'PierSelfOperated': pier_1120_1121,
-        'ShippingCompanyYangMing': "陽明海運" in row["港代"],
-        'ShippingAgentWanHai': "萬海航運公司" in row["港代"],
-        'Unmooring': boat_name,
-        'LoadingUnloading': pier_1042_1043 or pier_1120_1121,
-        'Tugboat': yang_ming_or_wan_hai
+        '港代': row['port_agent'],
+        '收件人': row['recipients']
     }
 
-    return stakeholder_conditions.get(stakeholder, False)
+def log_deliveries(row, deliveries: List[Delivery], test_group_event=None):
+    now = (datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
+    for delivery in deliveries:
+        status = delivery.status if delivery.status in ('成功', '失敗') else f'失敗 ({delivery.status})'
+        if delivery.label is None:
+            print(f'{now} 通知發送{status}: {row["船名"]} - 事件: {test_group_event} ({delivery.channel.name})')
+        else:
+            print(f'{now} 通知發送{status}: {row["船名"]} to {delivery.label} ({delivery.channel.name})')
 
-def send_notifications(row, line_notify_tokens, original_token):
+def prepare_notifications(row, channels: Dict[str, Channel], original_token) -> List[Delivery]:
     latest_event = row['最新消息']
-    message = format_message(row)
-    
-    if message is None:
-        return
-    if latest_event in notification_mapping:
-        send_to_test_group = False
-        send_stakeholders = []
-
-        for stakeholder in notification_mapping[latest_event]:
-
-            if notification_filter(row, stakeholder):
-                send_to_test_group = True
-                send_stakeholders.append(stakeholder)
 
-                token = line_notify_tokens.get(stakeholder)
-                if not token:
-                    print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 無法發送通知: {row["船名"]} to {stakeholder}, TOKEN 未設置')
-                    continue
-
-                response = send_line_notify(message, token)
-                status = '成功' if response.status_code == 200 else '失敗'
-                print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 通知發送{status}: {row["船名"]} to {stakeholder}')
-        
-        if original_token and send_to_test_group:
-            stakeholders_list = "\n".join(send_stakeholders)
-            message_with_stakeholders = f"\n通知對象: \n{stakeholders_list}" + message
-            response = send_line_notify(message_with_stakeholders, original_token)
-            status = '成功' if response.status_code == 200 else '失敗'
-            print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 通知發送{status}: {row["船名"]} - 事件: {latest_event}')
-    else:
+    if latest_event not in notification_mapping:
         print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 非目標事件: {row["船名"]} - {latest_event}')
-
-def send_notifications_for_berth_order(row, original_token):
-    message = format_previous_pilotage_message(row)
-    if message is None:
-        return
-
-    if original_token:
-        response = send_line_notify(message, original_token)
-        status = '成功' if response.status_code == 200 else '失敗'
-        print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 通知發送{status}: {row["船名"]} - 事件: 碼頭{row["碼頭代號"]}-{row["觸發事件"]}')
-
-def combine_ship_and_berth_and_port_agent(rows):
-    ship_berths = get_ship_berth_and_port_agent()
-
+        return []
+
+    # Rendered once, the same message goes to every stakeholder on every channel
+    message = render_message(row)
+
+    # The candidates come with their recipients already filtered
+    recipients = row['收件人']
+
+    deliveries = []
+    for stakeholder in recipients:
+        targets = [(channel, channel.addresses(stakeholder)) for channel in channels.values()]
+        if not any(addresses for _, addresses in targets):
+            print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 無法發送通知: {row["船名"]} to {stakeholder}, TOKEN 未設置')
+            continue
+        for channel, addresses in targets:
+            if addresses:
+                payload = channel.prepare(message, stakeholder)
+                deliveries.extend(Delivery(channel, address, stakeholder, payload) for address in addresses)
+
+    if original_token and recipients:
+        deliveries.append(Delivery(channels['line'], original_token, None, message.with_recipients(recipients)))
+    return deliveries
+
+def prepare_notifications_for_berth_order(row, channels: Dict[str, Channel], original_token) -> List[Delivery]:
+    if not original_token:
+        return []
+    message = render_message(row)
+    return [Delivery(channels['line'], original_token, None, message.body)]
+
+async def deliver_notifications(rows, channels: Dict[str, Channel]):
+    # Every channel sends the notifications in order from its own queue, so a slow
+    # provider only delays its own messages
+    dispatcher = Dispatcher()
     for row in rows:
-        for ship_berth in ship_berths:
-            if ship_berth['ship_name_chinese'] in row["船名"]:
-                if row['最新消息'] in berth_message_type_for_pier:
-                    row.update({'碼頭代號': ship_berth['berth_number']})
-                
-                row.update({'港代': ship_berth['port_agent']})
-        if '碼頭代號' not in row.keys():
-            row.update({'碼頭代號': '0000'})
-        if '港代' not in row.keys():
-            row.update({'港代': 'NO PORT AGENT'})
-    
-    return(rows)
+        try:
+            if row['訊息格式'] == '接靠順序':
+                deliveries = prepare_notifications_for_berth_order(row, channels, original_token)
+                test_group_event = f'碼頭{row["碼頭代號"]}-{row["觸發事件"]}'
+            else:
+                deliveries = prepare_notifications(row, channels, original_token)
+                test_group_event = row['最新消息']
+            dispatcher.submit(deliveries, lambda sent, row=row, event=test_group_event: log_deliveries(row, sent, event))
+        except Exception as e:
+            print(f"Failed to send notification: {str(e)}")
+    await dispatcher.join()
 
 def main():
     interval_time = int(os.getenv('INTERVAL_TIME', 180))
 
     print(f'{(datetime.now() + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")} 查看資料庫有無更新')
     interval = interval_time + 1
-    rows = []
-    rows.extend(get_recent_ship_statuses(interval))
-    rows = combine_ship_and_berth_and_port_agent(rows)
-    rows.extend(get_berth_and_previous_pilotage_time_updated(interval))
-    for row in rows:
-        try:
-            if row['訊息格式'] == '接靠順序':
-                send_notifications_for_berth_order(row, original_token)
-            else:
-                send_notifications(row, line_notify_tokens, original_token)
-        except Exception as e:
-            print(f"Failed to send notification: {str(e)}")
+    rows = get_notification_candidates(interval)
+
+    breakers = load_breakers(CIRCUIT_BREAKER_STATE_FILE, CIRCUIT_BREAKER_FAILURES, CIRCUIT_BREAKER_RESET)
+    channels = create_channels(breakers)
+    try:
+        asyncio.run(deliver_notifications(rows, channels))
+    finally:
+        save_breakers(CIRCUIT_BREAKER_STATE_FILE, breakers)
 
 if __name__ == "__main__":
     main()
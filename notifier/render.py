@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+from string import Formatter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+##########################################
+# Message templates                      #
+##########################################
+# Keyed by 訊息格式, with the fields prepared by `format_fields`
+SHIP_HEADER = "\n".join(["", "", "船名: {船名}", "船編: {船編}", "航次: {航次}", "ETA: {ETA}", "ETD: {ETD}", ""])
+UPDATE_FOOTER = "\n".join(["", "更新時間: ", "{更新時間}"])
+MESSAGE_TEMPLATES = {
+    '一般訊息': SHIP_HEADER + "\n".join(["", "最新事件: {最新消息}", "事件時間: {事件時間}", "事件來源: {事件來源}", ""]) + UPDATE_FOOTER,
+    '接靠順序': SHIP_HEADER + "\n".join(["", "碼頭代號: {碼頭代號}", "前一艘船舶{觸發事件}時間: {事件時間}", ""]) + UPDATE_FOOTER,
+}
+
+# One line summary, e.g. for a mail subject or a text message
+TITLE_TEMPLATES = {
+    '一般訊息': "{船名} {最新消息}",
+    '接靠順序': "{船名} 碼頭{碼頭代號}-{觸發事件}",
+}
+
+RECIPIENTS_HEADER = "\n通知對象: \n{recipients}"
+
+
+class MessageTemplate:
+    """
+    A template parsed once into its literal text and field names.
+
+    Rendering joins the literals with already formatted field values, without parsing
+    the template or formatting the values again.
+    """
+    __slots__ = ('literals', 'fields')
+
+    def __init__(self, template: str):
+        self.literals: List[str] = []
+        self.fields: List[Optional[str]] = []
+        for literal, field, _, _ in Formatter().parse(template):
+            self.literals.append(literal)
+            self.fields.append(field)
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = []
+        for literal, field in zip(self.literals, self.fields):
+            parts.append(literal)
+            if field is not None:
+                parts.append(values[field])
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str, kind: str = 'body') -> MessageTemplate:
+    templates = TITLE_TEMPLATES if kind == 'title' else MESSAGE_TEMPLATES
+    return MessageTemplate(templates[name])
+
+
+@lru_cache(maxsize=4096)
+def _format_timestamp(dt: datetime) -> str:
+    return (dt + timedelta(hours=8)).strftime("%Y/%m/%d %H:%M:%S")
+
+
+def format_datetime(dt):
+    if isinstance(dt, datetime):
+        return _format_timestamp(dt)
+    else:
+        return dt
+
+
+def format_fields(row: dict) -> Dict[str, str]:
+    """
+    Formats every field of a notification once, times in Taiwan time.
+    """
+    values = {key: str(format_datetime(value)) for key, value in row.items() if key != '收件人'}
+    values['更新時間'] = str(format_datetime(row['更新時間'])) if row.get('更新時間') else "N/A"
+    return values
+
+
+class RenderedMessage:
+    """
+    A notification rendered once, shared by all its recipients and channels.
+
+    Attributes:
+        format (str): The 訊息格式 of the notification.
+        title (str): A one line summary.
+        body (str): The message sent to each recipient.
+        fields (Dict[str, str]): The formatted fields, for channels with their own layout.
+    """
+    __slots__ = ('format', 'title', 'body', 'fields', '_with_recipients')
+
+    def __init__(self, format: str, title: str, body: str, fields: Dict[str, str]):
+        self.format = format
+        self.title = title
+        self.body = body
+        self.fields = fields
+        self._with_recipients: Dict[Tuple[str, ...], str] = {}
+
+    def with_recipients(self, recipients: Sequence[str]) -> str:
+        """
+        The body preceded by the list of recipients, as sent to the test group.
+        """
+        key = tuple(recipients)
+        if key not in self._with_recipients:
+            self._with_recipients[key] = RECIPIENTS_HEADER.format(recipients="\n".join(key)) + self.body
+        return self._with_recipients[key]
+
+
+def render_message(row: dict) -> RenderedMessage:
+    message_format = row['訊息格式']
+    fields = format_fields(row)
+    return RenderedMessage(
+        message_format,
+        get_template(message_format, 'title').render(fields),
+        get_template(message_format).render(fields),
+        fields,
+    )
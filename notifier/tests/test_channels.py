@@ -0,0 +1,264 @@
+"""
+Delivery tests against the simulator's fake LINE Notify, webhook, SMS gateway and SMTP sinks.
+
+Run from the repository root:
+
+    python -m pytest notifier/tests
+"""
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+NOTIFIER_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(NOTIFIER_DIR), str(NOTIFIER_DIR.parent)]
+
+from channels import (Channel, CircuitBreaker, Delivery, Dispatcher, EmailChannel, LineNotifyChannel, SmsChannel,
+                      WebhookChannel, fan_out, load_breakers, save_breakers)
+from render import render_message
+from simulator.server import AlertSink, start, start_smtp
+from simulator.traffic import PortTraffic
+
+ROW = {
+    '訊息格式': '一般訊息', '船名': '永明1號', '船編': '100001', '航次': '0001', 'ETA': 'N/A', 'ETD': 'N/A',
+    '最新消息': '船長報告ETA', '事件時間': 'N/A', '事件來源': 'test', '更新時間': None,
+    '碼頭代號': '1042', '港代': '陽明海運', '收件人': ['Pilot'],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class SinkTestCase(unittest.TestCase):
+    """
+    Starts the simulator's sinks once, and resets their faults before every test.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sink = AlertSink()
+        cls.http = start(PortTraffic(1, 0.0, seed=1), cls.sink, '127.0.0.1', free_port())
+        cls.smtp_port = free_port()
+        cls.smtp = start_smtp(cls.sink, '127.0.0.1', cls.smtp_port)
+        cls.base_url = f"http://127.0.0.1:{cls.http.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.http.shutdown()
+        cls.smtp.shutdown()
+
+    def setUp(self):
+        self.sink.delays, self.sink.failing, self.sink.rejected = {}, set(), set()
+        with self.sink.lock:
+            self.sink.deliveries.clear()
+        self.message = render_message(dict(ROW))
+
+    def channel(self, name: str, timeout: float = 20, breaker: CircuitBreaker = None) -> Channel:
+        breaker = breaker or CircuitBreaker(3, 60)
+        if name == 'line':
+            return LineNotifyChannel(f"{self.base_url}/api/notify", {'Pilot': 'token-pilot'}, timeout, breaker)
+        if name == 'webhook':
+            return WebhookChannel(f"{self.base_url}/api/webhook", timeout, breaker)
+        if name == 'email':
+            return EmailChannel('127.0.0.1', self.smtp_port, 'portcdm@localhost', {'Pilot': 'pilot@example.com'},
+                                timeout, breaker)
+        return SmsChannel(f"{self.base_url}/api/sms", None, {'Pilot': '0912000001'}, timeout, breaker)
+
+    def delivery(self, channel: Channel, address: str = None) -> Delivery:
+        return Delivery(channel, address or channel.addresses('Pilot')[0], 'Pilot', channel.prepare(self.message, 'Pilot'))
+
+    def received(self, channel: str) -> list:
+        with self.sink.lock:
+            return [d for d in self.sink.deliveries if d[1] == channel]
+
+
+class TimeoutIsolationTest(SinkTestCase):
+    """
+    Ordering is checked with gates and counters rather than wall-clock bounds.
+    """
+
+    def hold(self, channel: Channel) -> threading.Event:
+        """
+        Holds every send of the channel until the returned gate is set, and records how
+        many of them ran at once in `channel.max_in_flight`.
+        """
+        gate, lock, send = threading.Event(), threading.Lock(), channel.send
+        in_flight = [0]
+        channel.max_in_flight = 0
+
+        def held_send(payload, address):
+            with lock:
+                in_flight[0] += 1
+                channel.max_in_flight = max(channel.max_in_flight, in_flight[0])
+            try:
+                gate.wait(30)
+                send(payload, address)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+
+        channel.send = held_send
+        return gate
+
+    async def wait_for(self, condition, timeout: float = 30) -> None:
+        # Only a bound for a broken build: a passing run returns as soon as the condition holds
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    def test_slow_channel_does_not_delay_line(self):
+        for slow in ('webhook', 'email', 'sms'):
+            with self.subTest(slow=slow):
+                self.setUp()
+                line, other = self.channel('line'), self.channel(slow, timeout=60)
+                gate = self.hold(other)
+                sent = []
+
+                async def run():
+                    dispatcher = Dispatcher()
+                    for n in range(5):
+                        line_delivery = Delivery(line, 'token-pilot', 'Pilot', f'message {n}')
+                        dispatcher.submit([line_delivery, self.delivery(other)], sent.extend)
+                    # Every LINE message goes out while the other channel is stuck on its first send
+                    await self.wait_for(lambda: len(self.received('line')) == 5)
+                    held = len(self.received(slow))
+                    gate.set()
+                    await dispatcher.join()
+                    return held
+
+                held = asyncio.run(run())
+
+                self.assertEqual([d[3] for d in self.received('line')], [f'message {n}' for n in range(5)])
+                self.assertEqual(held, 0)
+                self.assertEqual(len(self.received(slow)), 5)
+                # The channel's own messages still go one at a time, in order
+                self.assertEqual(other.max_in_flight, 1)
+                self.assertTrue(all(d.status == '成功' for d in sent))
+
+    def test_timed_out_send_is_not_waited_for(self):
+        stalled_done = threading.Event()
+
+        class StalledChannel(Channel):
+            def addresses(self, stakeholder):
+                return ['stalled']
+
+            def send(self, payload, address):
+                release.wait(30)
+                stalled_done.set()
+
+        release = threading.Event()
+        stalled, line = StalledChannel('stalled', 0.2, CircuitBreaker(3, 60)), self.channel('line')
+        sent = []
+
+        async def run():
+            dispatcher = Dispatcher()
+            dispatcher.submit([self.delivery(stalled), self.delivery(line)], sent.extend)
+            await dispatcher.join()
+
+        try:
+            asyncio.run(run())
+            # The run ended while the stalled send was still blocked
+            self.assertFalse(stalled_done.is_set())
+        finally:
+            release.set()
+
+        self.assertEqual({d.channel.name: d.status for d in sent}, {'stalled': '逾時', 'line': '成功'})
+        self.assertEqual(stalled.breaker.failures, 1)
+
+    def test_sink_timeout_counts_as_failure(self):
+        self.sink.delays = {'sms': 2}
+        sms = self.channel('sms', timeout=0.2)
+        [delivery] = asyncio.run(fan_out([self.delivery(sms)]))
+        self.assertIn(delivery.status, ('逾時', '失敗'))
+        self.assertEqual(sms.breaker.failures, 1)
+
+
+class CircuitBreakerTest(SinkTestCase):
+    """
+    The reset timeout is passed by moving `opened_at` back rather than by sleeping.
+    """
+
+    def send(self, channel: Channel, address: str = None) -> str:
+        [delivery] = asyncio.run(fan_out([self.delivery(channel, address)]))
+        return delivery.status
+
+    @staticmethod
+    def expire(breaker: CircuitBreaker) -> None:
+        breaker.opened_at -= breaker.reset_timeout
+
+    def test_open_half_open_close(self):
+        for name in ('line', 'webhook', 'email', 'sms'):
+            with self.subTest(channel=name):
+                self.setUp()
+                channel = self.channel(name, breaker=CircuitBreaker(2, 60))
+                self.sink.failing = {name}
+
+                self.assertEqual([self.send(channel) for _ in range(3)], ['失敗', '失敗', '熔斷'])
+                self.assertEqual(channel.breaker.state, 'open')
+
+                # Half-open: a failed trial opens it again
+                self.expire(channel.breaker)
+                self.assertEqual(channel.breaker.state, 'half-open')
+                self.assertEqual(self.send(channel), '失敗')
+                self.assertEqual(channel.breaker.state, 'open')
+
+                # A successful trial closes it
+                self.expire(channel.breaker)
+                self.sink.failing = set()
+                self.assertEqual(self.send(channel), '成功')
+                self.assertEqual(channel.breaker.state, 'closed')
+                self.assertEqual(len(self.received(name)), 1)
+
+    def test_half_open_lets_one_trial_through(self):
+        line = self.channel('line', breaker=CircuitBreaker(1, 60, failures=1, opened_at=time.time() - 120))
+        deliveries = asyncio.run(fan_out([self.delivery(line) for _ in range(3)]))
+        self.assertEqual(sorted(d.status for d in deliveries), ['成功', '熔斷', '熔斷'])
+        self.assertEqual(line.breaker.state, 'closed')
+
+    def test_rejected_address_does_not_open_breaker(self):
+        for name, address in (('line', 'revoked-token'), ('sms', '0900000000'), ('email', 'gone@example.com')):
+            with self.subTest(channel=name):
+                self.setUp()
+                self.sink.rejected = {address}
+                channel = self.channel(name, breaker=CircuitBreaker(2, 60))
+
+                self.assertEqual([self.send(channel, address) for _ in range(3)], ['拒收'] * 3)
+                self.assertEqual(channel.breaker.state, 'closed')
+                self.assertEqual(self.send(channel), '成功')
+
+    def test_state_persists_across_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'circuit_breakers.json')
+            self.sink.failing = {'sms'}
+
+            # First run: the SMS gateway fails until its breaker opens
+            breakers = {'sms': CircuitBreaker(2, 60)}
+            sms = self.channel('sms', breaker=breakers['sms'])
+            self.assertEqual([self.send(sms) for _ in range(2)], ['失敗', '失敗'])
+            save_breakers(path, breakers)
+
+            # Next run, in a new process: still open, nothing is sent
+            breakers = load_breakers(path, 2, 60)
+            sms = self.channel('sms', breaker=breakers['sms'])
+            self.assertEqual(breakers['sms'].state, 'open')
+            self.assertEqual(self.send(sms), '熔斷')
+
+            # Once the reset timeout has passed, the trial closes it, and that is saved too
+            self.expire(breakers['sms'])
+            self.sink.failing = set()
+            self.assertEqual(self.send(sms), '成功')
+            save_breakers(path, breakers)
+            self.assertEqual(load_breakers(path, 2, 60)['sms'].state, 'closed')
+            self.assertEqual(load_breakers(path, 2, 60)['sms'].failures, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
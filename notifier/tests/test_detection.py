@@ -0,0 +1,94 @@
+"""
+Checks get_notification_candidates against the former per-ship detection on a scratch database.
+
+Needs a PostgreSQL server, reached with the usual POSTGRES_* variables; skipped without
+POSTGRES_HOST. Run from the repository root:
+
+    POSTGRES_HOST=localhost python -m pytest notifier/tests/test_detection.py
+"""
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+
+NOTIFIER_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(NOTIFIER_DIR), str(NOTIFIER_DIR.parent)]
+
+TEST_DB = 'portcdm_test_detection'
+INIT_SQL = NOTIFIER_DIR.parent / 'init_db.sql'
+
+# (voyage, ship name, the berth order names it contains with their berth and port agent)
+SHIPS = [
+    # Neither name is a prefix of the other: the longest match is not the last one
+    ('1000010001', '大永明號YM ONE', [('永明', '1042', '陽明海運股份有限公司'), ('大永明', '1120', '萬海航運公司')]),
+    ('1000020001', '長明1號EVER ONE', [('長明', '1043', '萬海航運公司'), ('長明1號', '1121', '陽明海運股份有限公司')]),
+    ('1000030001', '海安號SEA PEACE', [('海安號', '1070', '東方海外')]),
+    ('1000040001', '吉春號ALS JUNO', []),
+]
+
+
+@unittest.skipUnless(os.getenv('POSTGRES_HOST'), "needs a PostgreSQL server (POSTGRES_HOST)")
+class PortAgentMatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import main as notifier
+
+        cls.admin = notifier.get_db_connection()
+        cls.admin.autocommit = True
+        with cls.admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {TEST_DB}')
+            cur.execute(f"CREATE DATABASE {TEST_DB} ENCODING 'UTF8' TEMPLATE template0")
+        cls.database = os.environ.get('POSTGRES_DB')
+        os.environ['POSTGRES_DB'] = TEST_DB
+
+        now = datetime.now()
+        conn = notifier.get_db_connection()
+        with conn, conn.cursor() as cur:
+            cur.execute(INIT_SQL.read_text())
+            for voyage, ship_name, berth_orders in SHIPS:
+                cur.execute('INSERT INTO ship_status (ship_voyage_number, ship_name, latest_event, updated_at) '
+                            'VALUES (%s, %s, %s, %s)', (voyage, ship_name, 'x', now))
+                cur.execute('INSERT INTO ship_voyage (ship_voyage_number, updated_at) VALUES (%s, %s)',
+                            (voyage, now - timedelta(hours=1)))
+                cur.execute('INSERT INTO ship_events (ship_voyage_number, event_source, event_time, event_name, '
+                            'navigation_status, pilot_order_number, berth_number, event_content_time) '
+                            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
+                            (voyage, 'test', now, '船長報告ETA', '進港', '00000001', '0000', now + timedelta(hours=2)))
+                for chinese, berth, port_agent in berth_orders:
+                    cur.execute('INSERT INTO ship_berth_order (berth_number, ship_status, pilotage_time, ship_name_chinese, '
+                                'ship_name_english, port_agent, updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                                (berth, '進港', now + timedelta(hours=1), chinese, '', port_agent, now - timedelta(hours=1)))
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.database is None:
+            os.environ.pop('POSTGRES_DB', None)
+        else:
+            os.environ['POSTGRES_DB'] = cls.database
+        with cls.admin.cursor() as cur:
+            # The detection functions leave their connections to the garbage collector
+            cur.execute(f'DROP DATABASE IF EXISTS {TEST_DB} WITH (FORCE)')
+        cls.admin.close()
+
+    @staticmethod
+    def matches(rows: list) -> dict:
+        return {row['船編'] + row['航次']: (row['港代'], row['碼頭代號']) for row in rows if row['訊息格式'] == '一般訊息'}
+
+    def test_overlapping_names_keep_the_legacy_last_match(self):
+        import main as notifier
+        from benchmarks import legacy_detection as legacy
+
+        legacy_rows = legacy.combine_ship_and_berth_and_port_agent(legacy.get_recent_ship_statuses(300))
+        expected = self.matches(legacy_rows)
+        self.assertEqual(self.matches(notifier.get_notification_candidates(300)), expected)
+
+        self.assertEqual(expected['1000010001'], ('陽明海運股份有限公司', '1042'))
+        self.assertEqual(expected['1000020001'], ('陽明海運股份有限公司', '1121'))
+        self.assertEqual(expected['1000030001'], ('東方海外', '1070'))
+        self.assertEqual(expected['1000040001'], ('NO PORT AGENT', '0000'))
+
+
+if __name__ == '__main__':
+    unittest.main()
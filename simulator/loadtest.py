@@ -0,0 +1,178 @@
+"""
+Runs the crawler and the notifier against the simulated port and reports the end-to-end
+alert latency: from the moment an event appears on the simulated website to the moment
+the notifier's message reaches the LINE Notify sink.
+
+Run from the repository root, with the database reachable (e.g. `docker-compose up -d db`):
+
+    python -m simulator.loadtest --ships 2000 --event-rate 10 --duration 900 --interval 60
+
+The crawler and notifier run as local processes by default. Use --crawler-cmd and
+--notifier-cmd to run them elsewhere (e.g. in their containers), with --advertise-host
+set to an address they can reach this machine on.
+
+--channels also enables the notifier's webhook, email and SMS channels against the
+simulator's sinks, and --delay / --fail make one of them slow or failing, e.g. to check
+that a stalled SMS gateway does not hold back the LINE messages:
+
+    python -m simulator.loadtest --channels webhook,email,sms --delay sms=30 --fail email
+"""
+import argparse
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from simulator.server import AlertSink, start, start_smtp
+from simulator.traffic import ROOT, PortTraffic
+
+STAKEHOLDER_ENV_SUFFIXES = [
+    'PILOT', 'CIQS', 'UNMOORING', 'TUGBOAT', 'SHIPPINGAGENT_WAN_HAI', 'SHIPPINGCOMPANY_YANG_MING',
+    'LOADINGUNLOADING_LIEN_HAI', 'PIER_LIEN_HAI', 'PIER_SELF_OPERATED',
+]
+CHANNELS = ('line', 'webhook', 'email', 'sms')
+MESSAGE_KEY = re.compile(r'船編: (\S+)\n航次: (\S+)\n.*?最新事件: ([^\n]+)', re.S)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_periodically(name: str, cmd: List[str], cwd: str, env: Dict[str, str], interval: float,
+                     stop: threading.Event, durations: List[float]) -> None:
+    while not stop.is_set():
+        start_time = time.time()
+        result = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True)
+        durations.append(time.time() - start_time)
+        if result.returncode != 0:
+            print(f"{name} exited with {result.returncode}: {result.stderr.strip()[-500:]}")
+        stop.wait(max(0.0, interval - durations[-1]))
+
+
+def latencies(traffic: PortTraffic, sink: AlertSink, since: float,
+              channel: Optional[str] = None) -> Tuple[List[float], int, int]:
+    """
+    Matches every alert to the simulated event it reports.
+
+    SMS texts only carry a summary and are counted but never matched.
+
+    Returns:
+        Tuple[List[float], int, int]: The latency of the first alert of each event, the number
+                                      of events emitted since `since`, and the number of messages,
+                                      on `channel` or on any channel.
+    """
+    with traffic.lock:
+        emitted = {key: at for key, at in traffic.emitted.items() if at >= since}
+    with sink.lock:
+        deliveries = [d for d in sink.deliveries if channel in (None, d[1])]
+
+    first_alert: Dict[Tuple[str, str, str], float] = {}
+    for received_at, _, _, message in deliveries:
+        match = MESSAGE_KEY.search(message)
+        if match:
+            key = (match.group(1), match.group(2), match.group(3).strip())
+            first_alert.setdefault(key, received_at)
+    return [first_alert[key] - at for key, at in emitted.items() if key in first_alert], len(emitted), len(deliveries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ships', type=int, default=200, help="voyages listed on the simulated website")
+    parser.add_argument('--event-rate', type=float, default=1.0, help="events per second over the whole port")
+    parser.add_argument('--duration', type=float, default=600, help="seconds to run")
+    parser.add_argument('--interval', type=int, default=60, help="crawler and notifier period, i.e. INTERVAL_TIME")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--advertise-host', default='127.0.0.1', help="address the crawler and notifier reach the simulator on")
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--crawler-cmd', default='python main.py')
+    parser.add_argument('--notifier-cmd', default='python main.py')
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    parser.add_argument('--channels', default='', help="comma separated extra channels: webhook, email, sms")
+    parser.add_argument('--delay', action='append', default=[], metavar='CHANNEL=SECONDS',
+                        help="make a channel's sink answer slowly")
+    parser.add_argument('--fail', action='append', default=[], metavar='CHANNEL', help="make a channel's sink fail")
+    parser.add_argument('--channel-timeout', type=float, default=5, help="the notifier's per-channel timeout")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    extra_channels = [name for name in args.channels.split(',') if name]
+    delays = {name: float(seconds) for name, seconds in (item.split('=', 1) for item in args.delay)}
+
+    traffic = PortTraffic(args.ships, args.event_rate, seed=args.seed)
+    sink = AlertSink(delays, tuple(args.fail))
+    start(traffic, sink, '0.0.0.0', args.port)
+    start_smtp(sink, '0.0.0.0', args.smtp_port)
+    base_url = f"http://{args.advertise_host}:{args.port}"
+
+    env = dict(os.environ)
+    env.update({
+        'TZ': 'UTC',
+        'PYTHONUNBUFFERED': '1',
+        'INTERVAL_TIME': str(args.interval),
+        'POSTGRES_HOST': args.db_host,
+        'PORT_WEB_BASE_URL': f"{base_url}/khbweb",
+        'LINE_NOTIFY_URL': f"{base_url}/api/notify",
+        'LINE_NOTIFY_TOKEN': 'sim-test-group',
+        'CHANNEL_TIMEOUT': str(args.channel_timeout),
+        'CIRCUIT_BREAKER_STATE_FILE': os.path.join(tempfile.mkdtemp(prefix='portcdm-loadtest-'), 'circuit_breakers.json'),
+    })
+    for i, suffix in enumerate(STAKEHOLDER_ENV_SUFFIXES):
+        env[f'LINE_NOTIFY_TOKEN_{suffix}'] = f"sim-{suffix.lower()}"
+        env[f'EMAIL_TO_{suffix}'] = f"{suffix.lower()}@sim.local"
+        env[f'SMS_TO_{suffix}'] = f"+886900{i:06d}"
+    if 'webhook' in extra_channels:
+        env['WEBHOOK_URL'] = f"{base_url}/api/webhook"
+    if 'email' in extra_channels:
+        env.update({'SMTP_HOST': args.advertise_host, 'SMTP_PORT': str(args.smtp_port)})
+    if 'sms' in extra_channels:
+        env['SMS_GATEWAY_URL'] = f"{base_url}/api/sms"
+
+    print(f"{args.ships} ships, {args.event_rate} events/s, {args.interval}s interval, running for {args.duration:.0f}s")
+    started = time.time()
+    stop = threading.Event()
+    crawler_durations: List[float] = []
+    notifier_durations: List[float] = []
+    workers = [
+        threading.Thread(target=run_periodically, args=('crawler', shlex.split(args.crawler_cmd), str(ROOT / 'crawler'),
+                                                        env, args.interval, stop, crawler_durations)),
+        threading.Thread(target=run_periodically, args=('notifier', shlex.split(args.notifier_cmd), str(ROOT / 'notifier'),
+                                                        env, args.interval, stop, notifier_durations)),
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while time.time() - started < args.duration:
+            time.sleep(min(30.0, args.duration))
+            values, emitted, messages = latencies(traffic, sink, started)
+            print(f"[{time.time() - started:6.0f}s] events {emitted}, alerted {len(values)}, messages {messages}, "
+                  f"p50 {percentile(values, 50):.1f}s, p99 {percentile(values, 99):.1f}s")
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+    values, emitted, messages = latencies(traffic, sink, started)
+    print()
+    print(f"events emitted      {emitted}")
+    print(f"events alerted      {len(values)} ({len(values) / max(emitted, 1):.0%})")
+    print(f"messages delivered  {messages}")
+    for p in (50, 90, 99):
+        print(f"latency p{p:<2}         {percentile(values, p):.1f}s")
+    print(f"latency max         {max(values, default=float('nan')):.1f}s")
+    for channel in CHANNELS:
+        if channel == 'line' or channel in extra_channels:
+            values, _, messages = latencies(traffic, sink, started, channel)
+            print(f"{channel:<9} messages  {messages}, p50 {percentile(values, 50):.1f}s, p99 {percentile(values, 99):.1f}s")
+    for name, durations in (('crawler', crawler_durations), ('notifier', notifier_durations)):
+        if durations:
+            print(f"{name:<9} cycles    {len(durations)}, mean {sum(durations) / len(durations):.1f}s, max {max(durations):.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+import argparse
+import json
+import socketserver
+import threading
+import time
+from email import message_from_bytes, policy
+from datetime import datetime
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from simulator.traffic import PortTraffic, SimVoyage
+
+STAGE_COLUMNS = ["進港申請", "移泊申請", "出港申請", "港外船舶進港", "錨泊中", "進港作業中", "裝卸須知",
+                 "移泊作業中", "移泊裝卸作業", "出港作業中", "船舶已出港"]
+BERTH_ORDER_HEADERS = ["船席", "靠泊時間", "動態", "引水時間", "中文船名", "英文船名", "港代理"]
+
+
+def roc_time(dt: Optional[datetime], seconds: bool = False) -> str:
+    if dt is None:
+        return ""
+    return f"{dt.year - 1911}/{dt.month:02d}/{dt.day:02d} " + dt.strftime("%H:%M:%S" if seconds else "%H:%M")
+
+
+def event_time(dt: datetime) -> str:
+    period = "上午" if dt.hour < 12 else "下午"
+    return f"{dt:%Y/%m/%d} {period} {dt.hour % 12 or 12:02d}:{dt:%M:%S}"
+
+
+def _page(body: str) -> bytes:
+    return f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"></head><body>{body}</body></html>".encode("utf-8")
+
+
+def _cell(cell_id: str, content: str) -> str:
+    return f'<td id="{cell_id}">{content}</td>'
+
+
+def _stages(voyage: SimVoyage) -> List[bool]:
+    berthed = voyage.has("實際靠妥時間")
+    departed = voyage.has("離開泊地時間")
+    outbound_pilot = voyage.has("引水人上船時間", "出港")
+    return [
+        voyage.has("進港預報申請"),
+        False,
+        voyage.has("出港預報申請"),
+        voyage.has("通過10浬時間") and not voyage.has("引水人上船時間", "進港"),
+        voyage.has("通過5浬時間") and not voyage.has("引水人上船時間", "進港"),
+        voyage.has("引水人上船時間", "進港") and not berthed,
+        berthed and not outbound_pilot,
+        False,
+        False,
+        outbound_pilot and not departed,
+        departed,
+    ]
+
+
+def render_status_grid(traffic: PortTraffic) -> bytes:
+    """
+    UA1007: the ship status grid, on a single page (no pager).
+    """
+    prefix = "ASPx_船舶即時動態_tccell"
+    rows = []
+    for i, voyage in enumerate(traffic.voyages):
+        latest = voyage.events[-1].name if voyage.events else ""
+        cells = [voyage.voyage_number, escape(voyage.ship_name), escape(latest)]
+        cells += ['<img src="ok.png">' if flag else "" for flag in _stages(voyage)]
+        rows.append("<tr>" + "".join(_cell(f"{prefix}{i}_{n}", c) for n, c in enumerate(cells)) + "</tr>")
+    return _page(f'<table id="ASPx_船舶即時動態">{"".join(rows)}</table>')
+
+
+def render_events(voyage: Optional[SimVoyage]) -> bytes:
+    """
+    UA3007: the events of one voyage, latest first.
+    """
+    prefix = "ASPx_船舶事件_tccell"
+    rows = []
+    for i, event in enumerate(reversed(voyage.events if voyage else [])):
+        cells = [event.source, event_time(event.time), event.name, event.navigation_status,
+                 event.pilot_order_number, event.berth_number, roc_time(event.content_time)]
+        rows.append("<tr>" + "".join(_cell(f"{prefix}{i}_{n}", escape(c)) for n, c in enumerate(cells)) + "</tr>")
+    return _page(f'<table id="ASPx_船舶事件">{"".join(rows)}</table>')
+
+
+def render_miles(voyage: Optional[SimVoyage]) -> bytes:
+    """
+    UA5007: the 10 and 5 nautical miles passage times of one voyage.
+    """
+    if voyage is None:
+        return _page("")
+    prefix = "ASPx_港外船舶進港_tccell0_"
+    cells = [voyage.voyage_number, escape(voyage.ship_name),
+             roc_time(voyage.pass_10, seconds=True), roc_time(voyage.pass_5, seconds=True)]
+    return _page("<table><tr>" + "".join(_cell(f"{prefix}{n}", c) for n, c in enumerate(cells)) + "</tr></table>")
+
+
+def render_berth_order(traffic: PortTraffic) -> bytes:
+    """
+    oh015: the berth order DevExpress grid.
+    """
+    queued = [v for v in traffic.voyages if v.has("新增引水申請", "進港") and not v.has("離開泊地時間")]
+    queued.sort(key=lambda v: (v.berth, v.pilotage_time or datetime.max))
+    headers = "".join(f'<td class="dxgvHeader_PlasticBlue"><table><tr><td>{h}</td></tr></table></td>'
+                      for h in BERTH_ORDER_HEADERS)
+    rows = []
+    for i, voyage in enumerate(queued):
+        cells = [voyage.berth, roc_time(voyage.berthing_time) or "待接靠",
+                 "出港" if voyage.has("新增引水申請", "出港") else "進港", roc_time(voyage.pilotage_time),
+                 voyage.ship_name_chinese, voyage.ship_name_english, voyage.port_agent]
+        row_class = "dxgvDataRow_PlasticBlue" + (" dxgvDataRowAlt_PlasticBlue" if i % 2 else "")
+        rows.append(f'<tr class="{row_class}">' + "".join(f'<td class="dxgv">{escape(c)}</td>' for c in cells) + "</tr>")
+    return _page(f'<table class="dxgvControl_PlasticBlue"><tr>{headers}</tr>{"".join(rows)}</table>')
+
+
+class AlertSink:
+    """
+    Collects the messages the notifier dispatches, as (received at, channel, recipient, message).
+
+    `delays` holds seconds to wait before answering, `failing` the channels that answer
+    with a server error, and `rejected` the recipients (LINE tokens, phone numbers, mail
+    addresses) refused as invalid, to exercise the notifier's timeouts and circuit breakers.
+    """
+
+    def __init__(self, delays: Optional[Dict[str, float]] = None, failing: Tuple[str, ...] = (),
+                 rejected: Tuple[str, ...] = ()):
+        self.lock = threading.Lock()
+        self.deliveries: List[Tuple[float, str, str, str]] = []
+        self.delays = delays or {}
+        self.failing = set(failing)
+        self.rejected = set(rejected)
+
+    def accept(self, channel: str) -> bool:
+        """
+        Applies the configured fault for the channel, returns whether to accept the message.
+        """
+        time.sleep(self.delays.get(channel, 0))
+        return channel not in self.failing
+
+    def record(self, channel: str, recipient: str, message: str) -> None:
+        with self.lock:
+            self.deliveries.append((time.time(), channel, recipient, message))
+
+
+def make_handler(traffic: PortTraffic, sink: AlertSink):
+    class SimulatorHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            page = url.path.rsplit('/', 1)[-1]
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+            with traffic.lock:
+                voyage = traffic.find(query.get('SP_ID', ''), query.get('SP_SERIAL', ''))
+                if page == 'UA1007.aspx':
+                    body = render_status_grid(traffic)
+                elif page == 'UA3007.aspx':
+                    body = render_events(voyage)
+                elif page == 'UA5007.aspx':
+                    body = render_miles(voyage)
+                elif page == 'oh015.aspx':
+                    body = render_berth_order(traffic)
+                else:
+                    body = None
+            self._send(200 if body else 404, body or b'', 'text/html; charset=utf-8')
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length).decode('utf-8')
+            path = urlsplit(self.path).path
+            channel = {'/api/notify': 'line', '/api/webhook': 'webhook', '/api/sms': 'sms'}.get(path)
+            if channel is None:
+                self._send(404, b'', 'text/plain')
+                return
+            if channel == 'line':
+                # LINE Notify: form encoded message, the token identifies the recipient
+                recipient = self.headers.get('Authorization', '').replace('Bearer ', '')
+                message = parse_qs(body).get('message', [''])[0]
+            elif channel == 'webhook':
+                payload = json.loads(body)
+                recipient, message = payload.get('stakeholder') or '', payload.get('text', '')
+            else:
+                payload = json.loads(body)
+                recipient, message = payload.get('to', ''), payload.get('text', '')
+
+            if not sink.accept(channel):
+                self._send(503, b'{"status":503,"message":"unavailable"}', 'application/json')
+                return
+            if recipient in sink.rejected:
+                # As LINE Notify answers a revoked token
+                self._send(401, b'{"status":401,"message":"Invalid access token"}', 'application/json')
+                return
+            sink.record(channel, recipient, message)
+            self._send(200, b'{"status":200,"message":"ok"}', 'application/json')
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SimulatorHandler
+
+
+def make_smtp_handler(sink: AlertSink):
+    class SmtpHandler(socketserver.StreamRequestHandler):
+        """
+        Just enough of SMTP for smtplib: every mail is recorded once per recipient.
+        """
+
+        def reply(self, line: str) -> None:
+            self.wfile.write(f"{line}\r\n".encode('utf-8'))
+
+        def handle(self):
+            recipients: List[str] = []
+            self.reply('220 simulator ESMTP')
+            for raw in self.rfile:
+                command = raw.decode('utf-8', 'replace').strip()
+                verb = command[:4].upper()
+                if verb in ('HELO', 'EHLO'):
+                    self.reply('250 simulator')
+                elif verb == 'MAIL':
+                    recipients = []
+                    self.reply('250 OK')
+                elif verb == 'RCPT':
+                    recipient = command.split(':', 1)[1].strip().strip('<>')
+                    if recipient in sink.rejected:
+                        self.reply('550 No such user')
+                    else:
+                        recipients.append(recipient)
+                        self.reply('250 OK')
+                elif verb == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    lines = []
+                    for data in self.rfile:
+                        if data in (b'.\r\n', b'.\n'):
+                            break
+                        lines.append(data[1:] if data.startswith(b'..') else data)
+                    if sink.accept('email'):
+                        mail = message_from_bytes(b''.join(lines), policy=policy.default)
+                        text = mail.get_body(('plain',)).get_content()
+                        for recipient in recipients:
+                            sink.record('email', recipient, text)
+                        self.reply('250 OK')
+                    else:
+                        self.reply('451 Relay unavailable')
+                elif verb == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('250 OK')
+
+    return SmtpHandler
+
+
+def start_smtp(sink: AlertSink, host: str, port: int) -> socketserver.ThreadingTCPServer:
+    """
+    Serves a fake SMTP relay that records the mails in the sink, from a background thread.
+    """
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer((host, port), make_smtp_handler(sink))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start(traffic: PortTraffic, sink: AlertSink, host: str, port: int) -> ThreadingHTTPServer:
+    """
+    Serves the simulated port website and the LINE Notify, webhook and SMS gateway sinks,
+    and advances the traffic, all from background threads.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(traffic, sink))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def ticker():
+        while True:
+            traffic.tick()
+            time.sleep(0.1)
+    threading.Thread(target=ticker, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves a simulated port website for the crawler.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--ships', type=int, default=200)
+    parser.add_argument('--event-rate', type=float, default=1.0, help="events per second over the whole port")
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    traffic = PortTraffic(args.ships, args.event_rate, seed=args.seed)
+    sink = AlertSink()
+    start(traffic, sink, args.host, args.port)
+    start_smtp(sink, args.host, args.smtp_port)
+    print(f"Simulated port at http://{args.host}:{args.port}/khbweb/ ({args.ships} ships, {args.event_rate} events/s)")
+    print(f"SMTP relay at {args.host}:{args.smtp_port}")
+    while True:
+        time.sleep(3600)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import importlib.util
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _load_notifier_config():
+    spec = importlib.util.spec_from_file_location('notifier_config', ROOT / 'notifier' / 'config.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+notifier_config = _load_notifier_config()
+
+# A voyage goes through these events in order, (event name, navigation status)
+INBOUND = [
+    ("進港預報申請", "進港"), ("修改進港預報", "進港"), ("海巡署審核", "進港"), ("移民署審核", "進港"),
+    ("新增引水申請", "進港"), ("船長報告ETA", "進港"), ("申請進港", "進港"), ("更新引水時間", "進港"),
+    ("引水人排班", "進港"), ("通過10浬時間", "進港"), ("通過5浬時間", "進港"), ("引水人出發", "進港"),
+    ("引水人上船時間", "進港"), ("經過信號台 (進港)", "進港"), ("實際靠妥時間", "進港"),
+]
+OUTBOUND = [
+    ("出港預報申請", "出港"), ("修改出港預報", "出港"), ("海巡署審核", "出港"), ("移民署審核", "出港"),
+    ("新增引水申請", "出港"), ("更新引水時間", "出港"), ("引水人排班", "出港"), ("引水人出發", "出港"),
+    ("引水人上船時間", "出港"), ("離開泊地時間", "出港"),
+]
+# Reported on UA5007 and turned into events by the notifier, not listed on UA3007
+PASSAGE_EVENTS = {"通過10浬時間": "pass_10", "通過5浬時間": "pass_5"}
+
+
+def display_name(name: str, navigation_status: str) -> str:
+    """
+    The event name as the notifier shows it (and keys `notification_mapping`).
+    """
+    if name in notifier_config.INOUT_PILOTAGE_EVENTS:
+        return f"{name} ({navigation_status})"
+    return name
+
+LIFECYCLE = [step for step in INBOUND + OUTBOUND if display_name(*step) in notifier_config.notification_mapping]
+
+SHIP_NAMES = [("長明", "EVER BRIGHT"), ("永明", "YM WELLNESS"), ("文明", "YM CIVIL"), ("好明", "YM GOODNESS"),
+              ("吉春", "ALS JUNO"), ("海安", "SEA PEACE"), ("萬春", "WAN HAI SPRING"), ("台中", "TAICHUNG STAR")]
+PORT_AGENTS = ["陽明海運股份有限公司", "萬海航運公司", "長榮海運股份有限公司", "東方海外"]
+BERTHS = ["1042", "1043", "1120", "1121", "1070", "1075", "1108", "1115"]
+EVENT_SOURCES = ["港務資訊系統", "VTS轉檔", "引水人系統"]
+
+
+class SimEvent:
+    __slots__ = ('name', 'navigation_status', 'source', 'time', 'content_time', 'pilot_order_number', 'berth_number')
+
+    def __init__(self, name, navigation_status, source, time, content_time, pilot_order_number, berth_number):
+        self.name = name
+        self.navigation_status = navigation_status
+        self.source = source
+        self.time = time
+        self.content_time = content_time
+        self.pilot_order_number = pilot_order_number
+        self.berth_number = berth_number
+
+
+class SimVoyage:
+    __slots__ = ('ship_id', 'voyage', 'ship_name_chinese', 'ship_name_english', 'port_agent', 'berth',
+                 'step', 'events', 'pass_10', 'pass_5', 'pilotage_time', 'berthing_time', 'eta', 'etd')
+
+    def __init__(self, ship_id: str, voyage: str, names: Tuple[str, str], port_agent: str, berth: str):
+        self.ship_id = ship_id
+        self.voyage = voyage
+        self.ship_name_chinese, self.ship_name_english = names
+        self.port_agent = port_agent
+        self.berth = berth
+        self.step = 0
+        self.events: List[SimEvent] = []
+        self.pass_10: Optional[datetime] = None
+        self.pass_5: Optional[datetime] = None
+        self.pilotage_time: Optional[datetime] = None
+        self.berthing_time: Optional[datetime] = None
+        self.eta: Optional[datetime] = None
+        self.etd: Optional[datetime] = None
+
+    @property
+    def voyage_number(self) -> str:
+        return self.ship_id + self.voyage
+
+    @property
+    def ship_name(self) -> str:
+        # The status grid shows both names, the berth order grid shows them separately
+        return self.ship_name_chinese + self.ship_name_english
+
+    @property
+    def done(self) -> bool:
+        return self.step >= len(LIFECYCLE)
+
+    def has(self, name: str, navigation_status: Optional[str] = None) -> bool:
+        return any(e.name == name and navigation_status in (None, e.navigation_status) for e in self.events) \
+            or (name in PASSAGE_EVENTS and getattr(self, PASSAGE_EVENTS[name]) is not None)
+
+
+class PortTraffic:
+    """
+    A simulated port whose voyages advance through their lifecycle in real time.
+
+    `event_rate` events per second are spread over the active voyages. A voyage that
+    left the port is replaced by a new one, so `ships` voyages are always listed.
+    Every emitted event is recorded with its wall-clock time, keyed like the
+    notifier's messages, to measure end-to-end alert latency.
+    """
+
+    def __init__(self, ships: int, event_rate: float, reshuffle_rate: float = 0.02, seed: Optional[int] = None):
+        self.event_rate = event_rate
+        self.reshuffle_rate = reshuffle_rate
+        self.lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._serial = 0
+        self._pending = 0.0
+        self._last_tick = time.time()
+        # (船編, 航次, 最新事件) -> wall-clock time the event became visible
+        self.emitted: Dict[Tuple[str, str, str], float] = {}
+        self.voyages: List[SimVoyage] = []
+        # Voyages that left the port stay queryable, like on the real site
+        self._index: Dict[Tuple[str, str], SimVoyage] = {}
+        for _ in range(ships):
+            voyage = self._new_voyage()
+            # Start the fleet spread over the whole lifecycle
+            for _ in range(self._random.randrange(len(LIFECYCLE))):
+                self._advance(voyage, record=False)
+            self.voyages.append(voyage)
+
+    @staticmethod
+    def now() -> datetime:
+        # The port website shows Taiwan time
+        return datetime.utcnow() + timedelta(hours=8)
+
+    def _new_voyage(self) -> SimVoyage:
+        self._serial += 1
+        chinese, english = self._random.choice(SHIP_NAMES)
+        voyage = SimVoyage(
+            ship_id=f"{100000 + self._serial % 900000:06d}",
+            voyage=f"{self._serial % 10000:04d}",
+            names=(f"{chinese}{self._serial}號", f"{english} {self._serial}"),
+            port_agent=self._random.choice(PORT_AGENTS),
+            berth=self._random.choice(BERTHS),
+        )
+        self._index[(voyage.ship_id, voyage.voyage)] = voyage
+        return voyage
+
+    def tick(self) -> None:
+        """
+        Emits the events due since the previous tick.
+        """
+        with self.lock:
+            now = time.time()
+            self._pending += (now - self._last_tick) * self.event_rate
+            self._last_tick = now
+            while self._pending >= 1:
+                self._pending -= 1
+                index = self._random.randrange(len(self.voyages))
+                voyage = self.voyages[index]
+                if voyage.done:
+                    voyage = self.voyages[index] = self._new_voyage()
+                if self._random.random() < self.reshuffle_rate:
+                    self._reshuffle()
+                else:
+                    self._advance(voyage)
+
+    def _record(self, voyage: SimVoyage, name: str) -> None:
+        self.emitted.setdefault((voyage.ship_id, voyage.voyage, name), time.time())
+
+    def _advance(self, voyage: SimVoyage, record: bool = True) -> None:
+        name, navigation_status = LIFECYCLE[voyage.step]
+        voyage.step += 1
+        now = self.now()
+
+        content_time = None
+        if name in PASSAGE_EVENTS:
+            setattr(voyage, PASSAGE_EVENTS[name], now)
+        else:
+            if name in ("修改進港預報", "船長報告ETA"):
+                voyage.eta = now + timedelta(hours=self._random.randint(2, 24))
+                content_time = voyage.eta
+            elif name == "修改出港預報":
+                voyage.etd = now + timedelta(hours=self._random.randint(6, 48))
+                content_time = voyage.etd
+            elif name in ("新增引水申請", "更新引水時間"):
+                voyage.pilotage_time = now + timedelta(minutes=self._random.randint(30, 240))
+                content_time = voyage.pilotage_time
+            elif name == "實際靠妥時間":
+                voyage.berthing_time = now
+                content_time = now
+            voyage.events.append(SimEvent(
+                name, navigation_status, self._random.choice(EVENT_SOURCES), now, content_time,
+                f"{self._serial:04d}{voyage.step:04d}", voyage.berth,
+            ))
+        if record:
+            self._record(voyage, display_name(name, navigation_status))
+
+    def _reshuffle(self) -> None:
+        """
+        Moves a ship waiting for its berth to another berth.
+        """
+        waiting = [v for v in self.voyages if v.has("新增引水申請", "進港") and not v.has("實際靠妥時間")]
+        if not waiting:
+            return
+        voyage = self._random.choice(waiting)
+        voyage.berth = self._random.choice([b for b in BERTHS if b != voyage.berth])
+        now = self.now()
+        voyage.pilotage_time = now + timedelta(minutes=self._random.randint(30, 240))
+        voyage.events.append(SimEvent("船席異動", "進港", EVENT_SOURCES[0], now, None,
+                                      f"{self._serial:04d}{voyage.step:04d}", voyage.berth))
+        self._record(voyage, "船席異動")
+
+    def find(self, ship_id: str, voyage: str) -> Optional[SimVoyage]:
+        return self._index.get((ship_id, voyage))
@@ -0,0 +1,11 @@
+-- Brings a database created by an earlier init_db.sql up to date. Safe to run again.
+
+-- ship_events.updated_at, read by the API to pick up events updated in place
+ALTER TABLE ship_events ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+CREATE INDEX IF NOT EXISTS ship_events_updated_at_idx ON ship_events (updated_at);
+
+DROP TRIGGER IF EXISTS update_ship_events_timestamp ON ship_events;
+CREATE TRIGGER update_ship_events_timestamp
+BEFORE UPDATE ON ship_events
+FOR EACH ROW
+EXECUTE FUNCTION update_timestamp();